@@ -0,0 +1,153 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Calibrate llama.cpp thread and batch settings for a GGUF model on the current host."""
+
+import hashlib
+import json
+import os
+import socket
+import time
+from datetime import datetime
+
+DEFAULT_TUNING_PATH = os.path.expanduser("~/.ayx/llm_connect_autotune.json")
+DEFAULT_CALIBRATION_PROMPT_TOKENS = 512
+DEFAULT_CALIBRATION_DECODE_TOKENS = 32
+# Bytes hashed at each end of the model file; hashing whole multi-GB files would take longer than the calibration.
+FINGERPRINT_CHUNK_SIZE = 16 * 1024 * 1024
+
+BATCH_CANDIDATES = [(512, 512), (1024, 512), (2048, 512), (2048, 1024), (256, 256)]
+DEFAULT_BATCH = (512, 512)
+
+
+def model_fingerprint(model_path):
+    """Hash the size, the header and the tail of a model file."""
+    digest = hashlib.sha256()
+    size = os.path.getsize(model_path)
+    digest.update(str(size).encode())
+    with open(model_path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_CHUNK_SIZE))
+        f.seek(max(0, size - FINGERPRINT_CHUNK_SIZE))
+        digest.update(f.read(FINGERPRINT_CHUNK_SIZE))
+    return digest.hexdigest()[:32]
+
+
+def tuning_key(model_path, n_gpu_layers=0):
+    """Key of a tuned configuration: the host, the model file hash and the GPU offload it was measured with."""
+    return f"{socket.gethostname()}|{model_fingerprint(model_path)}|gpu_layers={n_gpu_layers}"
+
+
+def load_tuning(key, path=DEFAULT_TUNING_PATH):
+    """Return the saved settings for a key, or None."""
+    try:
+        with open(path) as f:
+            return json.load(f).get(key, {}).get("settings")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_tuning(key, settings, measurements, path=DEFAULT_TUNING_PATH):
+    """Store the best settings for a key, keeping the entries of other hosts and models."""
+    try:
+        with open(path) as f:
+            tunings = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        tunings = {}
+    tunings[key] = {
+        "settings": settings,
+        "measurements": measurements,
+        "tuned_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(tunings, f, indent=2)
+
+
+def thread_candidates(max_threads):
+    """Thread counts to try: powers of two up to the available CPUs, and the CPU count itself."""
+    candidates = {max_threads}
+    threads = 1
+    while threads < max_threads:
+        if threads >= max(1, max_threads // 8):
+            candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+
+def measure(llama_class, llama_kwargs, settings, prompt_tokens, decode_tokens):
+    """Load the model with the given settings and return prefill and decode speeds in tokens/sec."""
+    llama = llama_class(**dict(llama_kwargs, **settings))
+    try:
+        token = llama.tokenize(b" the", add_bos=False)[0]
+        prompt = [llama.token_bos()] + [token] * (prompt_tokens - 1)
+
+        start = time.perf_counter()
+        llama.eval(prompt)
+        prefill_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(decode_tokens):
+            llama.eval([token])
+        decode_seconds = time.perf_counter() - start
+    finally:
+        llama.close()
+    return {
+        "prefill_tokens_per_sec": prompt_tokens / prefill_seconds,
+        "decode_tokens_per_sec": decode_tokens / decode_seconds,
+    }
+
+
+def workload_seconds(measurement, prompt_tokens, decode_tokens):
+    """Estimated time of one row with the calibrated prompt and response lengths."""
+    return prompt_tokens / measurement["prefill_tokens_per_sec"] + decode_tokens / measurement["decode_tokens_per_sec"]
+
+
+def autotune(llama_class, llama_kwargs, max_threads, prompt_tokens=DEFAULT_CALIBRATION_PROMPT_TOKENS,
+             decode_tokens=DEFAULT_CALIBRATION_DECODE_TOKENS, on_progress=None):
+    """Sweep thread counts, then batch sizes with the best thread count, and return the fastest settings.
+
+    Returns `(settings, measurements)` where settings holds `n_threads`, `n_threads_batch`,
+    `n_batch` and `n_ubatch`.
+    """
+    # The calibration prompt and the decoded tokens must fit in the context window
+    prompt_tokens = max(8, min(prompt_tokens, llama_kwargs.get("n_ctx", 512) - decode_tokens - 1))
+    measurements = []
+
+    def run(settings):
+        result = measure(llama_class, llama_kwargs, settings, prompt_tokens, decode_tokens)
+        measurements.append(dict(settings, **result))
+        if on_progress:
+            on_progress(
+                f"Auto-tune {settings}: prefill {result['prefill_tokens_per_sec']:.1f} tok/s, "
+                f"decode {result['decode_tokens_per_sec']:.1f} tok/s"
+            )
+        return workload_seconds(result, prompt_tokens, decode_tokens)
+
+    n_batch, n_ubatch = DEFAULT_BATCH
+    best = None
+    for threads in thread_candidates(max_threads):
+        settings = {"n_threads": threads, "n_threads_batch": threads, "n_batch": n_batch, "n_ubatch": n_ubatch}
+        seconds = run(settings)
+        if best is None or seconds < best[0]:
+            best = (seconds, settings)
+
+    threads = best[1]["n_threads"]
+    for n_batch, n_ubatch in BATCH_CANDIDATES:
+        if (n_batch, n_ubatch) == DEFAULT_BATCH:
+            continue
+        settings = {"n_threads": threads, "n_threads_batch": threads, "n_batch": n_batch, "n_ubatch": n_ubatch}
+        seconds = run(settings)
+        if seconds < best[0]:
+            best = (seconds, settings)
+    return best[1], measurements
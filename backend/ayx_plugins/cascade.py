@@ -0,0 +1,124 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cascade routing: answer with the cheapest model tier whose response passes validation."""
+
+import json
+import math
+import re
+
+# Tier name standing for the GGUF model loaded for local inference.
+LOCAL_CASCADE_TIER = "local"
+DEFAULT_REFUSAL_PATTERN = (
+    r"\b(I('m| am) (sorry|unable|not able)|I can(no|')t (help|assist|provide|answer)|"
+    r"as an AI( language model)?|I do not have (access|enough information))\b"
+)
+
+JSON_INVALID = "json_invalid"
+REFUSAL = "refusal"
+REGEX_MISS = "regex_miss"
+LOW_CONFIDENCE = "low_confidence"
+ERROR = "error"
+
+
+def parse_cascade_models(text):
+    """Split the ordered tier list, given comma or newline separated, cheapest first."""
+    return [model.strip() for model in re.split(r"[,\n]", text or "") if model.strip()]
+
+
+def token_logprobs(logprobs):
+    """Return the sampled token log probabilities of a chat completion choice, from a dict or a response object."""
+    if logprobs is None:
+        return []
+    content = logprobs.get("content") if isinstance(logprobs, dict) else getattr(logprobs, "content", None)
+    return [item["logprob"] if isinstance(item, dict) else item.logprob for item in content or []]
+
+
+def response_confidence(logprobs):
+    """Geometric mean probability of the sampled tokens, or None without log probabilities."""
+    values = [value for value in token_logprobs(logprobs) if value is not None]
+    if not values:
+        return None
+    return math.exp(sum(values) / len(values))
+
+
+class CascadeValidator:
+    """Decide whether a tier's response is good enough or the row escalates to the next tier."""
+
+    def __init__(self, require_json=False, pattern=None, min_confidence=None, refusal_pattern=DEFAULT_REFUSAL_PATTERN):
+        self.require_json = require_json
+        self.pattern = re.compile(pattern) if pattern else None
+        self.min_confidence = min_confidence
+        self.refusal_pattern = re.compile(refusal_pattern, re.IGNORECASE) if refusal_pattern else None
+
+    def check(self, text, logprobs=None):
+        """Return the reason to escalate, or None when the response is accepted.
+
+        A response without log probabilities passes the confidence check.
+        """
+        if text is None or not text.strip():
+            return ERROR
+        if self.require_json:
+            try:
+                json.loads(text)
+            except json.JSONDecodeError:
+                return JSON_INVALID
+        if self.refusal_pattern and self.refusal_pattern.search(text):
+            return REFUSAL
+        if self.pattern and not self.pattern.search(text):
+            return REGEX_MISS
+        if self.min_confidence is not None:
+            confidence = response_confidence(logprobs)
+            if confidence is not None and confidence < self.min_confidence:
+                return LOW_CONFIDENCE
+        return None
+
+
+class CascadeStats:
+    """Per-tier answered rows, escalations by reason and cost, against sending every row to the last tier."""
+
+    def __init__(self, tiers):
+        self.tiers = tiers
+        self.answered = {tier: 0 for tier in tiers}
+        self.escalations = {tier: {} for tier in tiers}
+        self.cost = {tier: 0.0 for tier in tiers}
+        self.baseline_cost = 0.0
+
+    def record_attempt(self, tier, cost, reason=None):
+        self.cost[tier] += cost
+        if reason is None:
+            self.answered[tier] += 1
+        else:
+            self.escalations[tier][reason] = self.escalations[tier].get(reason, 0) + 1
+
+    def savings(self):
+        return self.baseline_cost - sum(self.cost.values())
+
+    def summary(self):
+        """Report lines: hit rate of each tier and the estimated savings."""
+        rows = sum(self.answered.values())
+        lines = []
+        for tier in self.tiers:
+            attempts = self.answered[tier] + sum(self.escalations[tier].values())
+            hit_rate = 100.0 * self.answered[tier] / attempts if attempts else 0.0
+            reasons = ", ".join(f"{reason} {count}" for reason, count in sorted(self.escalations[tier].items()))
+            lines.append(
+                f"Cascade tier {tier}: answered {self.answered[tier]} of {attempts} rows ({hit_rate:.1f}%), "
+                f"cost ${self.cost[tier]:.4f}" + (f", escalated: {reasons}" if reasons else "")
+            )
+        lines.append(
+            f"Cascade savings: ${self.savings():.4f} for {rows} rows "
+            f"(${self.baseline_cost:.4f} estimated with {self.tiers[-1]} only)"
+        )
+        return lines
@@ -0,0 +1,89 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Split prompts longer than the context window into overlapping chunks and combine the answers."""
+
+DEFAULT_CHUNK_TOKENS = 4096
+DEFAULT_CHUNK_CONCURRENCY = 8
+# Tokens kept free for the chat template and the role markers around each message.
+CHAT_TEMPLATE_OVERHEAD_TOKENS = 64
+DEFAULT_REDUCE_PROMPT = (
+    "The following answers were produced for consecutive parts of one long input. "
+    "Combine them into a single answer.\n\n{responses}"
+)
+RESPONSE_SEPARATOR = "\n\n---\n\n"
+
+
+def chunk_spans(n_tokens, chunk_tokens, overlap_tokens=0):
+    """Return the `(start, end)` token spans of chunks of at most `chunk_tokens`, each overlapping the previous one."""
+    if chunk_tokens <= 0:
+        raise ValueError("chunk_tokens must be positive")
+    overlap_tokens = min(max(0, overlap_tokens), chunk_tokens // 2)
+    spans = []
+    start = 0
+    while True:
+        end = min(start + chunk_tokens, n_tokens)
+        spans.append((start, end))
+        if end >= n_tokens:
+            return spans
+        start = end - overlap_tokens
+
+
+def chunk_text(text, encode, decode, chunk_tokens, overlap_tokens=0):
+    """Split a text into token-bounded chunks, returning `[text]` when it already fits."""
+    tokens = encode(text)
+    if len(tokens) <= chunk_tokens:
+        return [text]
+    return [decode(tokens[start:end]) for start, end in chunk_spans(len(tokens), chunk_tokens, overlap_tokens)]
+
+
+def pack_responses(responses, count_tokens, budget):
+    """Group consecutive responses so the combined text of each group fits in `budget` tokens.
+
+    A response longer than the budget gets a group of its own.
+    """
+    separator_tokens = count_tokens(RESPONSE_SEPARATOR)
+    groups = []
+    group, group_tokens = [], 0
+    for response in responses:
+        tokens = count_tokens(response) + separator_tokens
+        if group and group_tokens + tokens > budget:
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(response)
+        group_tokens += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+def map_prompt(task, chunk):
+    """Put the task before a chunk, so every chunk carries the instruction and not only the first one."""
+    return f"{task}\n\n{chunk}" if task else chunk
+
+
+def reduce_prompt(template, responses, task=None):
+    """Fill the `{responses}` placeholder of the reduce prompt, or append the responses when it has none.
+
+    The task fills a `{task}` placeholder, or is stated before the prompt, so the answers are
+    combined into an answer to the original question.
+    """
+    joined = RESPONSE_SEPARATOR.join(responses)
+    if "{task}" in template:
+        template = template.replace("{task}", task or "")
+    elif task:
+        template = f"Task: {task}\n\n{template}"
+    if "{responses}" in template:
+        return template.replace("{responses}", joined)
+    return f"{template}\n\n{joined}"
@@ -0,0 +1,135 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Single-token classification: score a fixed set of labels from the log probabilities of the first answer token."""
+
+import math
+import re
+
+import numpy as np
+
+CLASSIFICATION_INSTRUCTION = "Classify the input. Answer with exactly one of these labels and nothing else: {labels}"
+# Most alternatives remote providers return for a token.
+MAX_TOP_LOGPROBS = 20
+# Bias pushing OpenAI models to start their answer with a label token.
+LABEL_LOGIT_BIAS = 100
+
+
+def parse_labels(text):
+    """Split the label list, given comma or newline separated."""
+    labels = []
+    for label in re.split(r"[,\n]", text or ""):
+        if label.strip() and label.strip() not in labels:
+            labels.append(label.strip())
+    return labels
+
+
+def probability_column(label):
+    return f"{label} probability"
+
+
+def with_instruction(messages, labels):
+    """Add the classification instruction to the system message, or as a new system message."""
+    instruction = CLASSIFICATION_INSTRUCTION.format(labels=", ".join(labels))
+    if messages and messages[0]["role"] == "system" and messages[0]["content"]:
+        return [{"role": "system", "content": f"{messages[0]['content']}\n\n{instruction}"}] + messages[1:]
+    return [{"role": "system", "content": instruction}] + [message for message in messages if message["role"] != "system"]
+
+
+def label_token_ids(labels, tokenize):
+    """Return the ids of the tokens each label can start with, with and without a leading space."""
+    return [sorted({tokens[0] for tokens in (tokenize(label), tokenize(" " + label)) if tokens}) for label in labels]
+
+
+def shared_first_tokens(label_ids):
+    """Return the labels, by position, whose first token is also the first token of another label."""
+    owners = {}
+    for position, ids in enumerate(label_ids):
+        for token_id in ids:
+            owners.setdefault(token_id, set()).add(position)
+    return sorted({position for positions in owners.values() if len(positions) > 1 for position in positions})
+
+
+def logsumexp(values):
+    values = [value for value in values if value is not None and value > -math.inf]
+    if not values:
+        return -math.inf
+    top = max(values)
+    return top + math.log(sum(math.exp(value - top) for value in values))
+
+
+def normalize(logprobs):
+    """Turn per-label log probabilities into probabilities summing to 1 over the labels, or None."""
+    logprobs = np.asarray(logprobs, dtype=np.float64)
+    if not np.isfinite(logprobs).any():
+        return None
+    weights = np.exp(logprobs - logprobs[np.isfinite(logprobs)].max())
+    return weights / weights.sum()
+
+
+def score_logits(logits, label_ids):
+    """Label probabilities from the next-token logits of a local model."""
+    top = float(np.max(logits))
+    log_total = top + math.log(float(np.exp(logits - top).sum()))
+    return normalize([logsumexp([float(logits[token_id]) - log_total for token_id in ids]) for ids in label_ids])
+
+
+def score_top_logprobs(top_logprobs, labels):
+    """Label probabilities from the alternatives a remote provider returned for the first answer token.
+
+    An alternative counts for every label starting with its text, case-insensitively.
+    """
+    scores = [[] for _ in labels]
+    for item in top_logprobs:
+        token = item["token"] if isinstance(item, dict) else item.token
+        logprob = item["logprob"] if isinstance(item, dict) else item.logprob
+        token = token.strip().lower()
+        if not token:
+            continue
+        for position, label in enumerate(labels):
+            if label.lower().startswith(token):
+                scores[position].append(logprob)
+    return normalize([logsumexp(values) for values in scores])
+
+
+def score_text(text, labels):
+    """Probability 1 for the label a response names, for providers that return no log probabilities."""
+    answer = (text or "").strip().strip(".\"'").lower()
+    matches = [position for position, label in enumerate(labels) if answer == label.lower()]
+    if not matches:
+        matches = [position for position, label in enumerate(labels) if answer.startswith(label.lower())]
+    if not matches:
+        return None
+    probabilities = np.zeros(len(labels))
+    probabilities[matches[0]] = 1.0
+    return probabilities
+
+
+def openai_label_bias(model, labels):
+    """Return a `logit_bias` restricting the first answer token of an OpenAI model to the labels, or None.
+
+    Token ids are those of the model tokenizer, so the bias is only built for OpenAI models
+    tiktoken knows.
+    """
+    try:
+        import litellm
+        import tiktoken
+
+        if litellm.get_llm_provider(model)[1] not in ("openai", "azure"):
+            return None
+        encoding = tiktoken.encoding_for_model(model.split("/")[-1])
+    except Exception:
+        return None
+    label_ids = label_token_ids(labels, encoding.encode_ordinary)
+    return {str(token_id): LABEL_LOGIT_BIAS for ids in label_ids for token_id in ids}
@@ -0,0 +1,94 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Adaptive request concurrency: additive increase while the provider keeps up, multiplicative decrease on overload."""
+
+import time
+from collections import namedtuple
+
+from .hedging import LatencyTracker
+
+DEFAULT_INITIAL_CONCURRENCY = 4
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_DECREASE_FACTOR = 0.5
+# A request slower than this multiple of the median latency is a latency spike.
+DEFAULT_SPIKE_RATIO = 2.0
+# Number of observed latencies needed before latency spikes are detected.
+MIN_SPIKE_SAMPLES = 10
+SPIKE_LATENCY_WINDOW = 100
+
+INCREASE = "increase"
+RATE_LIMITED = "rate limited"
+TIMED_OUT = "timeout"
+LATENCY_SPIKE = "latency spike"
+
+ConcurrencyChange = namedtuple("ConcurrencyChange", ["seconds", "limit", "reason"])
+
+
+class AIMDController:
+    """Number of requests allowed in flight, adapted to how the provider copes.
+
+    Each successful request at normal latency adds `1 / limit`, so the limit grows by one per
+    round of requests. A rate limit, a timeout or a request slower than `spike_ratio` times the
+    median latency multiplies the limit by `decrease_factor`. Requests sent before the last
+    decrease do not decrease it again: they were sent at the old level, and one overload
+    episode then costs a single cut. Every change of the whole limit is kept in `trace`.
+    """
+
+    def __init__(self, initial=DEFAULT_INITIAL_CONCURRENCY, min_limit=1, max_limit=DEFAULT_MAX_CONCURRENCY,
+                 decrease_factor=DEFAULT_DECREASE_FACTOR, spike_ratio=DEFAULT_SPIKE_RATIO, clock=time.monotonic):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.spike_ratio = spike_ratio
+        self.clock = clock
+        self.started = clock()
+        self.window = min(max(initial, min_limit), max_limit)
+        self.last_decrease = None
+        self.latencies = LatencyTracker(SPIKE_LATENCY_WINDOW)
+        self.trace = [ConcurrencyChange(0.0, self.limit, "start")]
+
+    @property
+    def limit(self):
+        return int(self.window)
+
+    def on_success(self, sent_at, latency):
+        """Record a successful request sent at `sent_at` (controller clock) that took `latency` seconds."""
+        median = self.latencies.percentile(50) if len(self.latencies.samples) >= MIN_SPIKE_SAMPLES else None
+        self.latencies.record(latency)
+        if median and latency > self.spike_ratio * median:
+            self.on_overload(sent_at, LATENCY_SPIKE)
+            return
+        self.change(min(self.max_limit, self.window + 1.0 / self.limit), INCREASE)
+
+    def on_overload(self, sent_at, reason):
+        """Cut the limit after a rate limit, timeout or latency spike of a request sent at `sent_at`."""
+        if self.last_decrease is not None and sent_at < self.last_decrease:
+            return
+        self.last_decrease = self.clock()
+        self.change(max(self.min_limit, self.window * self.decrease_factor), reason)
+
+    def change(self, window, reason):
+        previous = self.limit
+        self.window = window
+        if self.limit != previous:
+            self.trace.append(ConcurrencyChange(self.clock() - self.started, self.limit, reason))
+
+    def summary(self):
+        limits = [change.limit for change in self.trace]
+        decreases = sum(change.reason != INCREASE for change in self.trace[1:])
+        return f"Adaptive concurrency: {self.limit} requests in flight at the end (range {min(limits)}-{max(limits)}, {decreases} decreases)"
+
+    def trace_lines(self):
+        return [f"Concurrency {change.seconds:.1f}s: {change.limit} ({change.reason})" for change in self.trace]
@@ -0,0 +1,110 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Deadline-aware dispatch: run rows until a wall-clock cutoff and report the status of every row."""
+
+import asyncio
+import time
+
+STATUS_OK = "ok"
+STATUS_TIMEOUT = "timeout"
+STATUS_SKIPPED = "skipped"
+STATUS_ERROR = "error"
+DEFAULT_DEADLINE_CONCURRENCY = 8
+
+
+class RunDeadline:
+    """Wall-clock cutoff of the run, counted from its creation, and time limit of each row."""
+
+    def __init__(self, run_seconds=None, row_seconds=None, clock=time.monotonic):
+        self.clock = clock
+        self.cutoff = clock() + run_seconds if run_seconds else None
+        self.row_seconds = row_seconds
+
+    def remaining(self):
+        """Seconds left before the cutoff, or None without a run deadline."""
+        if self.cutoff is None:
+            return None
+        return max(0.0, self.cutoff - self.clock())
+
+    def expired(self):
+        return self.cutoff is not None and self.clock() >= self.cutoff
+
+    def row_timeout(self):
+        """Time a row may take: its own limit, shortened to what is left of the run."""
+        limits = [limit for limit in (self.row_seconds, self.remaining()) if limit is not None]
+        return min(limits) if limits else None
+
+    def under_pressure(self, pending_rows, mean_latency, concurrency):
+        """Whether the queued rows are not expected to finish before the cutoff at the observed latency."""
+        remaining = self.remaining()
+        if remaining is None or not mean_latency:
+            return False
+        return pending_rows * mean_latency / concurrency > remaining
+
+
+async def run_with_deadline(rows, process, deadline, concurrency=DEFAULT_DEADLINE_CONCURRENCY, lengths=None, controller=None):
+    """Await `process(row)` for every row, at most `concurrency` at a time, until the deadline.
+
+    Returns a `(status, result)` pair per row, in row order: the result for "ok", the exception
+    for "error", None for rows that timed out or were never started ("skipped"). Rows are sent in
+    order until the queued rows are not expected to finish in time; then the shortest `lengths`
+    go first, so more rows complete before the cutoff. Requests still running at the cutoff are
+    cancelled. With an adaptive concurrency `controller`, its current limit replaces `concurrency`.
+    """
+    outcomes = [(STATUS_SKIPPED, None)] * len(rows)
+    pending = list(range(len(rows)))
+    running = {}
+    latencies = []
+
+    async def run_row(position):
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(process(rows[position]), deadline.row_timeout())
+        except asyncio.TimeoutError:
+            outcomes[position] = (STATUS_TIMEOUT, None)
+            return
+        except Exception as e:
+            outcomes[position] = (STATUS_ERROR, e)
+            return
+        latencies.append(time.monotonic() - start)
+        outcomes[position] = (STATUS_OK, result)
+
+    def current_limit():
+        return controller.limit if controller else concurrency
+
+    def next_position():
+        mean_latency = sum(latencies) / len(latencies) if latencies else None
+        if lengths is not None and deadline.under_pressure(len(pending), mean_latency, current_limit()):
+            position = min(pending, key=lambda position: lengths[position])
+            pending.remove(position)
+            return position
+        return pending.pop(0)
+
+    while pending or running:
+        while pending and len(running) < current_limit() and not deadline.expired():
+            position = next_position()
+            running[asyncio.ensure_future(run_row(position))] = position
+        if not running:
+            break  # The deadline passed, the rows left are skipped
+        done, _ = await asyncio.wait(running, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            del running[task]
+        if deadline.expired():
+            for task, position in running.items():
+                task.cancel()
+                outcomes[position] = (STATUS_TIMEOUT, None)
+            await asyncio.gather(*running, return_exceptions=True)
+            running = {}
+    return outcomes
@@ -0,0 +1,59 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Batched text embeddings returned as Arrow fixed-size list vectors."""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+DEFAULT_EMBEDDING_BATCH_SIZE = 256
+
+
+def embed_texts(texts, embed_batch, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE, dimensions=None, on_batch_error=None):
+    """Embed a column of texts and return a `pa.FixedSizeListArray` of float32, one vector per text.
+
+    Distinct non-null texts are sent once, in batches of `batch_size`, to `embed_batch(texts)`,
+    which returns one vector per text. The vectors are written into a single contiguous float32
+    matrix. Null texts are null vectors, as are the texts of a failed batch when `on_batch_error`
+    is given; otherwise the error is raised. `dimensions` is only needed when no batch succeeds.
+    """
+    codes, uniques = pd.factorize(np.asarray(texts, dtype=object), use_na_sentinel=True)
+    matrix = np.zeros((len(uniques), dimensions or 0), dtype=np.float32)
+    embedded = np.zeros(len(uniques), dtype=bool)
+
+    for start in range(0, len(uniques), batch_size):
+        chunk = list(uniques[start:start + batch_size])
+        try:
+            vectors = embed_batch(chunk)
+        except Exception as e:
+            if on_batch_error is None:
+                raise
+            on_batch_error(e, chunk)
+            continue
+        if not embedded.any() and dimensions is None:
+            matrix = np.zeros((len(uniques), len(vectors[0])), dtype=np.float32)
+        matrix[start:start + len(chunk)] = vectors
+        embedded[start:start + len(chunk)] = True
+
+    # Gather the rows of duplicate texts from the distinct vectors
+    found = codes >= 0
+    rows = np.where(found, codes, 0)
+    if len(uniques):
+        values = matrix[rows]
+        mask = ~(found & embedded[rows])
+    else:
+        values = np.zeros((len(codes), matrix.shape[1]), dtype=np.float32)
+        mask = np.ones(len(codes), dtype=bool)
+    return pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), matrix.shape[1], mask=pa.array(mask))
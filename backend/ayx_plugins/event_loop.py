@@ -0,0 +1,49 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Background asyncio event loop used to run litellm coroutines from the plugin callbacks."""
+
+import asyncio
+import threading
+
+
+class BackgroundEventLoop:
+    """An asyncio event loop running forever on a daemon thread.
+
+    The SDK calls the plugin synchronously, so coroutines are submitted to this loop and the
+    caller blocks on the result. Keeping a single loop for the whole run lets litellm reuse its
+    async HTTP clients between rows.
+    """
+
+    def __init__(self, name="llm-connect-event-loop"):
+        """Create the loop and start its thread."""
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop and return its concurrent future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the loop and block until it returns."""
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        """Stop the loop and wait for its thread to exit."""
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
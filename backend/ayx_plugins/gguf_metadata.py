@@ -0,0 +1,238 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Read GGUF header metadata without loading the model weights."""
+
+import json
+import mmap
+import os
+import re
+import struct
+
+GGUF_MAGIC = b"GGUF"
+DEFAULT_INDEX_PATH = os.path.expanduser("~/.ayx/gguf_index.json")
+# Arrays longer than this (tokenizer vocabularies, merges) are skipped rather than stored.
+MAX_STORED_ARRAY_LENGTH = 64
+
+# GGUF metadata value types
+UINT8, INT8, UINT16, INT16, UINT32, INT32, FLOAT32, BOOL, STRING, ARRAY, UINT64, INT64, FLOAT64 = range(13)
+SCALAR_FORMATS = {
+    UINT8: "<B", INT8: "<b", UINT16: "<H", INT16: "<h", UINT32: "<I", INT32: "<i",
+    FLOAT32: "<f", BOOL: "<?", UINT64: "<Q", INT64: "<q", FLOAT64: "<d",
+}
+
+# ggml tensor type -> (elements per block, bytes per block)
+GGML_TYPE_SIZES = {
+    0: (1, 4), 1: (1, 2), 2: (32, 18), 3: (32, 20), 6: (32, 22), 7: (32, 24), 8: (32, 34), 9: (32, 36),
+    10: (256, 84), 11: (256, 110), 12: (256, 144), 13: (256, 176), 14: (256, 210), 15: (256, 292),
+    16: (256, 66), 17: (256, 74), 18: (256, 98), 19: (256, 50), 20: (32, 18), 21: (256, 110),
+    22: (256, 82), 23: (256, 136), 24: (1, 1), 25: (1, 2), 26: (1, 4), 27: (1, 8), 28: (1, 8),
+    29: (256, 56), 30: (1, 2), 34: (256, 54), 35: (256, 66), 39: (32, 17),
+}
+
+# llama_ftype values stored in `general.file_type`
+FILE_TYPE_NAMES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1", 10: "Q2_K",
+    11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M", 16: "Q5_K_S", 17: "Q5_K_M",
+    18: "Q6_K", 19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S", 22: "IQ3_XS", 23: "IQ3_XXS", 24: "IQ1_S",
+    25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M", 28: "IQ2_S", 29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M",
+    32: "BF16", 36: "TQ1_0", 37: "TQ2_0", 38: "MXFP4_MOE",
+}
+
+LAYER_TENSOR_PATTERN = re.compile(r"^blk\.(\d+)\.")
+
+
+class GGUFFormatError(ValueError):
+    """The file is not a readable GGUF file."""
+
+
+class _Reader:
+    """Sequential little-endian reader over a memory-mapped buffer."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.offset = 0
+
+    def scalar(self, value_type):
+        fmt = SCALAR_FORMATS[value_type]
+        value = struct.unpack_from(fmt, self.buffer, self.offset)[0]
+        self.offset += struct.calcsize(fmt)
+        return value
+
+    def string(self):
+        length = self.scalar(UINT64)
+        value = bytes(self.buffer[self.offset:self.offset + length]).decode("utf-8", errors="replace")
+        self.offset += length
+        return value
+
+    def value(self, value_type):
+        if value_type == STRING:
+            return self.string()
+        if value_type == ARRAY:
+            item_type = self.scalar(UINT32)
+            length = self.scalar(UINT64)
+            if length > MAX_STORED_ARRAY_LENGTH:
+                self.skip_array(item_type, length)
+                return None
+            return [self.value(item_type) for _ in range(length)]
+        if value_type not in SCALAR_FORMATS:
+            raise GGUFFormatError(f"Unknown GGUF metadata value type {value_type}")
+        return self.scalar(value_type)
+
+    def skip_array(self, item_type, length):
+        if item_type in SCALAR_FORMATS:
+            self.offset += struct.calcsize(SCALAR_FORMATS[item_type]) * length
+        elif item_type == STRING:
+            for _ in range(length):
+                string_length = self.scalar(UINT64)
+                self.offset += string_length
+        else:
+            for _ in range(length):
+                self.value(item_type)
+
+
+def tensor_nbytes(shape, ggml_type):
+    """Size in bytes of a tensor of the given shape and ggml type."""
+    if ggml_type not in GGML_TYPE_SIZES:
+        return 0
+    block_size, type_size = GGML_TYPE_SIZES[ggml_type]
+    elements = 1
+    for dim in shape:
+        elements *= dim
+    return elements // block_size * type_size
+
+
+def read_gguf_header(path):
+    """Parse the metadata and tensor table of a GGUF file.
+
+    The file is memory-mapped, so only the pages holding the header are read from disk.
+    Returns a dict with `version`, `metadata` and `tensors` (name, shape, type, size).
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            if buffer[:4] != GGUF_MAGIC:
+                raise GGUFFormatError(f"'{path}' is not a GGUF file")
+            reader = _Reader(buffer)
+            reader.offset = 4
+            version = reader.scalar(UINT32)
+            if version < 2:
+                raise GGUFFormatError(f"GGUF version {version} of '{path}' is not supported")
+            tensor_count = reader.scalar(UINT64)
+            kv_count = reader.scalar(UINT64)
+
+            metadata = {}
+            for _ in range(kv_count):
+                key = reader.string()
+                metadata[key] = reader.value(reader.scalar(UINT32))
+
+            tensors = []
+            for _ in range(tensor_count):
+                name = reader.string()
+                n_dims = reader.scalar(UINT32)
+                shape = [reader.scalar(UINT64) for _ in range(n_dims)]
+                ggml_type = reader.scalar(UINT32)
+                reader.scalar(UINT64)  # data offset
+                tensors.append({"name": name, "shape": shape, "type": ggml_type, "size": tensor_nbytes(shape, ggml_type)})
+    return {"version": version, "metadata": metadata, "tensors": tensors}
+
+
+def _max_if_list(value):
+    """Some architectures store per-layer head counts as arrays."""
+    return max(value) if isinstance(value, list) and value else value
+
+
+def summarize_gguf(header):
+    """Extract the values the tool needs from a parsed GGUF header.
+
+    `layer_bytes` holds the size of each repeating block (`blk.N.*` tensors) and
+    `non_layer_bytes` the embeddings, output head and norms.
+    """
+    metadata = header["metadata"]
+    architecture = metadata.get("general.architecture", "")
+    block_count = metadata.get(f"{architecture}.block_count") or 0
+
+    layer_bytes = [0] * block_count
+    non_layer_bytes = 0
+    for tensor in header["tensors"]:
+        match = LAYER_TENSOR_PATTERN.match(tensor["name"])
+        if match and int(match.group(1)) < block_count:
+            layer_bytes[int(match.group(1))] += tensor["size"]
+        else:
+            non_layer_bytes += tensor["size"]
+
+    head_count = _max_if_list(metadata.get(f"{architecture}.attention.head_count"))
+    head_count_kv = _max_if_list(metadata.get(f"{architecture}.attention.head_count_kv"))
+    embedding_length = metadata.get(f"{architecture}.embedding_length")
+    file_type = metadata.get("general.file_type")
+    return {
+        "architecture": architecture,
+        "name": metadata.get("general.name"),
+        "context_length": metadata.get(f"{architecture}.context_length"),
+        "embedding_length": embedding_length,
+        "block_count": block_count,
+        "head_count": head_count,
+        "head_count_kv": head_count_kv or head_count,
+        "key_length": metadata.get(f"{architecture}.attention.key_length"),
+        "value_length": metadata.get(f"{architecture}.attention.value_length"),
+        "file_type": file_type,
+        "quantization": FILE_TYPE_NAMES.get(file_type, f"type {file_type}" if file_type is not None else None),
+        "tensor_count": len(header["tensors"]),
+        "tensor_bytes": sum(layer_bytes) + non_layer_bytes,
+        "layer_bytes": layer_bytes,
+        "non_layer_bytes": non_layer_bytes,
+    }
+
+
+def kv_cache_bytes(summary, n_ctx, bytes_per_element=2):
+    """Estimated size of the f16 KV cache for `n_ctx` tokens, or None if the header lacks attention sizes."""
+    head_count = summary.get("head_count")
+    head_count_kv = summary.get("head_count_kv")
+    embedding_length = summary.get("embedding_length")
+    if not head_count or not head_count_kv or not embedding_length:
+        return None
+    head_dim = embedding_length // head_count
+    key_length = summary.get("key_length") or head_dim
+    value_length = summary.get("value_length") or head_dim
+    per_token_per_layer = head_count_kv * (key_length + value_length) * bytes_per_element
+    return per_token_per_layer * n_ctx * summary["block_count"]
+
+
+class GGUFIndex:
+    """Cache of GGUF summaries in a JSON file, keyed by path and invalidated by mtime and size."""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def get(self, model_path):
+        """Return the summary of a GGUF file, parsing its header only if it changed since it was indexed."""
+        model_path = os.path.abspath(model_path)
+        stat = os.stat(model_path)
+        entry = self.entries.get(model_path)
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return entry["summary"]
+
+        summary = summarize_gguf(read_gguf_header(model_path))
+        self.entries[model_path] = {"mtime": stat.st_mtime, "size": stat.st_size, "summary": summary}
+        self.save()
+        return summary
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f)
@@ -0,0 +1,63 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Choose how many model layers fit in the free GPU memory."""
+
+import subprocess
+
+from .gguf_metadata import kv_cache_bytes
+
+NVIDIA_SMI_QUERY = ["nvidia-smi", "--query-gpu=index,name,memory.total,memory.free", "--format=csv,noheader,nounits"]
+# VRAM kept free for the llama.cpp compute buffers and the CUDA context.
+COMPUTE_BUFFER_RESERVE_MIB = 512
+MIB = 1024 * 1024
+
+
+def query_nvidia_smi():
+    """Return the raw `nvidia-smi` GPU listing, raising FileNotFoundError without an NVIDIA driver."""
+    result = subprocess.run(NVIDIA_SMI_QUERY, stdin=subprocess.DEVNULL, capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+def parse_nvidia_smi(output):
+    """Parse `index, name, memory.total, memory.free` CSV lines into dicts with MiB values."""
+    gpus = []
+    for line in output.strip().splitlines():
+        idx, name, total, free = [s.strip() for s in line.split(",")]
+        gpus.append({"index": int(idx), "name": name, "total_mib": int(total), "free_mib": int(free)})
+    return gpus
+
+
+def plan_gpu_layers(summary, n_ctx, free_mib, budget_percent, reserve_mib=COMPUTE_BUFFER_RESERVE_MIB):
+    """Return the largest `n_gpu_layers` whose weights and KV cache fit in the budget, and the bytes it uses.
+
+    llama.cpp offloads the last layers first, each with its share of the KV cache. When every
+    layer fits and the output head fits too, -1 (all) is returned.
+    """
+    budget = free_mib * budget_percent / 100.0 * MIB - reserve_mib * MIB
+    block_count = summary["block_count"]
+    kv_bytes = kv_cache_bytes(summary, n_ctx) or 0
+    kv_per_layer = kv_bytes / block_count if block_count else 0
+
+    used = 0
+    layers = 0
+    for layer_bytes in reversed(summary["layer_bytes"]):
+        if used + layer_bytes + kv_per_layer > budget:
+            break
+        used += layer_bytes + kv_per_layer
+        layers += 1
+
+    if layers == block_count and used + summary["non_layer_bytes"] <= budget:
+        return -1, used + summary["non_layer_bytes"]
+    return layers, used
@@ -0,0 +1,111 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hedged requests: fire a duplicate request when a row is slower than the observed tail latency."""
+
+import asyncio
+import math
+import time
+from collections import deque, namedtuple
+
+DEFAULT_HEDGE_PERCENTILE = 95.0
+DEFAULT_HEDGE_MAX_PERCENT = 5.0
+# Number of observed latencies needed before the percentile deadline is trusted.
+MIN_LATENCY_SAMPLES = 20
+LATENCY_WINDOW = 500
+
+HedgeResult = namedtuple("HedgeResult", ["response", "hedged", "hedge_won"])
+
+
+class LatencyTracker:
+    """Rolling window of observed request latencies in seconds."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, pct):
+        """Return the nearest-rank percentile of the window, or None when it is empty."""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+        return ordered[rank - 1]
+
+
+class HedgePolicy:
+    """Decide when to hedge a request and cap hedges to a share of the traffic."""
+
+    def __init__(self, percentile=DEFAULT_HEDGE_PERCENTILE, max_hedge_percent=DEFAULT_HEDGE_MAX_PERCENT,
+                 min_samples=MIN_LATENCY_SAMPLES):
+        self.percentile = percentile
+        self.max_hedge_percent = max_hedge_percent
+        self.min_samples = min_samples
+        self.latencies = LatencyTracker()
+        self.requests = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def delay(self):
+        """Return the adaptive hedge deadline in seconds, or None while too few latencies are known."""
+        if len(self.latencies.samples) < self.min_samples:
+            return None
+        return self.latencies.percentile(self.percentile)
+
+    def try_acquire(self):
+        """Reserve a hedge if it keeps hedges within `max_hedge_percent` of all requests."""
+        if (self.hedges + 1) * 100.0 > self.max_hedge_percent * self.requests:
+            return False
+        self.hedges += 1
+        return True
+
+
+async def hedged_request(primary, hedge, policy):
+    """Await `primary()`, racing it against `hedge()` once the policy deadline has passed.
+
+    `primary` and `hedge` are coroutine factories so the duplicate request is only created
+    when it is actually fired. The first request to finish wins and the other one is cancelled.
+    Errors of the first finisher are only raised if the other request fails too.
+    """
+    policy.requests += 1
+    start = time.monotonic()
+    primary_task = asyncio.ensure_future(primary())
+    delay = policy.delay()
+
+    done, _ = await asyncio.wait({primary_task}, timeout=delay)
+    if done or not policy.try_acquire():
+        response = await primary_task
+        policy.latencies.record(time.monotonic() - start)
+        return HedgeResult(response, False, False)
+
+    hedge_task = asyncio.ensure_future(hedge())
+    pending = {primary_task, hedge_task}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            succeeded = [task for task in done if task.exception() is None]
+            if succeeded:
+                hedge_won = succeeded[0] is hedge_task
+                policy.hedges_won += int(hedge_won)
+                policy.latencies.record(time.monotonic() - start)
+                return HedgeResult(succeeded[0].result(), True, hedge_won)
+            if not pending:
+                raise next(iter(done)).exception()
+            # Give the other request a chance before failing the row
+    finally:
+        for task in (primary_task, hedge_task):
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,314 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Long-lived local inference daemon keeping GGUF models loaded across workflow runs.
+
+The tool starts the daemon on first use and finds it again on later runs. They talk over a
+Unix domain socket, or a named pipe on Windows, through `multiprocessing.connection`, which
+frames each message and authenticates the client with a key only the user can read. Every
+message is an Arrow IPC stream whose schema metadata holds the JSON request or reply header.
+
+This file runs as a script, so it must not use relative imports.
+"""
+
+import argparse
+import getpass
+import hashlib
+import json
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.connection import Client, Listener
+
+import pyarrow as pa
+
+DAEMON_DIR = os.path.expanduser("~/.ayx")
+DAEMON_KEY_PATH = os.path.join(DAEMON_DIR, "llm_connect_daemon.key")
+DAEMON_LOG_PATH = os.path.join(DAEMON_DIR, "llm_connect_daemon.log")
+DEFAULT_IDLE_MINUTES = 30
+# Models kept loaded at once; loading another one unloads the least recently used.
+DEFAULT_MAX_MODELS = 2
+# Seconds to wait for a freshly started daemon to accept connections.
+DAEMON_START_TIMEOUT = 30
+RESPONSE_CACHE_ENTRIES = 10000
+HEADER_KEY = b"llm_connect"
+
+
+def daemon_address():
+    if sys.platform == "win32":
+        return rf"\\.\pipe\llm_connect_daemon_{getpass.getuser()}"
+    return os.path.join(DAEMON_DIR, "llm_connect_daemon.sock")
+
+
+def daemon_authkey(create=False):
+    """Return the key shared by the daemon and its clients, creating it readable by the user only."""
+    try:
+        with open(DAEMON_KEY_PATH, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        if not create:
+            raise
+    os.makedirs(DAEMON_DIR, exist_ok=True)
+    key = secrets.token_bytes(32)
+    fd = os.open(DAEMON_KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+def encode_message(header, table=None):
+    """Serialize a header and an optional table as one Arrow IPC stream."""
+    table = table if table is not None else pa.table({})
+    table = table.replace_schema_metadata({HEADER_KEY: json.dumps(header).encode("utf-8")})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_message(data):
+    """Return the header and the table of a message built by `encode_message`."""
+    table = pa.ipc.open_stream(pa.py_buffer(data)).read_all()
+    header = json.loads(table.schema.metadata[HEADER_KEY])
+    return header, table.replace_schema_metadata(None)
+
+
+class InferenceDaemon:
+    """Serve chat completions from GGUF models loaded once and kept until the daemon is idle.
+
+    At most `max_models` models stay loaded, the least recently used being unloaded first.
+    """
+
+    def __init__(self, address, authkey, idle_minutes=DEFAULT_IDLE_MINUTES, max_models=DEFAULT_MAX_MODELS):
+        self.address = address
+        self.authkey = authkey
+        self.idle_seconds = idle_minutes * 60
+        self.max_models = max(1, max_models)
+        self.models = OrderedDict()
+        self.grammars = {}
+        self.responses = OrderedDict()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.last_request = time.monotonic()
+
+    def model(self, llama_kwargs):
+        """Return the loaded model for these arguments and its lock, and whether it was already loaded."""
+        key = json.dumps(llama_kwargs, sort_keys=True)
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key], True
+            from llama_cpp import Llama
+
+            # Unloading before loading keeps the memory of one model at most above the cap. A request
+            # still running on an unloaded model holds it until it is done.
+            while len(self.models) >= self.max_models:
+                self.models.popitem(last=False)
+            # Loading under the daemon lock keeps two runs from loading the same model twice
+            self.models[key] = (Llama(**llama_kwargs), threading.Lock())
+            return self.models[key], False
+
+    def grammar(self, spec):
+        """Compile the JSON grammar of a request once: "json" for any JSON, otherwise a JSON schema."""
+        if spec is None:
+            return None
+        with self.lock:
+            if spec not in self.grammars:
+                from llama_cpp import LlamaGrammar
+                from llama_cpp.llama_grammar import JSON_GBNF
+
+                if spec == "json":
+                    self.grammars[spec] = LlamaGrammar.from_string(JSON_GBNF, verbose=False)
+                else:
+                    self.grammars[spec] = LlamaGrammar.from_json_schema(spec, verbose=False)
+            return self.grammars[spec]
+
+    def cached_response(self, key):
+        with self.lock:
+            if key in self.responses:
+                self.responses.move_to_end(key)
+                return self.responses[key]
+        return None
+
+    def cache_response(self, key, response):
+        with self.lock:
+            self.responses[key] = response
+            if len(self.responses) > RESPONSE_CACHE_ENTRIES:
+                self.responses.popitem(last=False)
+
+    def chat(self, header, table):
+        (llama, model_lock), _ = self.model(header["llama_kwargs"])
+        grammar = self.grammar(header.get("grammar"))
+        params = header["params"]
+        model_key = json.dumps([header["llama_kwargs"], params, header.get("grammar")], sort_keys=True)
+
+        contents, prompt_tokens, completion_tokens, errors = [], [], [], []
+        for messages in table.column("messages").to_pylist():
+            key = hashlib.sha256((model_key + messages).encode("utf-8")).hexdigest()
+            response = self.cached_response(key) if header.get("cache") else None
+            if response is None:
+                try:
+                    with model_lock:
+                        response = llama.create_chat_completion(messages=json.loads(messages), grammar=grammar, stream=False, **params)
+                except Exception as e:
+                    contents.append(None)
+                    prompt_tokens.append(None)
+                    completion_tokens.append(None)
+                    errors.append(f"{type(e).__name__}: {e}")
+                    continue
+                if header.get("cache"):
+                    self.cache_response(key, response)
+            contents.append(response["choices"][0]["message"]["content"])
+            prompt_tokens.append(response["usage"]["prompt_tokens"])
+            completion_tokens.append(response["usage"]["completion_tokens"])
+            errors.append(None)
+        return pa.table({
+            "content": pa.array(contents, pa.string()),
+            "prompt_tokens": pa.array(prompt_tokens, pa.int32()),
+            "completion_tokens": pa.array(completion_tokens, pa.int32()),
+            "error": pa.array(errors, pa.string()),
+        })
+
+    def handle_request(self, header, table):
+        op = header.get("op")
+        if op == "ping":
+            return {"ok": True, "models": len(self.models), "pid": os.getpid()}, None
+        if op == "load":
+            start = time.perf_counter()
+            _, already_loaded = self.model(header["llama_kwargs"])
+            return {"already_loaded": already_loaded, "seconds": time.perf_counter() - start}, None
+        if op == "chat":
+            return {}, self.chat(header, table)
+        raise ValueError(f"Unknown daemon request '{op}'")
+
+    def handle_connection(self, connection):
+        with connection:
+            while True:
+                try:
+                    header, table = decode_message(connection.recv_bytes())
+                except (EOFError, OSError):
+                    return
+                with self.lock:
+                    self.active += 1
+                try:
+                    reply, reply_table = self.handle_request(header, table)
+                except Exception as e:
+                    reply, reply_table = {"error": f"{type(e).__name__}: {e}"}, None
+                finally:
+                    with self.lock:
+                        self.active -= 1
+                        self.last_request = time.monotonic()
+                connection.send_bytes(encode_message(reply, reply_table))
+
+    def exit_when_idle(self):
+        while True:
+            time.sleep(min(30, self.idle_seconds))
+            with self.lock:
+                idle = not self.active and time.monotonic() - self.last_request > self.idle_seconds
+            if idle:
+                if sys.platform != "win32" and os.path.exists(self.address):
+                    os.unlink(self.address)
+                os._exit(0)
+
+    def serve(self):
+        if sys.platform != "win32" and os.path.exists(self.address):
+            try:
+                Client(self.address, authkey=self.authkey).close()
+                return  # Another daemon started first and is serving
+            except OSError:
+                # A socket left behind by a daemon that did not exit cleanly
+                os.unlink(self.address)
+        listener = Listener(self.address, authkey=self.authkey)
+        threading.Thread(target=self.exit_when_idle, daemon=True).start()
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception:
+                continue  # A client that failed authentication
+            threading.Thread(target=self.handle_connection, args=(connection,), daemon=True).start()
+
+
+class DaemonError(RuntimeError):
+    """The inference daemon could not be reached or failed a request."""
+
+
+class DaemonClient:
+    """Connection to the inference daemon, which is started when no daemon is running."""
+
+    def __init__(self, idle_minutes=DEFAULT_IDLE_MINUTES, on_info=None, max_models=DEFAULT_MAX_MODELS):
+        self.address = daemon_address()
+        try:
+            self.connection = Client(self.address, authkey=daemon_authkey())
+            if on_info:
+                on_info("Connected to the running inference daemon")
+        except (FileNotFoundError, ConnectionError, OSError):
+            self.start_daemon(idle_minutes, max_models)
+            if on_info:
+                on_info(f"Started the inference daemon (exits after {idle_minutes} idle minutes, keeps up to {max_models} models loaded)")
+            self.connection = self.wait_for_daemon()
+
+    def start_daemon(self, idle_minutes, max_models):
+        daemon_authkey(create=True)
+        log = open(DAEMON_LOG_PATH, "a")
+        kwargs = {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP} if sys.platform == "win32" else {"start_new_session": True}
+        # The daemon outlives this tool process, so it must not hold its standard streams
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--idle-minutes", str(idle_minutes), "--max-models", str(max_models)],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log, close_fds=True, **kwargs,
+        )
+        log.close()
+
+    def wait_for_daemon(self):
+        deadline = time.monotonic() + DAEMON_START_TIMEOUT
+        while True:
+            try:
+                return Client(self.address, authkey=daemon_authkey())
+            except (FileNotFoundError, ConnectionError, OSError):
+                if time.monotonic() > deadline:
+                    raise DaemonError(f"The inference daemon did not start within {DAEMON_START_TIMEOUT} seconds, see {DAEMON_LOG_PATH}")
+                time.sleep(0.2)
+
+    def request(self, header, table=None):
+        self.connection.send_bytes(encode_message(header, table))
+        reply, reply_table = decode_message(self.connection.recv_bytes())
+        if "error" in reply:
+            raise DaemonError(reply["error"])
+        return reply, reply_table
+
+    def load(self, llama_kwargs):
+        """Make sure the daemon holds the model, returning whether it was already loaded and the load time."""
+        reply, _ = self.request({"op": "load", "llama_kwargs": llama_kwargs})
+        return reply["already_loaded"], reply["seconds"]
+
+    def chat(self, llama_kwargs, messages_list, params, grammar=None, cache=False):
+        """Run chat completions for a list of message lists and return a table of contents, tokens and errors."""
+        table = pa.table({"messages": pa.array([json.dumps(messages) for messages in messages_list], pa.string())})
+        header = {"op": "chat", "llama_kwargs": llama_kwargs, "params": params, "grammar": grammar, "cache": cache}
+        _, reply_table = self.request(header, table)
+        return reply_table
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--idle-minutes", type=float, default=DEFAULT_IDLE_MINUTES)
+    parser.add_argument("--max-models", type=int, default=DEFAULT_MAX_MODELS)
+    args = parser.parse_args()
+    InferenceDaemon(daemon_address(), daemon_authkey(create=True), args.idle_minutes, args.max_models).serve()
@@ -0,0 +1,162 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parse the JSON responses of a record batch in bulk with pyarrow.json into typed Arrow columns."""
+
+import io
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pj
+
+FLATTEN_COLUMNS = "flatten"
+STRUCT_COLUMNS = "struct"
+DEFAULT_JSON_SAMPLE_ROWS = 1000
+# Markdown code fences some models wrap JSON answers in, even in JSON mode.
+CODE_FENCE_PATTERN = r"^\s*```(?:json)?\s*|\s*```\s*$"
+JSON_SCHEMA_TYPES = {"string": pa.string(), "integer": pa.int64(), "number": pa.float64(), "boolean": pa.bool_()}
+
+
+def json_error_column(response_column):
+    return f"{response_column} JSON error"
+
+
+def arrow_type(json_schema):
+    """Arrow type of a JSON Schema, or None for types without one (the field is then left out)."""
+    json_type = json_schema.get("type")
+    if isinstance(json_type, list):
+        json_type = next((name for name in json_type if name != "null"), None)
+    if json_type is None and json_schema.get("enum") and all(isinstance(value, str) for value in json_schema["enum"]):
+        json_type = "string"
+    if json_type == "object":
+        fields = [pa.field(name, arrow_type(child)) for name, child in json_schema.get("properties", {}).items() if arrow_type(child) is not None]
+        return pa.struct(fields) if fields else None
+    if json_type == "array":
+        item_type = arrow_type(json_schema.get("items", {}))
+        return pa.list_(item_type) if item_type is not None else None
+    return JSON_SCHEMA_TYPES.get(json_type)
+
+
+def arrow_schema(json_schema):
+    """Arrow schema of the top-level object of a JSON Schema."""
+    struct = arrow_type(json_schema)
+    if not isinstance(struct, pa.StructType):
+        raise ValueError("The JSON schema must describe an object with typed properties")
+    return pa.schema(list(struct))
+
+
+def without_null_types(data_type):
+    """Replace the null type inferred for fields only seen empty by string."""
+    if pa.types.is_null(data_type):
+        return pa.string()
+    if pa.types.is_struct(data_type):
+        return pa.struct([field.with_type(without_null_types(field.type)) for field in data_type])
+    if pa.types.is_list(data_type):
+        return pa.list_(without_null_types(data_type.value_type))
+    return data_type
+
+
+def json_lines(responses):
+    """One JSON document per line: code fences stripped, line breaks outside strings removed, missing responses as {}.
+
+    A line break inside a JSON string must be escaped, so raw line breaks are only whitespace.
+    """
+    values = pa.array(pd.Series(responses, dtype=object), type=pa.string(), from_pandas=True)
+    values = pc.replace_substring_regex(values, CODE_FENCE_PATTERN, "")
+    values = pc.replace_substring_regex(values, r"[\r\n]+", " ")
+    return pc.if_else(pc.equal(pc.utf8_trim_whitespace(values.fill_null("")), ""), "{}", values)
+
+
+def read_lines(lines, schema=None):
+    buffer = pc.binary_join(pa.ListArray.from_arrays([0, len(lines)], lines), "\n")[0].as_py().encode("utf-8") + b"\n"
+    parse_options = pj.ParseOptions(explicit_schema=schema, unexpected_field_behavior="ignore") if schema is not None else None
+    return pj.read_json(io.BytesIO(buffer), read_options=pj.ReadOptions(block_size=max(len(buffer) + 1, 1 << 20)), parse_options=parse_options)
+
+
+def read_valid_lines(lines, schema=None):
+    """Parse the lines in bulk, splitting the lines in halves around the ones that fail.
+
+    Returns the parsed tables with the offset of their first line, and the error of each failed
+    line. A few invalid responses cost a few more bulk parses, not a parse per row.
+    """
+    tables, errors = [], {}
+    ranges = [(0, len(lines))]
+    while ranges:
+        start, end = ranges.pop()
+        try:
+            table = read_lines(lines.slice(start, end - start), schema)
+            # A response holding several JSON documents parses as several rows
+            if table.num_rows != end - start:
+                raise pa.ArrowInvalid(f"Expected one JSON document per response, got {table.num_rows}")
+            tables.append((start, table))
+        except pa.ArrowInvalid as e:
+            if end - start == 1:
+                errors[start] = re.sub(r" in row \d+$", "", str(e))
+            else:
+                middle = (start + end) // 2
+                ranges += [(middle, end), (start, middle)]
+    return sorted(tables, key=lambda item: item[0]), errors
+
+
+class JsonResponseParser:
+    """Parse columns of JSON responses into tables of one schema.
+
+    The schema is given, or inferred from the first `sample_rows` responses of the first batch and
+    then kept for the rest of the run so every record batch has the same columns. Responses that are
+    not JSON objects, or whose values do not convert to the schema, get null fields and an error.
+    """
+
+    def __init__(self, schema=None, sample_rows=DEFAULT_JSON_SAMPLE_ROWS):
+        self.schema = schema
+        self.sample_rows = sample_rows
+
+    def infer_schema(self, lines):
+        tables, _ = read_valid_lines(lines.slice(0, self.sample_rows))
+        if not tables:
+            return pa.schema([])
+        schema = tables[0][1].schema
+        for _, table in tables[1:]:
+            try:
+                schema = pa.unify_schemas([schema, table.schema], promote_options="permissive")
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # The types seen first win, conflicting rows fail to parse against them
+                continue
+        return pa.schema([field.with_type(without_null_types(field.type)) for field in schema])
+
+    def parse(self, responses):
+        """Return the parsed fields as a table, one row per response, and the parse error of each row or None."""
+        lines = json_lines(responses)
+        if self.schema is None:
+            self.schema = self.infer_schema(lines)
+        tables, errors = read_valid_lines(lines, self.schema)
+        # Failed lines are filled with rows of null fields
+        empty_row = pa.Table.from_pylist([{}], schema=self.schema)
+        pieces, rows = [], 0
+        for start, table in tables + [(len(lines), None)]:
+            pieces += [empty_row] * (start - rows)
+            if table is not None:
+                pieces.append(table.select(self.schema.names).cast(self.schema))
+                rows = start + table.num_rows
+        return pa.concat_tables(pieces), [errors.get(position) for position in range(len(lines))]
+
+
+def field_columns(table, mode=FLATTEN_COLUMNS, prefix="", struct_name="fields"):
+    """Named output arrays of the parsed fields: nested objects flattened to `parent.child` columns, or one struct column."""
+    if mode == STRUCT_COLUMNS:
+        return {prefix + struct_name: pa.StructArray.from_arrays([column.combine_chunks() for column in table.columns], fields=list(table.schema))}
+    while any(pa.types.is_struct(field.type) for field in table.schema):
+        table = table.flatten()
+    return {f"{prefix}{name}": column for name, column in zip(table.column_names, table.columns)}
@@ -17,29 +17,68 @@
 import json
 import os
 import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Any, Dict, List
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 import pyarrow as pa
 from ayx_python_sdk.core import Anchor, PluginV2
 from ayx_python_sdk.providers.amp_provider.amp_provider_v2 import AMPProviderV2
-from litellm import Cache, batch_completion, completion, completion_cost, completion_with_retries
+from litellm import Cache, acompletion, batch_completion, completion, completion_cost, embedding
 from litellm.utils import trim_messages
 from openai import OpenAIError
 from pandas.core.dtypes.common import is_string_dtype
-from llama_cpp import Llama, LLAMA_SPLIT_MODE_LAYER
+from llama_cpp import Llama, LlamaGrammar, LLAMA_SPLIT_MODE_LAYER
 from llama_cpp import llama_cpp as _llama_cpp
+from llama_cpp import llama_chat_format
+from llama_cpp.llama_grammar import JSON_GBNF
 import litellm
 
+from .event_loop import BackgroundEventLoop
+from .classification import MAX_TOP_LOGPROBS, label_token_ids, openai_label_bias, parse_labels, probability_column, score_logits, score_text, score_top_logprobs, shared_first_tokens, with_instruction
+from .concurrency import DEFAULT_INITIAL_CONCURRENCY, DEFAULT_MAX_CONCURRENCY, RATE_LIMITED, TIMED_OUT, AIMDController
+from .deadlines import DEFAULT_DEADLINE_CONCURRENCY, STATUS_ERROR, STATUS_OK, RunDeadline, run_with_deadline
+from .cascade import LOCAL_CASCADE_TIER, CascadeStats, CascadeValidator, parse_cascade_models
+from .chunking import CHAT_TEMPLATE_OVERHEAD_TOKENS, DEFAULT_CHUNK_CONCURRENCY, DEFAULT_CHUNK_TOKENS, DEFAULT_REDUCE_PROMPT, RESPONSE_SEPARATOR, chunk_text, map_prompt, pack_responses, reduce_prompt
+from .output_columns import StringColumnEncoder, float32_column, int32_column, set_columns, string_column
+from .prompt_caching import cache_savings, cached_token_counts, needs_cache_control, with_cache_control
+from .prompt_files import estimate_file_tokens, read_prompt_file
+from .profiling import RunProfiler
+from .pipeline import DEFAULT_PIPELINE_MEMORY_MB, DEFAULT_PIPELINE_WORKERS, OrderedPipeline
+from .packing import DEFAULT_PACK_ANSWER_TOKENS, DEFAULT_PACK_SIZE, ITEM_OVERHEAD_TOKENS, PACK_INSTRUCTION, allocate, pack_groups, pack_items, parse_packed_answers, split_cost, with_pack_instruction
+from .planning import TOKENS_PER_MESSAGE, RunPlan, batch_encoder, count_tokens, load_throughput, record_throughput, throughput_key, token_prices
+from .sidecar import DEFAULT_ROW_GROUP_ROWS, DEFAULT_SIDECAR_COMPRESSION, ROW_ID_COLUMN, SidecarWriter, key_table, row_status, sidecar_format
+from .scheduling import estimate_tokens, longest_first, makespan
+from .embeddings import DEFAULT_EMBEDDING_BATCH_SIZE, embed_texts
+from .autotune import DEFAULT_CALIBRATION_DECODE_TOKENS, DEFAULT_CALIBRATION_PROMPT_TOKENS, autotune, load_tuning, save_tuning, tuning_key
+from .gguf_metadata import GGUFIndex, kv_cache_bytes
+from .gpu_placement import parse_nvidia_smi, plan_gpu_layers, query_nvidia_smi
+from .vision import DEFAULT_IMAGE_CACHE_MB, DEFAULT_IMAGE_MAX_SIZE, DEFAULT_VISION_CHAT_HANDLER, ImageEncodingCache, ImagePreprocessor, create_vision_handler
+from .inference_daemon import DEFAULT_IDLE_MINUTES, DEFAULT_MAX_MODELS, DaemonClient
+from .local_worker_pool import PROMPT_FILE_KEY, LocalWorkerPool, available_cpus
+from .json_columns import DEFAULT_JSON_SAMPLE_ROWS, FLATTEN_COLUMNS, STRUCT_COLUMNS, JsonResponseParser, arrow_schema, field_columns, json_error_column
+from .hedging import DEFAULT_HEDGE_MAX_PERCENT, DEFAULT_HEDGE_PERCENTILE, HedgePolicy, hedged_request
+from .retry_policy import DEFAULT_BREAKER_ERROR_RATE, DEFAULT_BREAKER_WINDOW, RATE_LIMIT, TIMEOUT, CircuitBreaker, RetryPolicy, classify_error
+
 # import debugpy
 
-DEFAULT_NUM_RETRIES = 100
 DEFAULT_INPUT_CONTEXT_LENGTH = 512
+DEFAULT_REQUEST_TIMEOUT = 60
 os.environ["LITELLM_LOCAL_MODEL_COST_MAP"] = "True"
 os.environ["LITELLM_MODE"] = "PRODUCTION"
 # GPU device index to use for inference.
 MAIN_GPU = 0
+COMPLETION_OPERATION = "Completion"
+EMBEDDINGS_OPERATION = "Embeddings"
+CLASSIFICATION_OPERATION = "Classification"
+# Vector size of simulated embeddings when embeddingDimensions is not set.
+DEFAULT_SIMULATED_EMBEDDING_DIMENSIONS = 1536
 
 
 class LLMConnect(PluginV2):
@@ -50,9 +89,7 @@ class LLMConnect(PluginV2):
         self.name = "LLMConnect"
         self.provider = provider
         self.provider.io.info(f"{self.name} tool started")
-        # Initialize input_dataframe as empty list to store batches
-        self.dataframe_batches = []
-        
+
         # Read all configuration values
         self.platform = self.provider.tool_config.get("platform")
         self.endpoint = self.provider.tool_config.get("endpoint")
@@ -71,29 +108,222 @@ class LLMConnect(PluginV2):
         self.use_system_prompt = self.provider.tool_config.get("useSystemPrompt") == "1" if self.provider.tool_config.get("useSystemPrompt") else False
         self.simulate_response = self.provider.tool_config.get("simulateResponse") == "1" if self.provider.tool_config.get("simulateResponse") else False
         self.simulate_response_text = self.provider.tool_config.get("simulateResponseText") if self.provider.tool_config.get("simulateResponseText") else None
-        self.num_retries = int(self.provider.tool_config.get("numRetries")) if self.provider.tool_config.get("numRetries") else DEFAULT_NUM_RETRIES
+        # Caps the per-error-class retry counts of the retry policy
+        self.num_retries = int(self.provider.tool_config.get("numRetries")) if self.provider.tool_config.get("numRetries") else None
+        self.use_circuit_breaker = self.provider.tool_config.get("circuitBreaker") != "0"
+        self.breaker_error_rate = float(self.provider.tool_config.get("circuitBreakerErrorRate")) if self.provider.tool_config.get("circuitBreakerErrorRate") else DEFAULT_BREAKER_ERROR_RATE
+        self.breaker_window = int(self.provider.tool_config.get("circuitBreakerWindow")) if self.provider.tool_config.get("circuitBreakerWindow") else DEFAULT_BREAKER_WINDOW
         self.batch_processing = self.provider.tool_config.get("batchProcessing") == "1" if self.provider.tool_config.get("batchProcessing") else False
         self.max_budget = float(self.provider.tool_config.get("maxBudget")) if self.provider.tool_config.get("maxBudget") else 1.001
         self.enforceJsonResponse = self.provider.tool_config.get("enforceJsonResponse") =="1"
+        self.json_schema_text = self.provider.tool_config.get("jsonSchema") if self.provider.tool_config.get("jsonSchema") else None
         self.gpu_offload = self.provider.tool_config.get("gpuOffload") == "1" if self.provider.tool_config.get("gpuOffload") else False
         self.n_gpu_layers = int(self.provider.tool_config.get("nGpuLayers")) if self.provider.tool_config.get("nGpuLayers") else 0
+        # Share of the free VRAM (%) that automatic GPU layer placement may fill
         self.gpu_memory = int(self.provider.tool_config.get("gpuMemory")) if self.provider.tool_config.get("gpuMemory") else 10
+        self.auto_gpu_layers = self.provider.tool_config.get("autoGpuLayers") == "1" if self.provider.tool_config.get("autoGpuLayers") else False
+        self.quantization = self.provider.tool_config.get("quantization") if self.provider.tool_config.get("quantization") else None
         self.input_context_length = int(self.provider.tool_config.get("inputContextLength")) if self.provider.tool_config.get("inputContextLength") else DEFAULT_INPUT_CONTEXT_LENGTH
         self.on_error = self.provider.tool_config.get("onError") if self.provider.tool_config.get("onError") else "warning"
         self.response_column_name = self.provider.tool_config.get("responseColumnName") if self.provider.tool_config.get("responseColumnName") else "LLM Response"
         self.inference_type = self.provider.tool_config.get("inferenceType") if self.provider.tool_config.get("inferenceType") else "Remote"
         self.platform_doc_url = self.provider.tool_config.get("platformDocUrl") if self.provider.tool_config.get("platformDocUrl") else ""
+        self.hedge_requests = self.provider.tool_config.get("hedgeRequests") == "1" if self.provider.tool_config.get("hedgeRequests") else False
+        self.hedge_percentile = float(self.provider.tool_config.get("hedgePercentile")) if self.provider.tool_config.get("hedgePercentile") else DEFAULT_HEDGE_PERCENTILE
+        self.hedge_max_percent = float(self.provider.tool_config.get("hedgeMaxPercent")) if self.provider.tool_config.get("hedgeMaxPercent") else DEFAULT_HEDGE_MAX_PERCENT
+        self.hedge_model = self.provider.tool_config.get("hedgeModel") if self.provider.tool_config.get("hedgeModel") else None
+        self.hedge_endpoint = self.provider.tool_config.get("hedgeEndpoint") if self.provider.tool_config.get("hedgeEndpoint") else None
+        self.local_workers = int(self.provider.tool_config.get("localWorkers")) if self.provider.tool_config.get("localWorkers") else 1
+        self.local_threads_per_worker = int(self.provider.tool_config.get("localThreadsPerWorker")) if self.provider.tool_config.get("localThreadsPerWorker") else None
+        self.auto_tune = self.provider.tool_config.get("autoTune") == "1" if self.provider.tool_config.get("autoTune") else False
+        self.auto_tune_prompt_length = int(self.provider.tool_config.get("autoTunePromptLength")) if self.provider.tool_config.get("autoTunePromptLength") else DEFAULT_CALIBRATION_PROMPT_TOKENS
+        self.auto_tune_decode_tokens = int(self.provider.tool_config.get("autoTuneDecodeTokens")) if self.provider.tool_config.get("autoTuneDecodeTokens") else DEFAULT_CALIBRATION_DECODE_TOKENS
+        self.operation = self.provider.tool_config.get("operation") if self.provider.tool_config.get("operation") else COMPLETION_OPERATION
+        self.embedding_batch_size = int(self.provider.tool_config.get("embeddingBatchSize")) if self.provider.tool_config.get("embeddingBatchSize") else DEFAULT_EMBEDDING_BATCH_SIZE
+        self.embedding_dimensions = int(self.provider.tool_config.get("embeddingDimensions")) if self.provider.tool_config.get("embeddingDimensions") else None
+        self.image_field = self.provider.tool_config.get("imageField") if self.provider.tool_config.get("imageField") else None
+        self.image_max_size = int(self.provider.tool_config.get("imageMaxSize")) if self.provider.tool_config.get("imageMaxSize") else DEFAULT_IMAGE_MAX_SIZE
+        self.image_cache_mb = int(self.provider.tool_config.get("imageCacheSize")) if self.provider.tool_config.get("imageCacheSize") else DEFAULT_IMAGE_CACHE_MB
+        self.vision_chat_handler = self.provider.tool_config.get("visionChatHandler") if self.provider.tool_config.get("visionChatHandler") else DEFAULT_VISION_CHAT_HANDLER
+        self.long_input = self.provider.tool_config.get("longInput") == "1" if self.provider.tool_config.get("longInput") else False
+        self.chunk_tokens = int(self.provider.tool_config.get("chunkTokens")) if self.provider.tool_config.get("chunkTokens") else None
+        self.chunk_overlap = int(self.provider.tool_config.get("chunkOverlap")) if self.provider.tool_config.get("chunkOverlap") else None
+        self.chunk_concurrency = int(self.provider.tool_config.get("chunkConcurrency")) if self.provider.tool_config.get("chunkConcurrency") else DEFAULT_CHUNK_CONCURRENCY
+        self.reduce_prompt_template = self.provider.tool_config.get("reducePrompt") if self.provider.tool_config.get("reducePrompt") else DEFAULT_REDUCE_PROMPT
+        self.map_instruction = self.provider.tool_config.get("mapInstruction") if self.provider.tool_config.get("mapInstruction") else None
+        self.cascade_models = parse_cascade_models(self.provider.tool_config.get("cascadeModels"))
+        self.cascade_regex = self.provider.tool_config.get("cascadeRegex") if self.provider.tool_config.get("cascadeRegex") else None
+        self.cascade_min_confidence = float(self.provider.tool_config.get("cascadeMinConfidence")) if self.provider.tool_config.get("cascadeMinConfidence") else None
+        self.cascade_refusals = self.provider.tool_config.get("cascadeRefusals") != "0"
+        self.length_bucketing = self.provider.tool_config.get("lengthBucketing") == "1" if self.provider.tool_config.get("lengthBucketing") else False
+        self.use_daemon = self.provider.tool_config.get("useDaemon") == "1" if self.provider.tool_config.get("useDaemon") else False
+        self.daemon_idle_minutes = float(self.provider.tool_config.get("daemonIdleMinutes")) if self.provider.tool_config.get("daemonIdleMinutes") else DEFAULT_IDLE_MINUTES
+        self.daemon_max_models = int(self.provider.tool_config.get("daemonMaxModels")) if self.provider.tool_config.get("daemonMaxModels") else DEFAULT_MAX_MODELS
+        self.dry_run = self.provider.tool_config.get("dryRun") == "1" if self.provider.tool_config.get("dryRun") else False
+        self.dictionary_responses = self.provider.tool_config.get("dictionaryResponses") != "0"
+        self.profile = self.provider.tool_config.get("profile") if self.provider.tool_config.get("profile") else None
+        self.profile_memory = self.provider.tool_config.get("profileMemory") == "1" if self.provider.tool_config.get("profileMemory") else False
+        self.use_pipeline = self.provider.tool_config.get("pipeline") == "1" if self.provider.tool_config.get("pipeline") else False
+        self.pipeline_workers = int(self.provider.tool_config.get("pipelineWorkers")) if self.provider.tool_config.get("pipelineWorkers") else DEFAULT_PIPELINE_WORKERS
+        self.pipeline_memory_mb = int(self.provider.tool_config.get("pipelineMemory")) if self.provider.tool_config.get("pipelineMemory") else DEFAULT_PIPELINE_MEMORY_MB
+        self.labels = parse_labels(self.provider.tool_config.get("labels"))
+        self.prompt_from_file = self.provider.tool_config.get("promptFromFile") == "1" if self.provider.tool_config.get("promptFromFile") else False
+        self.prompt_file_tokens = int(self.provider.tool_config.get("promptFileTokens")) if self.provider.tool_config.get("promptFileTokens") else None
+        self.sidecar_path = self.provider.tool_config.get("sidecarPath") if self.provider.tool_config.get("sidecarPath") else None
+        self.sidecar_format = self.provider.tool_config.get("sidecarFormat") if self.provider.tool_config.get("sidecarFormat") else None
+        self.sidecar_compression = self.provider.tool_config.get("sidecarCompression") if self.provider.tool_config.get("sidecarCompression") else DEFAULT_SIDECAR_COMPRESSION
+        self.sidecar_row_group_rows = int(self.provider.tool_config.get("sidecarRowGroupRows")) if self.provider.tool_config.get("sidecarRowGroupRows") else DEFAULT_ROW_GROUP_ROWS
+        self.sidecar_keys = [key.strip() for key in self.provider.tool_config.get("sidecarKeys").split(",") if key.strip()] if self.provider.tool_config.get("sidecarKeys") else []
+        self.run_deadline = float(self.provider.tool_config.get("runDeadline")) if self.provider.tool_config.get("runDeadline") else None
+        self.row_deadline = float(self.provider.tool_config.get("rowDeadline")) if self.provider.tool_config.get("rowDeadline") else None
+        self.prompt_caching = self.provider.tool_config.get("promptCaching") != "0" and self.platform != "**Local Inference**"
+        self.deadline_concurrency = int(self.provider.tool_config.get("deadlineConcurrency")) if self.provider.tool_config.get("deadlineConcurrency") else DEFAULT_DEADLINE_CONCURRENCY
+        self.adaptive_concurrency = self.provider.tool_config.get("adaptiveConcurrency") == "1" if self.provider.tool_config.get("adaptiveConcurrency") else False
+        self.max_concurrency = int(self.provider.tool_config.get("maxConcurrency")) if self.provider.tool_config.get("maxConcurrency") else DEFAULT_MAX_CONCURRENCY
+        self.parse_json = self.provider.tool_config.get("parseJson") == "1" if self.provider.tool_config.get("parseJson") else False
+        self.json_columns = self.provider.tool_config.get("jsonColumns") if self.provider.tool_config.get("jsonColumns") else FLATTEN_COLUMNS
+        self.json_sample_rows = int(self.provider.tool_config.get("jsonSampleRows")) if self.provider.tool_config.get("jsonSampleRows") else DEFAULT_JSON_SAMPLE_ROWS
+        self.json_field_prefix = self.provider.tool_config.get("jsonFieldPrefix") if self.provider.tool_config.get("jsonFieldPrefix") else ""
+        self.pack_rows = self.provider.tool_config.get("packRows") == "1" if self.provider.tool_config.get("packRows") else False
+        self.pack_size = int(self.provider.tool_config.get("packSize")) if self.provider.tool_config.get("packSize") else DEFAULT_PACK_SIZE
+        self.pack_answer_tokens = int(self.provider.tool_config.get("packAnswerTokens")) if self.provider.tool_config.get("packAnswerTokens") else DEFAULT_PACK_ANSWER_TOKENS
 
         # log tool config
         self.provider.io.info(f"Tool Config: {json.dumps(self.provider.tool_config, indent=2)}")
+
+        # Structured output: the JSON schema only applies when a JSON response is enforced
+        self.json_schema = self.load_json_schema(self.json_schema_text) if self.enforceJsonResponse and self.json_schema_text else None
+        self.json_grammar = None
+        self.embedding_size = None
+        if self.operation == CLASSIFICATION_OPERATION and not self.labels:
+            raise RuntimeError("'labels' must list the classes of the Classification operation")
+        self.label_bias = None
+        self.label_ids = None
+        self.chat_formatter = None
         
         self.total_cost = 0
+        self.hedge_cost = 0
+        self.string_encoders = {}
+        self.chunked_rows = 0
+        self.chunk_count = 0
+        self.reduce_calls = 0
+        self.reduce_cost = 0
+        self.cached_prompt_tokens = 0
+        self.cache_savings = 0.0
         self.start_time = datetime.now()
+        # Measured throughput, recorded at the end of the run for the estimates of later dry runs
+        self.throughput_key = throughput_key(self.platform, self.endpoint, self.model)
+        self.processed_rows = 0
+        self.processed_prompt_tokens = 0
+        self.processed_completion_tokens = 0
+        self.processing_seconds = 0.0
+        self.run_plan = None
+        self.plan_encoder = None
+        if self.dry_run:
+            self.provider.io.info(f"Dry run: estimating tokens, cost and run time, no completion is requested")
+            if self.platform == "**Local Inference**":
+                prices = (0.0, 0.0)  # No cost for local inference
+            elif self.platform == "Others (Custom)":
+                prices = None
+            else:
+                prices = token_prices(self.model)
+            max_completion_tokens = {EMBEDDINGS_OPERATION: 0, CLASSIFICATION_OPERATION: 1}.get(self.operation, self.max_token)
+            self.run_plan = RunPlan(max_completion_tokens, prices)
+
+        if self.cascade_models:
+            self.provider.io.info(f"Cascade routing through: {' -> '.join(self.cascade_models)}")
+            validator_kwargs = {} if self.cascade_refusals else {"refusal_pattern": None}
+            self.cascade_validator = CascadeValidator(self.enforceJsonResponse, self.cascade_regex, self.cascade_min_confidence, **validator_kwargs)
+            self.cascade_stats = CascadeStats(self.cascade_models)
+        else:
+            self.cascade_validator = None
+            self.cascade_stats = None
+
+        self.circuit_breaker = CircuitBreaker(self.breaker_error_rate, self.breaker_window, on_open=self.on_circuit_open) if self.use_circuit_breaker else None
+        self.retry_policy = RetryPolicy(max_retries=self.num_retries, breaker=self.circuit_breaker)
+
+        # Hedged requests race on a background event loop so the losing request can be cancelled
+        if self.hedge_requests and self.platform != "**Local Inference**":
+            self.provider.io.info(f"Hedging requests slower than the p{self.hedge_percentile:g} latency (max {self.hedge_max_percent:g}% of requests)")
+            self.hedge_policy = HedgePolicy(self.hedge_percentile, self.hedge_max_percent)
+            self.event_loop = BackgroundEventLoop()
+        else:
+            self.hedge_policy = None
+            self.event_loop = None
+
+        # Deadlines and adaptive concurrency run the rows of remote and localhost completions concurrently on the event loop
+        concurrent_rows = not (self.platform == "**Local Inference**" or self.batch_processing or self.long_input or self.cascade_models or self.dry_run or self.operation != COMPLETION_OPERATION)
+
+        # The run deadline counts from the start of the tool, rows still running at the cutoff are cancelled
+        self.deadline = None
+        self.status_counts = Counter()
+        if self.run_deadline or self.row_deadline:
+            if not concurrent_rows:
+                self.provider.io.info(f"Deadlines apply to row-by-row remote completions, rows are processed without a deadline")
+            else:
+                self.provider.io.info(f"Run deadline: {self.run_deadline or 'none'}s, row deadline: {self.row_deadline or 'none'}s, {self.deadline_concurrency} concurrent requests")
+                self.deadline = RunDeadline(self.run_deadline, self.row_deadline)
+
+        # The number of requests in flight follows the latency and overload signals of the provider
+        self.concurrency_controller = None
+        if self.adaptive_concurrency:
+            if not concurrent_rows:
+                self.provider.io.info(f"Adaptive concurrency applies to row-by-row remote completions")
+            else:
+                self.provider.io.info(f"Adaptive concurrency from {DEFAULT_INITIAL_CONCURRENCY} up to {self.max_concurrency} requests in flight")
+                self.concurrency_controller = AIMDController(max_limit=self.max_concurrency)
+
+        # Worker pool time of the bucketed batches, measured and estimated in input order from the row times
+        self.bucketed_rows = 0
+        self.bucketed_seconds = 0.0
+        self.input_order_seconds = 0.0
+        self.longest_first_seconds = 0.0
+
+        # Short rows are sent as numbered items of one request, the JSON array answer is split back into rows
+        self.packed_requests = 0
+        self.packed_rows = 0
+        self.resent_rows = 0
+        if self.pack_rows:
+            if not concurrent_rows or self.deadline or self.concurrency_controller or self.enforceJsonResponse:
+                self.provider.io.info(f"Packing applies to row-by-row remote completions without deadlines, adaptive concurrency or enforced JSON responses")
+                self.pack_rows = False
+            else:
+                self.provider.io.info(f"Packing up to {self.pack_size} rows per request, {self.pack_answer_tokens} completion tokens per row")
+                self.pack_prices = token_prices(self.model) if not self.platform == "Others (Custom)" else None
+
+        if (self.deadline or self.concurrency_controller) and self.event_loop is None:
+            self.event_loop = BackgroundEventLoop()
+
+        # JSON responses are parsed per record batch into typed columns of one schema for the whole run
+        self.json_parser = None
+        if self.parse_json:
+            if self.operation != COMPLETION_OPERATION or self.dry_run:
+                self.provider.io.info(f"JSON parsing applies to the responses of completions")
+            else:
+                if self.json_columns not in (FLATTEN_COLUMNS, STRUCT_COLUMNS):
+                    raise RuntimeError(f"'jsonColumns' must be '{FLATTEN_COLUMNS}' or '{STRUCT_COLUMNS}'")
+                try:
+                    schema = arrow_schema(self.json_schema) if self.json_schema else None
+                except ValueError as e:
+                    raise RuntimeError(f"'jsonSchema' cannot be parsed into columns: {str(e)}")
+                self.json_parser = JsonResponseParser(schema, self.json_sample_rows)
+                source = "the JSON schema" if schema is not None else f"the first {self.json_sample_rows} responses"
+                self.provider.io.info(f"Parsing JSON responses into {self.json_columns} columns typed from {source}")
 
         self.max_log_size = 10 * 1024 * 1024  # 10MB in bytes
         self.log_file = None
+        # Pipeline workers, chunk requests and litellm callbacks log and add to the run totals from several threads
+        self.log_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
         self.create_new_log_file()
 
+        # Profile files are written next to the cost log
+        self.profiler = None
+        if self.profile:
+            profile_prefix = self.log_path[:-len(".log")].replace("llm_connect_cost_", "llm_connect_profile_")
+            self.profiler = RunProfiler(self.profile, profile_prefix, trace_memory=self.profile_memory)
+            self.provider.io.info(f"Profiling record batches with the {self.profile} profiler" + (" and tracemalloc" if self.profile_memory else ""))
+
         litellm.drop_params = True
         litellm.set_verbose=True ##litellm.set_verbose=False
         # Set litellm global params
@@ -109,11 +339,21 @@ class LLMConnect(PluginV2):
             litellm.disable_cache() 
         
         # Add logic to handle local inference
+        self.llama = None
+        self.llama_kwargs = None
+        self.model_info = None
+        self.gguf_index = GGUFIndex()
+        self.worker_pool = None
+        self.image_preprocessor = None
+        self.image_cache = None
+        self.tokenizer_llama = None
+        self.prompt_codec = None
+        self.daemon = None
         if self.platform == "**Local Inference**":
             try:
                 # List and check GPU resources if GPU offload is requested
                 self.provider.io.info(f"Using local inference")
-                self.list_gpu_resources()
+                gpus = self.list_gpu_resources()
                 if not self.check_gpu_support():
                         self.provider.io.info(f"GPU offload requested but not supported. Falling back to CPU inference.")
                         self.gpu_offload = False
@@ -124,45 +364,168 @@ class LLMConnect(PluginV2):
                     self.provider.io.info(f"Error: No main model GGUF found in '{self.model}'.")
                 if not os.path.exists(model_path):
                     self.provider.io.info(f"Error: Model file not found at '{model_path}'.")
-                    
+
                 # Check requested context window length against model max context length if possible
+                self.model_info = self.describe_model(model_path)
+                if self.auto_gpu_layers and self.gpu_offload:
+                    self.n_gpu_layers = self.auto_gpu_layer_count(gpus)
                 gpu_layers_label = "all" if self.n_gpu_layers == -1 else ("none (CPU)" if self.n_gpu_layers == 0 else str(self.n_gpu_layers))
                 self.provider.io.info(f"Loading model from: {model_path}")
                 if clip_model_path:
                     self.provider.io.info(f"Multimodal projector: {clip_model_path}")
                 self.provider.io.info(f"Initializing with {self.input_context_length} context window, GPU layers: {gpu_layers_label}... (this may take a moment)")
-                
-                if self.gpu_offload:
-                    self.provider.io.info(f"Using GPU offload")
-                    self.llama = Llama(
-                        model_path=model_path,
-                        clip_model_path=clip_model_path,
-                        n_gpu_layers=self.n_gpu_layers,
-                        split_mode=LLAMA_SPLIT_MODE_LAYER,
-                        seed=self.seed,
-                        main_gpu=self.main_gpu,
-                        n_ctx=self.input_context_length,
-                        flash_attn=True,
-                        verbose=False,
-                    )
+
+                self.llama_kwargs = {
+                    "model_path": model_path,
+                    "clip_model_path": clip_model_path,
+                    "n_gpu_layers": self.n_gpu_layers if self.gpu_offload else 0,
+                    "split_mode": LLAMA_SPLIT_MODE_LAYER,
+                    "seed": self.seed,
+                    "main_gpu": MAIN_GPU,
+                    "n_ctx": self.input_context_length,
+                    "flash_attn": True,
+                    "verbose": False,
+                }
+                if self.operation == EMBEDDINGS_OPERATION:
+                    self.llama_kwargs["embedding"] = True
+                if LOCAL_CASCADE_TIER in self.cascade_models and self.cascade_min_confidence is not None:
+                    # llama.cpp only returns log probabilities when it keeps the logits of every token
+                    self.llama_kwargs["logits_all"] = True
+                self.provider.io.info(f"Using GPU offload" if self.gpu_offload else f"Using CPU")
+
+                if self.auto_tune:
+                    tuned_settings = self.tuned_llama_settings()
+                    self.llama_kwargs.update(tuned_settings)
+                    if self.local_threads_per_worker is None:
+                        self.local_threads_per_worker = tuned_settings["n_threads"]
+
+                use_vision = bool(self.image_field and clip_model_path and self.operation != EMBEDDINGS_OPERATION)
+                if self.image_field and not clip_model_path:
+                    self.provider.io.warn(f"'{self.image_field}' images are ignored: no mmproj projector GGUF found next to the model.")
+
+                # The worker processes serve text chat completions, embeddings, classification and images use the in-process model
+                if self.dry_run:
+                    self.provider.io.info(f"Dry run: only the model vocabulary is loaded")
+                elif self.local_workers > 1 and self.operation == COMPLETION_OPERATION and not use_vision:
+                    self.provider.io.info(f"Starting {self.local_workers} local inference worker processes")
+                    self.worker_pool = LocalWorkerPool(self.llama_kwargs, self.local_workers, self.local_threads_per_worker, on_warning=self.provider.io.info)
+                elif self.use_daemon and self.operation == COMPLETION_OPERATION and not use_vision:
+                    # The daemon keeps the model loaded for the next workflow runs
+                    self.daemon = DaemonClient(self.daemon_idle_minutes, on_info=self.provider.io.info, max_models=self.daemon_max_models)
+                    already_loaded, seconds = self.daemon.load(self.llama_kwargs)
+                    self.provider.io.info("Model already loaded in the inference daemon" if already_loaded else f"Model loaded in the inference daemon in {seconds:.1f}s")
                 else:
-                    self.provider.io.info(f"Using CPU")
-                    self.llama = Llama(
-                        model_path=model_path,
-                        clip_model_path=clip_model_path,
-                        n_gpu_layers=0,
-                        split_mode=LLAMA_SPLIT_MODE_LAYER,
-                        seed=self.seed,
-                        main_gpu=0,
-                        n_ctx=self.input_context_length,
-                        flash_attn=True,
-                        verbose=False,
-                    )
+                    if use_vision:
+                        self.provider.io.info(f"Using {self.vision_chat_handler} with images from '{self.image_field}'")
+                        self.image_preprocessor = ImagePreprocessor(self.image_max_size)
+                        self.image_cache = ImageEncodingCache(self.image_cache_mb * 1024 * 1024)
+                        self.llama_kwargs["chat_handler"] = create_vision_handler(self.vision_chat_handler, clip_model_path, self.image_cache, on_warning=self.provider.io.warn)
+                    self.llama = Llama(**self.llama_kwargs)
+                    if self.operation == CLASSIFICATION_OPERATION:
+                        self.label_ids = self.local_label_token_ids()
+
+                # Compile the JSON grammar once per run, it is reused for every row
+                if self.enforceJsonResponse and self.operation != EMBEDDINGS_OPERATION:
+                    self.json_grammar = self.compile_json_grammar()
             except Exception as e:
                 self.provider.io.error(f"Error initializing local inference: {str(e)}")
         else:
-            self.llama = None
             self.provider.io.info(f"Using remote inference")
+            if self.operation == CLASSIFICATION_OPERATION:
+                self.label_bias = openai_label_bias(self.model, self.labels)
+                if self.label_bias:
+                    self.provider.io.info(f"Restricting the first answer token to the {len(self.labels)} labels with logit_bias")
+
+        if self.long_input and not self.map_instruction and not (self.use_system_prompt and self.system_prompt):
+            self.provider.io.info(f"Long input: only the first chunk of a row holds an instruction written in its prompt, set 'mapInstruction' or a system prompt to give every chunk the task")
+
+        # Batch completions already send every row of a batch at once, only the worker processes take rows in turn
+        if self.length_bucketing and self.worker_pool is None:
+            self.provider.io.info("Length bucketing applies to the local worker pool, rows are sent in input order")
+
+        # The local cascade tier answers with the model of the tool, its worker processes or the inference daemon
+        if LOCAL_CASCADE_TIER in self.cascade_models and not self.dry_run and self.llama is None and self.worker_pool is None and self.daemon is None:
+            raise RuntimeError(f"The '{LOCAL_CASCADE_TIER}' cascade tier needs a model loaded with the Local Inference platform, list only remote models in 'cascadeModels' otherwise")
+
+        if self.prompt_from_file:
+            self.provider.io.info(f"Reading each prompt from the file named in '{self.prompt_field}' when its row is sent" + (f", up to {self.prompt_file_tokens} tokens" if self.prompt_file_tokens else ""))
+
+        # Full output rows go to the sidecar file, Designer only gets their keys and status
+        self.sidecar = None
+        if self.sidecar_path:
+            if self.dry_run:
+                self.provider.io.info(f"Dry run: the plan is written to the output, not to the sidecar file")
+            else:
+                sidecar_path = os.path.expanduser(self.sidecar_path)
+                file_format = sidecar_format(sidecar_path, self.sidecar_format)
+                self.sidecar = SidecarWriter(sidecar_path, file_format, self.sidecar_compression, self.sidecar_row_group_rows)
+                self.provider.io.info(f"Writing output rows to the {file_format} sidecar file {sidecar_path}, the output carries {', '.join([ROW_ID_COLUMN] + self.sidecar_keys + ['status'])}")
+
+        # Rows of consecutive record batches share one pool of requests, only row-by-row remote requests are pipelined
+        self.pipeline = None
+        if self.use_pipeline:
+            if self.platform == "**Local Inference**" or self.batch_processing or self.long_input or self.dry_run or self.deadline or self.concurrency_controller or self.pack_rows or self.operation == EMBEDDINGS_OPERATION:
+                self.provider.io.info(f"Pipelining applies to row-by-row remote requests, record batches are processed one at a time")
+            else:
+                self.provider.io.info(f"Pipelining record batches on {self.pipeline_workers} request workers (up to {self.pipeline_memory_mb} MB of queued input)")
+                self.pipeline = OrderedPipeline(
+                    self.classify_row if self.operation == CLASSIFICATION_OPERATION else (self.process_row_cascade if self.cascade_models else self.process_row),
+                    self.on_pipeline_output,
+                    workers=self.pipeline_workers,
+                    max_bytes=self.pipeline_memory_mb * 1024 * 1024,
+                )
+
+    def tuned_llama_settings(self):
+        """Return the auto-tuned thread and batch settings for this host and model, calibrating on first use."""
+        key = tuning_key(self.llama_kwargs["model_path"], self.llama_kwargs["n_gpu_layers"])
+        settings = load_tuning(key)
+        if settings:
+            self.provider.io.info(f"Using auto-tuned settings: {settings}")
+            return settings
+
+        # Each worker process gets its own share of the CPUs
+        max_threads = max(1, len(available_cpus()) // max(1, self.local_workers))
+        self.provider.io.info(f"Auto-tuning local inference with a {self.auto_tune_prompt_length} token prompt (runs once per host and model)...")
+        settings, measurements = autotune(
+            Llama, self.llama_kwargs, max_threads,
+            prompt_tokens=self.auto_tune_prompt_length,
+            decode_tokens=self.auto_tune_decode_tokens,
+            on_progress=self.provider.io.info,
+        )
+        save_tuning(key, settings, measurements)
+        self.provider.io.info(f"Auto-tuned settings saved: {settings}")
+        return settings
+
+    def load_json_schema(self, schema_text):
+        """Parse the configured JSON schema used for structured output."""
+        try:
+            schema = json.loads(schema_text)
+        except json.JSONDecodeError as e:
+            raise RuntimeError(f"'jsonSchema' is not valid JSON: {str(e)}")
+        if not isinstance(schema, dict):
+            raise RuntimeError("'jsonSchema' must be a JSON object describing the response schema")
+        return schema
+
+    def compile_json_grammar(self):
+        """Compile the llama.cpp GBNF grammar that constrains local decoding to valid JSON."""
+        if self.json_schema is None:
+            self.provider.io.info(f"Constraining local decoding with the generic JSON grammar")
+            return LlamaGrammar.from_string(JSON_GBNF, verbose=False)
+        self.provider.io.info(f"Compiling JSON schema to a GBNF grammar")
+        return LlamaGrammar.from_json_schema(json.dumps(self.json_schema), verbose=False)
+
+    def remote_response_format(self):
+        """Return the `response_format` sent to remote providers when a JSON response is enforced."""
+        if self.json_schema is None:
+            return {"type": "json_object"}
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "llm_connect_response",
+                "schema": self.json_schema,
+                "strict": True,
+            },
+        }
 
     def check_gpu_support(self):
         if not _llama_cpp.llama_supports_gpu_offload():
@@ -171,35 +534,98 @@ class LLMConnect(PluginV2):
         return True
 
     def list_gpu_resources(self):
+        """Report the NVIDIA GPUs and their free memory, returning them for layer placement."""
         try:
-            result = subprocess.run(
-                ["nvidia-smi", "--query-gpu=index,name,memory.total,memory.free", "--format=csv,noheader,nounits"],
-                stdin=subprocess.DEVNULL, capture_output=True, text=True, check=True,
-            )
+            gpus = parse_nvidia_smi(query_nvidia_smi())
             self.provider.io.info(f"Available GPUs:")
-            for line in result.stdout.strip().splitlines():
-                idx, name, total, free = [s.strip() for s in line.split(",")]
-                self.provider.io.info(f"  [{idx}] {name} — {int(free):,} / {int(total):,} MiB free")
+            for gpu in gpus:
+                self.provider.io.info(f"  [{gpu['index']}] {gpu['name']} — {gpu['free_mib']:,} / {gpu['total_mib']:,} MiB free")
+            return gpus
         except FileNotFoundError:
             self.provider.io.info("GPU info: nvidia-smi not found (no NVIDIA driver or non-NVIDIA GPU).")
         except subprocess.CalledProcessError as e:
             self.provider.io.info(f"GPU info: nvidia-smi error — {e.stderr.strip()}")
-    
+        return []
+
+    def auto_gpu_layer_count(self, gpus):
+        """Compute the largest safe `n_gpu_layers` from the GGUF layer sizes, the KV cache and the `gpuMemory` budget."""
+        if not gpus or not self.model_info or not self.model_info["block_count"]:
+            self.provider.io.info(f"Automatic GPU layer placement needs nvidia-smi and a readable GGUF header, keeping {self.n_gpu_layers} GPU layers.")
+            return self.n_gpu_layers
+        # Layers are split across every visible GPU
+        free_mib = sum(gpu["free_mib"] for gpu in gpus)
+        layers, used = plan_gpu_layers(self.model_info, self.input_context_length, free_mib, self.gpu_memory)
+        self.provider.io.info(
+            f"Automatic GPU layer placement: {'all' if layers == -1 else layers} of {self.model_info['block_count']} layers "
+            f"({used / 1024 ** 3:.2f} GiB) within {self.gpu_memory}% of {free_mib:,} MiB free VRAM"
+        )
+        return layers
+
     def find_model_files(self, model_dir):
-        """Return (main_model_path, clip_model_path) from a folder of GGUF files."""
+        """Return (main_model_path, clip_model_path) from a folder of GGUF files or a selected GGUF file."""
+        selected = None
         if os.path.isfile(model_dir):
+            if model_dir.endswith(".gguf") and "mmproj" not in os.path.basename(model_dir).lower():
+                selected = os.path.basename(model_dir)
             model_dir = os.path.dirname(model_dir)
         try:
-            files = [f for f in os.listdir(model_dir) if f.endswith(".gguf")]
+            files = sorted(f for f in os.listdir(model_dir) if f.endswith(".gguf"))
         except FileNotFoundError:
             return None, None
         mmproj = next((f for f in files if "mmproj" in f.lower()), None)
-        main   = next((f for f in files if "mmproj" not in f.lower()), None)
+        main   = selected or self.choose_quantization(model_dir, [f for f in files if "mmproj" not in f.lower()])
         return (
             os.path.join(model_dir, main)   if main   else None,
             os.path.join(model_dir, mmproj) if mmproj else None,
         )
-        
+
+    def choose_quantization(self, model_dir, files):
+        """Pick the GGUF file matching the `quantization` setting among several quantizations of a model."""
+        if not self.quantization or len(files) < 2:
+            return next(iter(files), None)
+        available = {}
+        for f in files:
+            try:
+                available[f] = self.gguf_index.get(os.path.join(model_dir, f))["quantization"] or ""
+            except Exception as e:
+                self.provider.io.info(f"Could not read GGUF header of '{f}': {str(e)}")
+                available[f] = ""
+        wanted = self.quantization.upper()
+        match = next((f for f, quant in available.items() if quant.upper() == wanted), None)
+        if match is None:
+            match = next((f for f in files if wanted in f.upper()), None)
+        if match is None:
+            self.provider.io.info(f"No '{self.quantization}' model found, available quantizations: {', '.join(sorted(set(available.values())))}")
+            return files[0]
+        return match
+
+    def describe_model(self, model_path):
+        """Report the GGUF header metadata and clamp the context length to what the model was trained for."""
+        try:
+            info = self.gguf_index.get(model_path)
+        except Exception as e:
+            self.provider.io.info(f"Could not read GGUF header of '{model_path}': {str(e)}")
+            return None
+
+        gib = 1024 ** 3
+        self.provider.io.info(
+            f"Model: {info['architecture']} '{info['name']}', {info['quantization']}, {info['block_count']} layers, "
+            f"trained context {info['context_length']}, weights {info['tensor_bytes'] / gib:.2f} GiB"
+        )
+        if info["context_length"] and self.input_context_length > info["context_length"]:
+            self.provider.io.warn(
+                f"Requested context length {self.input_context_length} exceeds the model maximum of "
+                f"{info['context_length']}, using {info['context_length']}."
+            )
+            self.input_context_length = info["context_length"]
+        kv_bytes = kv_cache_bytes(info, self.input_context_length)
+        if kv_bytes is not None:
+            self.provider.io.info(
+                f"Estimated memory to load: {(info['tensor_bytes'] + kv_bytes) / gib:.2f} GiB "
+                f"(KV cache for {self.input_context_length} tokens: {kv_bytes / gib:.2f} GiB)"
+            )
+        return info
+
     def create_new_log_file(self):
         if self.log_file:
             self.log_file.close()
@@ -227,35 +653,103 @@ class LLMConnect(PluginV2):
             self.create_new_log_file()
 
     def my_custom_logging_fn(self, model_call_dict):
-        self.check_log_size()
-        self.log_file.write(f"model call log details: {model_call_dict}\n")
-        self.log_file.flush()  # Ensure the data is written to the file
+        # The log file may be rotated, so the size check and the write hold the same lock
+        with self.log_lock:
+            self.check_log_size()
+            self.log_file.write(f"model call log details: {model_call_dict}\n")
+            self.log_file.flush()  # Ensure the data is written to the file
+
+    def add_cost(self, cost, hedge_cost=0):
+        """Add the cost of a request, and of the cancelled request it was hedged with, to the run totals."""
+        with self.stats_lock:
+            self.total_cost += cost + hedge_cost
+            self.hedge_cost += hedge_cost
+
+    def local_completion_kwargs(self, row, image_url=None, prompt_read=False):
+        """Build the llama.cpp chat completion arguments for a single prompt, with an optional image data URI.
 
-    def process_row_locally(self, row):
-        """Process a single row of data through the LLM. instantiated locally using llama.cpp"""
+        With `prompt_read`, the row already holds the text of its prompt file.
+        """
+        row = row if prompt_read else self.prompt_text(row)
+        content = row
+        if image_url:
+            content = [
+                {"type": "image_url", "image_url": {"url": image_url}},
+                {"type": "text", "text": row}
+            ]
         if self.use_system_prompt:
             messages = [
                 {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": row}
+                {"role": "user", "content": content}
             ]
         else:
-            messages = [{"role": "user", "content": row}]
-        
+            messages = [{"role": "user", "content": content}]
+
+        completion_kwargs = {
+            "messages": messages,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "max_tokens": self.max_token,
+            "stop": self.stop,
+            "seed": self.seed,
+            "stream": False
+        }
+
+        if self.enforceJsonResponse:
+            # The precompiled grammar replaces `response_format`, which would rebuild it on every call
+            completion_kwargs["grammar"] = self.json_grammar
+        return completion_kwargs
+
+    def prompt_text(self, row):
+        """Return the prompt of a row: the row itself, or the text of the file it names when prompts are read from files.
+
+        Files are only read here, as their row is sent, so the tool holds the text of the rows
+        in flight rather than of the whole input. Long inputs are read for the whole record batch
+        before chunking, their rows already hold the text.
+        """
+        if not self.prompt_from_file or self.long_input:
+            return row
+        return self.read_prompt(row)
+
+    def read_prompt(self, path):
+        """Read the prompt file of a row, up to `promptFileTokens` tokens."""
+        if not isinstance(path, str):
+            return path
+        if self.prompt_file_tokens and self.prompt_codec is None:
+            self.prompt_codec = self.token_codec()
+        return read_prompt_file(path, self.prompt_file_tokens, self.prompt_codec)
+
+    def read_prompts(self, paths):
+        """Read the prompt files of a whole column, None for the files that cannot be read."""
+        texts = []
+        for path in paths:
+            try:
+                texts.append(self.read_prompt(path))
+            except OSError as e:
+                if self.on_error == "error":
+                    self.provider.io.error(f"Error reading prompt file: {str(e)}")
+                    raise
+                self.provider.io.info(f"Error reading prompt file: {str(e)}")
+                texts.append(None)
+        return texts
 
+    def estimate_prompt_tokens(self, row):
+        """Cheap estimate of the prompt tokens of a row, from the file size when prompts are read from files."""
+        if self.prompt_from_file and not self.long_input:
+            return estimate_file_tokens(row, self.prompt_file_tokens)
+        return estimate_tokens(row)
+
+    def process_row_locally(self, row, image=None):
+        """Process a single row of data through the LLM. instantiated locally using llama.cpp
+
+        `image` is the future of the row's preprocessed image, if any.
+        """
         try:
-            self.provider.io.info(f"Requesting messages: {json.dumps(messages, indent=2)}")
-            completion_kwargs = {
-                "messages": messages,
-                "temperature": self.temperature,
-                "top_p": self.top_p,
-                "max_tokens": self.max_token,
-                "stop": self.stop,
-                "seed": self.seed,
-                "stream": False
-            }
-            
-            if self.enforceJsonResponse:
-                completion_kwargs["response_format"] = {"type": "json_object"}
+            completion_kwargs = self.local_completion_kwargs(row, image.result() if image else None)
+            if image:
+                self.provider.io.info(f"Requesting prompt with an image: {row}")
+            else:
+                self.provider.io.info(f"Requesting messages: {json.dumps(completion_kwargs['messages'], indent=2)}")
 
             if self.simulate_response:
                 output_content = self.simulate_response_text
@@ -289,8 +783,134 @@ class LLMConnect(PluginV2):
                 })
 
 
-    def process_row(self, row):
-        """Process a single row of data through the LLM."""
+    def process_rows_with_images(self, prompts, images):
+        """Process prompts with their images, preparing every image in the background before the rows run."""
+        futures = [self.image_preprocessor.prefetch(image) if pd.notna(image) else None for image in images]
+        results = [self.process_row_locally(prompt, future) for prompt, future in zip(prompts, futures)]
+        self.provider.io.info(
+            f"Image encodings reused from cache: {self.image_cache.hits}, encoded: {self.image_cache.misses}"
+        )
+        return pd.DataFrame(results, index=prompts.index)
+
+    def daemon_chat(self, messages_list):
+        """Run chat completions of message lists on the inference daemon, with the sampling settings and grammar of the tool."""
+        completion_kwargs = self.local_completion_kwargs(None)
+        params = {key: completion_kwargs[key] for key in ("temperature", "top_p", "max_tokens", "stop", "seed")}
+        grammar = None
+        if self.enforceJsonResponse:
+            grammar = json.dumps(self.json_schema) if self.json_schema is not None else "json"
+        return self.daemon.chat(self.llama_kwargs, messages_list, params, grammar, cache=self.use_caching)
+
+    def process_rows_with_daemon(self, prompts):
+        """Process a column of prompts with the model held by the inference daemon."""
+        read_files = self.prompt_from_file and not self.long_input
+        texts = self.read_prompts(prompts) if read_files else prompts.tolist()
+        # Rows whose prompt file could not be read are not sent, their response stays empty
+        sent = [position for position, text in enumerate(texts) if not (read_files and text is None)]
+        columns = {name: [None] * len(texts) for name in (self.response_column_name, 'prompt_tokens', 'completion_tokens', 'cost($)')}
+        if not sent:
+            return pd.DataFrame(columns, index=prompts.index)
+        responses = self.daemon_chat([self.local_completion_kwargs(texts[position], prompt_read=True)["messages"] for position in sent])
+
+        errors = responses.column("error").to_pylist()
+        for error in errors:
+            if error is None:
+                continue
+            if self.on_error == "error":
+                self.provider.io.error(f"Error in completion: {error}")
+                raise RuntimeError(error)
+            self.provider.io.info(f"Error in completion: {error}")
+        contents = responses.column("content").to_pylist()
+        prompt_tokens = responses.column("prompt_tokens").to_pylist()
+        completion_tokens = responses.column("completion_tokens").to_pylist()
+        for row, position in enumerate(sent):
+            columns[self.response_column_name][position] = contents[row]
+            columns['prompt_tokens'][position] = prompt_tokens[row]
+            columns['completion_tokens'][position] = completion_tokens[row]
+            columns['cost($)'][position] = None if errors[row] else 0  # No cost for local inference
+        return pd.DataFrame(columns, index=prompts.index)
+
+    def worker_completion_kwargs(self, row):
+        """Build the completion arguments of a row for the worker processes.
+
+        A prompt file is named rather than read, the worker taking the row reads it, so the
+        tool does not hold the text of every file of the batch at once.
+        """
+        if not self.prompt_from_file or self.long_input or not isinstance(row, str):
+            return self.local_completion_kwargs(row)
+        completion_kwargs = self.local_completion_kwargs("", prompt_read=True)
+        completion_kwargs[PROMPT_FILE_KEY] = (row, self.prompt_file_tokens)
+        return completion_kwargs
+
+    def process_rows_with_worker_pool(self, prompts):
+        """Process a column of prompts on the local worker processes, keeping the row order."""
+        self.provider.io.info(f"Dispatching {len(prompts)} rows to {self.local_workers} local workers.")
+        started = time.perf_counter()
+        if self.length_bucketing:
+            # Longest rows go first so a long row picked up last does not leave the other workers idle
+            order = longest_first([self.estimate_prompt_tokens(prompt) for prompt in prompts])
+            ordered = self.worker_pool.map([self.worker_completion_kwargs(prompts.iloc[position]) for position in order])
+            responses = [None] * len(prompts)
+            row_seconds = [0.0] * len(prompts)
+            for position, response, seconds in zip(order, ordered, self.worker_pool.row_seconds):
+                responses[position] = response
+                row_seconds[position] = seconds
+            self.report_bucketing(len(prompts), time.perf_counter() - started, row_seconds, order)
+        else:
+            responses = self.worker_pool.map([self.worker_completion_kwargs(prompt) for prompt in prompts])
+            seconds = time.perf_counter() - started
+            if seconds > 0:
+                self.provider.io.info(f"Local workers: {len(prompts)} rows in {seconds:.2f}s ({len(prompts) / seconds:.1f} rows/s)")
+
+        results = []
+        for response in responses:
+            if isinstance(response, Exception):
+                if self.on_error == "error":
+                    self.provider.io.error(f"Error in completion: {str(response)}")
+                    raise response
+                self.provider.io.info(f"Error in completion: {str(response)}")
+                results.append({
+                    self.response_column_name: None,
+                    'prompt_tokens': None,
+                    'completion_tokens': None,
+                    'cost($)': None
+                })
+            else:
+                results.append({
+                    self.response_column_name: response["choices"][0]["message"]["content"],
+                    'prompt_tokens': response["usage"]["prompt_tokens"],
+                    'completion_tokens': response["usage"]["completion_tokens"],
+                    'cost($)': 0  # No cost for local inference
+                })
+        return pd.DataFrame(results, index=prompts.index)
+
+    def report_bucketing(self, rows, seconds, row_seconds, order):
+        """Report the throughput of a bucketed worker pool batch against the same rows sent in input order.
+
+        Both orders are replayed from the time each row took in its worker, so the comparison
+        leaves out the queueing and transfer time that only the measured time includes.
+        """
+        input_order = makespan(row_seconds, self.local_workers)
+        longest_first_order = makespan(row_seconds, self.local_workers, order)
+        self.bucketed_rows += rows
+        self.bucketed_seconds += seconds
+        self.input_order_seconds += input_order
+        self.longest_first_seconds += longest_first_order
+        if seconds > 0 and longest_first_order > 0:
+            self.provider.io.info(
+                f"Length bucketing: {rows} rows in {seconds:.2f}s ({rows / seconds:.1f} rows/s), "
+                f"about {input_order / longest_first_order - 1:+.0%} throughput against input order (estimated {input_order:.2f}s from the row times)"
+            )
+
+    def remote_completion_kwargs(self, row, model=None, labels=None, packed_items=0):
+        """Build the litellm completion arguments for a single prompt, sent to `model` or the configured model.
+
+        With `labels`, the system message holds the classification instruction. With
+        `packed_items`, the prompt holds that many numbered rows and the system message the
+        packing instruction.
+        """
+        model = model or self.model
+        row = row if packed_items else self.prompt_text(row)
         if self.use_system_prompt:
             messages = [
                 {"role": "system", "content": self.system_prompt},
@@ -298,90 +918,784 @@ class LLMConnect(PluginV2):
             ]
         else:
             messages = [{"role": "user", "content": row}]
-        messages = trim_messages(messages, self.model)
+        if labels:
+            messages = with_instruction(messages, labels)
+        if packed_items:
+            messages = with_pack_instruction(messages, packed_items)
+        messages = self.cacheable_messages(trim_messages(messages, model), model)
+
+        completion_kwargs = {
+            "model": model,
+            "messages": messages,
+            "temperature": self.temperature,
+            # "top_p": self.top_p,
+            "max_tokens": self.max_token,
+            "stop": self.stop,
+            "seed": self.seed,
+            "timeout": DEFAULT_REQUEST_TIMEOUT,
+            "stream": False,
+            "drop_params": True,
+            # Retries are handled by the retry policy
+            "num_retries": 0,
+            "max_retries": 0,
+            "logger_fn": self.my_custom_logging_fn,
+        }
 
+        if self.use_caching:
+            completion_kwargs["caching"] = True
+        else:
+            completion_kwargs["caching"] = False
+
+        if self.enforceJsonResponse:
+            completion_kwargs["response_format"] = self.remote_response_format()
+
+        if self.simulate_response:
+            completion_kwargs["mock_response"] = self.simulate_response_text
+
+        if self.platform == "Others (Custom)":
+            completion_kwargs["base_url"] = self.endpoint
+            if self.use_api_key:
+                completion_kwargs["api_key"] = self.api_keys
+        return completion_kwargs
+
+    def process_row(self, row):
+        """Process a single row of data through the LLM."""
         try:
-            self.provider.io.info(f"Requesting messages: {json.dumps(messages, indent=2)}")
-            completion_kwargs = {
-                "model": self.model,
-                "messages": messages,
-                "temperature": self.temperature,
-                # "top_p": self.top_p,
-                "max_tokens": self.max_token,
-                "stop": self.stop,
-                "seed": self.seed,
-                "timeout": 60,
-                "stream": False,
-                "drop_params": True,
-                # "num_retries": 100, #self.num_retries,
-                "logger_fn": self.my_custom_logging_fn,
-            }
+            completion_kwargs = self.remote_completion_kwargs(row)
+            self.provider.io.info(f"Requesting messages: {json.dumps(completion_kwargs['messages'], indent=2)}")
 
-            if self.use_caching:
-                completion_kwargs["caching"] = True
+            # self.provider.io.info(f"Sending request...")
+            response, hedge_cost = self.send_completion(completion_kwargs)
+            # self.provider.io.info(f"Response received.")
+            return self.response_row(response, hedge_cost)
+
+        except Exception as e:
+            if self.on_error == "error":
+                self.provider.io.error(f"Error in completion: {str(e)}")
+                raise
             else:
-                completion_kwargs["caching"] = False
+                self.provider.io.info(f"Error in completion: {str(e)}")
+                return self.empty_row()
+
+    def send_completion(self, completion_kwargs):
+        """Send a remote completion through the retry policy, hedged when configured, and return the response and hedge cost."""
+        if self.hedge_policy:
+            return self.hedged_completion(completion_kwargs)
+        return self.retry_policy.call(lambda: completion(**completion_kwargs)), 0
+
+    def cacheable_messages(self, messages, model):
+        """Mark the static system prefix for providers that only cache marked prompt prefixes.
+
+        The system prompt comes first in every request, so providers caching prefixes on their
+        own reuse it too.
+        """
+        if self.prompt_caching and needs_cache_control(model):
+            return with_cache_control(messages)
+        return messages
+
+    def count_cached_tokens(self, response, model=None):
+        """Return the prompt tokens of a response read from the provider cache and add them to the run totals.
 
+        `completion_cost` already prices cached tokens at the cache read rate.
+        """
+        cached, written = cached_token_counts(response.usage)
+        savings = 0.0
+        if not self.simulate_response and not self.platform == "Others (Custom)":
+            savings = cache_savings(model or self.model, cached, written)
+        with self.stats_lock:
+            self.cached_prompt_tokens += cached
+            self.cache_savings += savings
+        return cached
+
+    def response_row(self, response, hedge_cost=0):
+        """Build the output row of a completion response and add its cost to the run total."""
+        output_content = response.choices[0].message.content
+        prompt_tokens = response.usage.prompt_tokens
+        completion_tokens = response.usage.completion_tokens
+        cost = self.response_cost(response)
+
+        return pd.Series({
+            self.response_column_name: output_content,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cached_tokens': self.count_cached_tokens(response),
+            'cost($)': cost + hedge_cost
+        })
+
+    def response_cost(self, response, model=None):
+        """Return the cost of a completion response and add it to the run total."""
+        if not self.simulate_response and not self.platform == "Others (Custom)":
+            try:
+                cost = completion_cost(completion_response=response)
+                self.add_cost(cost)
+            except Exception as e:
+                self.provider.io.info(f"Model {model or self.model} does not support cost calculation.")
+                cost = 0 # Set cost to 0 if model does not support cost calculation
+        else:
+            cost = 0 # Set cost to 0 for simulated responses
+        return cost
+
+    def empty_row(self):
+        return pd.Series({
+            self.response_column_name: None,
+            'prompt_tokens': None,
+            'completion_tokens': None,
+            'cached_tokens': None,
+            'cost($)': None
+        })
+
+    async def aprocess_row(self, row):
+        """Send the completion of a single row on the event loop and return the response and hedge cost."""
+        completion_kwargs = self.remote_completion_kwargs(row)
+        if self.hedge_policy:
+            return await self.ahedged_completion(completion_kwargs)
+        return await self.retry_policy.acall(lambda: self.observed_acompletion(completion_kwargs)), 0
+
+    async def observed_acompletion(self, completion_kwargs):
+        """Send one completion attempt and report its latency, rate limit or timeout to the concurrency controller."""
+        if not self.concurrency_controller:
+            return await acompletion(**completion_kwargs)
+        controller = self.concurrency_controller
+        sent_at = controller.clock()
+        try:
+            response = await acompletion(**completion_kwargs)
+        except Exception as e:
+            error_class = classify_error(e)
+            if error_class in (RATE_LIMIT, TIMEOUT):
+                controller.on_overload(sent_at, RATE_LIMITED if error_class == RATE_LIMIT else TIMED_OUT)
+            raise
+        controller.on_success(sent_at, controller.clock() - sent_at)
+        return response
+
+    def pack_input_budget(self):
+        """Prompt tokens the items of a pack may take: the context window less the system prompt, the packing instruction and the chat template."""
+        try:
+            budget = litellm.get_model_info(self.model)["max_input_tokens"] or DEFAULT_CHUNK_TOKENS
+        except Exception:
+            budget = DEFAULT_CHUNK_TOKENS
+        static_texts = [PACK_INSTRUCTION.format(count=self.pack_size)]
+        if self.use_system_prompt and self.system_prompt:
+            static_texts.append(self.system_prompt)
+        return budget - int(count_tokens(static_texts, self.plan_encoder).sum()) - CHAT_TEMPLATE_OVERHEAD_TOKENS
+
+    def process_rows_packed(self, prompts):
+        """Send the rows of a batch in packs of numbered items and split each JSON array answer back into rows.
+
+        The tokens and cost of a packed request are allocated to its rows: prompt and cached
+        tokens by the length of each item, completion tokens by the length of each answer. Rows
+        whose answer is missing or mismatched are sent again alone, their own request adding
+        to their share. Prompt files are grouped by their size and read a pack at a time.
+        """
+        if self.plan_encoder is None:
+            self.plan_encoder = batch_encoder(self.model)
+        # Missing prompts are not packed, they are sent alone like unpacked rows
+        packable = [position for position, prompt in enumerate(prompts) if isinstance(prompt, str)]
+        if self.prompt_from_file:
+            # Packs are formed from the file sizes and each pack reads only its own files when it is sent
+            texts = None
+            item_tokens = [estimate_file_tokens(prompts.iloc[position], self.prompt_file_tokens) for position in packable]
+        else:
+            texts = prompts.tolist()
+            item_tokens = count_tokens(np.array([texts[position] for position in packable], dtype=object), self.plan_encoder).tolist()
+        groups = [[packable[member] for member in group] for group in pack_groups(item_tokens, self.pack_size, self.pack_input_budget(), self.pack_answer_tokens, self.max_token)]
+        groups += [[position] for position in range(len(prompts)) if not isinstance(prompts.iloc[position], str)]
+        tokens = dict(zip(packable, item_tokens))
+
+        rows = [None] * len(prompts)
+        for group in groups:
+            if len(group) == 1:
+                rows[group[0]] = self.process_row(prompts.iloc[group[0]])
+                continue
+            if self.prompt_from_file:
+                read = dict(zip(group, self.read_prompts(prompts.iloc[group])))
+                # Files that cannot be read already failed according to `on_error`, their rows stay empty
+                for position in group:
+                    if read[position] is None:
+                        rows[position] = self.empty_row()
+                group = [position for position in group if read[position] is not None]
+                if not group:
+                    continue
+                group_texts = [read[position] for position in group]
+                tokens.update(zip(group, count_tokens(np.array(group_texts, dtype=object), self.plan_encoder).tolist()))
+            else:
+                group_texts = [texts[position] for position in group]
+            for position, row in zip(group, self.process_pack(group_texts, [tokens[position] for position in group])):
+                if pd.isna(row[self.response_column_name]):
+                    # The row keeps its share of the packed request and adds the cost of its own
+                    self.resent_rows += 1
+                    alone = self.process_row(prompts.iloc[position])
+                    for column in ('prompt_tokens', 'completion_tokens', 'cached_tokens', 'cost($)'):
+                        if not pd.isna(alone[column]):
+                            row[column] += alone[column]
+                    row[self.response_column_name] = alone[self.response_column_name]
+                rows[position] = row
+        return pd.DataFrame(rows, index=prompts.index)
+
+    def process_pack(self, texts, item_tokens):
+        """Send one packed request and return a row per item, with no response for the items it did not answer."""
+        try:
+            completion_kwargs = self.remote_completion_kwargs(pack_items(texts), packed_items=len(texts))
+            self.provider.io.info(f"Requesting messages: {json.dumps(completion_kwargs['messages'], indent=2)}")
+            response, hedge_cost = self.send_completion(completion_kwargs)
+        except Exception as e:
+            self.provider.io.info(f"Error in packed completion, sending its {len(texts)} rows alone: {str(e)}")
+            return [pd.Series({self.response_column_name: None, 'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0, 'cost($)': 0.0}, dtype=object) for _ in texts]
+        self.packed_requests += 1
+        self.packed_rows += len(texts)
+
+        answers = parse_packed_answers(response.choices[0].message.content, len(texts))
+        prompt_tokens = allocate(response.usage.prompt_tokens, item_tokens)
+        completion_tokens = allocate(response.usage.completion_tokens, [estimate_tokens(answer) + ITEM_OVERHEAD_TOKENS for answer in answers])
+        cached_tokens = allocate(self.count_cached_tokens(response), item_tokens)
+        costs = split_cost(self.response_cost(response) + hedge_cost, prompt_tokens, completion_tokens, self.pack_prices)
+        return [
+            pd.Series({
+                self.response_column_name: answer,
+                'prompt_tokens': prompt,
+                'completion_tokens': completion,
+                'cached_tokens': cached,
+                'cost($)': cost
+            }, dtype=object)
+            for answer, prompt, completion, cached, cost in zip(answers, prompt_tokens, completion_tokens, cached_tokens, costs)
+        ]
+
+    def process_rows_concurrently(self, prompts):
+        """Process the rows of a batch concurrently, until the deadline if any, with a `status` per row.
+
+        Rows are "ok", "error", "timeout" when cancelled at their own or the run deadline, or
+        "skipped" when the run deadline passed before they were sent. Only answered rows are
+        costed, so cancelled requests are not counted in the total cost.
+        """
+        outcomes = self.event_loop.run(run_with_deadline(
+            prompts.tolist(), self.aprocess_row, self.deadline or RunDeadline(), self.deadline_concurrency,
+            lengths=[self.estimate_prompt_tokens(prompt) for prompt in prompts], controller=self.concurrency_controller,
+        ))
+        rows = []
+        for status, outcome in outcomes:
+            if status == STATUS_OK:
+                row = self.response_row(*outcome)
+            else:
+                if status == STATUS_ERROR:
+                    if self.on_error == "error":
+                        self.provider.io.error(f"Error in completion: {str(outcome)}")
+                        raise outcome
+                    self.provider.io.info(f"Error in completion: {str(outcome)}")
+                row = self.empty_row()
+            row['status'] = status
+            self.status_counts[status] += 1
+            rows.append(row)
+        return pd.DataFrame(rows, index=prompts.index)
+
+    def tier_completion(self, tier, row):
+        """Answer a prompt with one cascade tier.
+
+        Returns the response text, prompt, completion and cached tokens, cost and the log
+        probabilities of the sampled tokens, if any. The daemon does not return log
+        probabilities, its answers pass the confidence check.
+        """
+        with_logprobs = self.cascade_min_confidence is not None
+        if tier == LOCAL_CASCADE_TIER:
             if self.simulate_response:
-                completion_kwargs["mock_response"] = self.simulate_response_text
+                return self.simulate_response_text, 0, 0, 0, 0, None
+            completion_kwargs = self.local_completion_kwargs(row)
+            if self.daemon:
+                response = self.daemon_chat([completion_kwargs["messages"]]).to_pylist()[0]
+                if response["error"]:
+                    raise RuntimeError(response["error"])
+                return response["content"], response["prompt_tokens"], response["completion_tokens"], 0, 0, None
+            if with_logprobs:
+                completion_kwargs["logprobs"] = True
+            if self.worker_pool:
+                response = self.worker_pool.map([completion_kwargs])[0]
+                if isinstance(response, Exception):
+                    raise response
+            else:
+                response = self.llama.create_chat_completion(**completion_kwargs)
+            choice = response["choices"][0]
+            return choice["message"]["content"], response["usage"]["prompt_tokens"], response["usage"]["completion_tokens"], 0, 0, choice.get("logprobs")
 
-            if self.platform == "Others (Custom)":
-                completion_kwargs["base_url"] = self.endpoint
-                if self.use_api_key:
-                    completion_kwargs["api_key"] = self.api_keys
-            
-            # self.provider.io.info(f"Sending request...")
-            response = completion_with_retries(**completion_kwargs)
-            # self.provider.io.info(f"Response received.")
+        completion_kwargs = self.remote_completion_kwargs(row, tier)
+        if with_logprobs:
+            completion_kwargs["logprobs"] = True
+        response, hedge_cost = self.send_completion(completion_kwargs)
+        cost = self.response_cost(response, tier) + hedge_cost
+        choice = response.choices[0]
+        return choice.message.content, response.usage.prompt_tokens, response.usage.completion_tokens, self.count_cached_tokens(response, tier), cost, getattr(choice, "logprobs", None)
 
-            output_content = response.choices[0].message.content
-            prompt_tokens = response.usage.prompt_tokens
-            completion_tokens = response.usage.completion_tokens
-            
-            if not self.simulate_response and not self.platform == "Others (Custom)":
+    def baseline_cost(self, prompt_tokens, completion_tokens):
+        """Estimated cost of the same tokens on the last cascade tier."""
+        last_tier = self.cascade_models[-1]
+        if last_tier == LOCAL_CASCADE_TIER or self.simulate_response or self.platform == "Others (Custom)":
+            return 0
+        try:
+            prompt_cost, output_cost = litellm.cost_per_token(model=last_tier, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            return prompt_cost + output_cost
+        except Exception:
+            return 0
+
+    def process_row_cascade(self, row):
+        """Process a row with the cheapest tier whose response passes validation, escalating on failure."""
+        prompt_tokens_total, completion_tokens_total, cached_tokens_total, cost_total = 0, 0, 0, 0
+        try:
+            for tier_index, tier in enumerate(self.cascade_models):
+                last_tier = tier_index == len(self.cascade_models) - 1
                 try:
-                    cost = completion_cost(completion_response=response)
-                    self.total_cost += cost
+                    output_content, prompt_tokens, completion_tokens, cached_tokens, cost, logprobs = self.tier_completion(tier, row)
                 except Exception as e:
-                    self.provider.io.info(f"Model {self.model} does not support cost calculation.")
-                    cost = 0 # Set cost to 0 if model does not support cost calculation
-            else:
-                cost = 0 # Set cost to 0 for simulated responses
+                    if last_tier:
+                        raise
+                    self.provider.io.info(f"Cascade tier {tier} failed, escalating: {str(e)}")
+                    with self.stats_lock:
+                        self.cascade_stats.record_attempt(tier, 0, "error")
+                    continue
+                prompt_tokens_total += prompt_tokens
+                completion_tokens_total += completion_tokens
+                cached_tokens_total += cached_tokens
+                cost_total += cost
 
-            return pd.Series({
-                self.response_column_name: output_content,
-                'prompt_tokens': prompt_tokens,
-                'completion_tokens': completion_tokens,
-                'cost($)': cost
-            })
+                # The last tier's answer is kept whatever the validators say
+                reason = None if last_tier else self.cascade_validator.check(output_content, logprobs)
+                with self.stats_lock:
+                    self.cascade_stats.record_attempt(tier, cost, reason)
+                if reason is None:
+                    baseline_cost = self.baseline_cost(prompt_tokens, completion_tokens)
+                    with self.stats_lock:
+                        self.cascade_stats.baseline_cost += baseline_cost
+                    return pd.Series({
+                        self.response_column_name: output_content,
+                        'prompt_tokens': prompt_tokens_total,
+                        'completion_tokens': completion_tokens_total,
+                        'cached_tokens': cached_tokens_total,
+                        'cost($)': cost_total,
+                        'cascade_tier': tier
+                    })
+                self.provider.io.info(f"Cascade tier {tier} response rejected ({reason}), escalating.")
 
         except Exception as e:
             if self.on_error == "error":
                 self.provider.io.error(f"Error in completion: {str(e)}")
                 raise
+            self.provider.io.info(f"Error in completion: {str(e)}")
+        return pd.Series({
+            self.response_column_name: None,
+            'prompt_tokens': None,
+            'completion_tokens': None,
+            'cached_tokens': None,
+            'cost($)': cost_total or None,
+            'cascade_tier': None
+        })
+
+    def local_label_token_ids(self):
+        """Return the token ids each label can start with in the GGUF vocabulary, warning about ambiguous labels."""
+        label_ids = label_token_ids(self.labels, lambda text: self.llama.tokenize(text.encode("utf-8"), add_bos=False))
+        shared = shared_first_tokens(label_ids)
+        if shared:
+            self.provider.io.warn(f"Labels starting with the same token cannot be told apart: {', '.join(self.labels[position] for position in shared)}")
+        return label_ids
+
+    def chat_prompt(self, messages):
+        """Render messages with the chat template of the GGUF model, ending with the start of the assistant turn."""
+        if self.chat_formatter is None:
+            template = self.llama.metadata.get("tokenizer.chat_template")
+            if template:
+                token_text = lambda token: self.llama.detokenize([token], special=True).decode("utf-8", errors="ignore") if token != -1 else ""
+                self.chat_formatter = llama_chat_format.Jinja2ChatFormatter(
+                    template=template,
+                    eos_token=token_text(self.llama.token_eos()),
+                    bos_token=token_text(self.llama.token_bos()),
+                    add_generation_prompt=True,
+                )
             else:
-                self.provider.io.info(f"Error in completion: {str(e)}")
-                return pd.Series({
-                    self.response_column_name: None,
-                    'prompt_tokens': None,
-                    'completion_tokens': None,
-                    'cost($)': None
-                })
+                # llama.cpp falls back to the Llama 2 format for models without a template
+                self.chat_formatter = llama_chat_format.format_llama2
+        return self.chat_formatter(messages=messages).prompt
+
+    def classification_result(self, probabilities, prompt_tokens, completion_tokens, cost, cached_tokens=None):
+        """Row result of a classification: the most probable label and the probability of every label."""
+        result = {
+            self.response_column_name: self.labels[int(probabilities.argmax())] if probabilities is not None else None,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cached_tokens': cached_tokens,
+            'cost($)': cost
+        }
+        for position, label in enumerate(self.labels):
+            result[probability_column(label)] = float(probabilities[position]) if probabilities is not None else None
+        return pd.Series(result)
+
+    def classify_row(self, row):
+        """Classify a prompt with a remote model from the log probabilities of its first answer token."""
+        try:
+            completion_kwargs = self.remote_completion_kwargs(row, labels=self.labels)
+            completion_kwargs.pop("response_format", None)
+            completion_kwargs.update({"max_tokens": 1, "temperature": 0, "logprobs": True, "top_logprobs": MAX_TOP_LOGPROBS})
+            if self.label_bias:
+                completion_kwargs["logit_bias"] = self.label_bias
+            response = self.retry_policy.call(lambda: completion(**completion_kwargs))
+
+            choice = response.choices[0]
+            logprobs = getattr(choice, "logprobs", None)
+            content = (logprobs.get("content") if isinstance(logprobs, dict) else getattr(logprobs, "content", None)) if logprobs else None
+            probabilities = None
+            if content:
+                first_token = content[0]
+                probabilities = score_top_logprobs(first_token["top_logprobs"] if isinstance(first_token, dict) else first_token.top_logprobs, self.labels)
+            if probabilities is None:
+                # Providers without log probabilities still answer with a label
+                probabilities = score_text(choice.message.content, self.labels)
+
+            cost = self.response_cost(response)
+            return self.classification_result(probabilities, response.usage.prompt_tokens, response.usage.completion_tokens, cost, self.count_cached_tokens(response))
+
+        except Exception as e:
+            if self.on_error == "error":
+                self.provider.io.error(f"Error in classification: {str(e)}")
+                raise
+            self.provider.io.info(f"Error in classification: {str(e)}")
+            return self.classification_result(None, None, None, None)
+
+    def classify_row_locally(self, row):
+        """Classify a prompt with the GGUF model from the logits of the next token, without sampling."""
+        try:
+            messages = with_instruction(self.local_completion_kwargs(row)["messages"], self.labels)
+            if self.simulate_response:
+                return self.classification_result(score_text(self.simulate_response_text, self.labels), 0, 0, 0)
+
+            tokens = self.llama.tokenize(self.chat_prompt(messages).encode("utf-8"), add_bos=False, special=True)
+            # Tokens shared with the previous prompt, such as the system prompt, keep their KV cache
+            prefix = min(Llama.longest_token_prefix(self.llama.input_ids[:self.llama.n_tokens].tolist(), tokens), len(tokens) - 1)
+            self.llama.n_tokens = prefix
+            self.llama.eval(tokens[prefix:])
+            logits = np.ctypeslib.as_array(_llama_cpp.llama_get_logits_ith(self.llama.ctx, -1), shape=(self.llama.n_vocab(),))
+            # No cost for local inference, and no token is generated
+            return self.classification_result(score_logits(logits, self.label_ids), len(tokens), 0, 0)
+
+        except Exception as e:
+            if self.on_error == "error":
+                self.provider.io.error(f"Error in classification: {str(e)}")
+                raise
+            self.provider.io.info(f"Error in classification: {str(e)}")
+            return self.classification_result(None, None, None, None)
+
+    def on_circuit_open(self, breaker):
+        """Report the circuit breaker opening, remaining rows are then failed according to `on_error`."""
+        self.provider.io.warn(
+            f"Circuit breaker opened: {breaker.current_error_rate():.0f}% of the last {len(breaker.outcomes)} requests failed. "
+            f"Remaining rows will not be sent (onError: {self.on_error})."
+        )
+
+    def hedged_completion(self, completion_kwargs):
+        """Send a completion, hedged by a duplicate request once the row exceeds the adaptive deadline.
+
+        Returns the winning response and the estimated cost of the cancelled request, which was
+        billed for its prompt tokens.
+        """
+        return self.event_loop.run(self.ahedged_completion(completion_kwargs))
+
+    async def ahedged_completion(self, completion_kwargs):
+        """Coroutine of `hedged_completion`, run on the event loop."""
+        hedge_kwargs = dict(completion_kwargs)
+        if self.hedge_model:
+            hedge_kwargs["model"] = self.hedge_model
+        if self.hedge_endpoint:
+            hedge_kwargs["base_url"] = self.hedge_endpoint
+
+        result = await hedged_request(
+            lambda: self.retry_policy.acall(lambda: self.observed_acompletion(completion_kwargs)),
+            lambda: self.retry_policy.acall(lambda: self.observed_acompletion(hedge_kwargs)),
+            self.hedge_policy,
+        )
+        if not result.hedged:
+            return result.response, 0
+
+        loser_model = completion_kwargs["model"] if result.hedge_won else hedge_kwargs["model"]
+        self.provider.io.info(f"Hedged request answered by {'hedge' if result.hedge_won else 'primary'}, cancelled {loser_model}.")
+        if self.simulate_response or self.platform == "Others (Custom)":
+            return result.response, 0
+        try:
+            hedge_cost, _ = litellm.cost_per_token(model=loser_model, prompt_tokens=result.response.usage.prompt_tokens, completion_tokens=0)
+        except Exception as e:
+            self.provider.io.info(f"Model {loser_model} does not support cost calculation.")
+            hedge_cost = 0
+        self.add_cost(0, hedge_cost)
+        return result.response, hedge_cost
+
+    def simulated_embeddings(self, texts):
+        """Return a zero vector per text, or the vector given as a JSON list in `simulateResponseText`."""
+        try:
+            vector = json.loads(self.simulate_response_text) if self.simulate_response_text else None
+        except json.JSONDecodeError:
+            vector = None
+        if not isinstance(vector, list):
+            vector = [0.0] * (self.embedding_dimensions or DEFAULT_SIMULATED_EMBEDDING_DIMENSIONS)
+        return [vector] * len(texts)
+
+    def embed_batch_locally(self, texts):
+        """Embed a batch of texts with the GGUF model loaded with `embedding=True`."""
+        if self.simulate_response:
+            return self.simulated_embeddings(texts)
+        return self.llama.embed(texts)
+
+    def embed_batch(self, texts):
+        """Embed a batch of texts with one `litellm.embedding` call, retried by the retry policy."""
+        if self.simulate_response:
+            return self.simulated_embeddings(texts)
+
+        embedding_kwargs = {
+            "model": self.model,
+            "input": texts,
+            "timeout": DEFAULT_REQUEST_TIMEOUT,
+            "caching": self.use_caching,
+            "drop_params": True,
+            # Retries are handled by the retry policy
+            "num_retries": 0,
+            "max_retries": 0,
+            "logger_fn": self.my_custom_logging_fn,
+        }
+        if self.embedding_dimensions:
+            embedding_kwargs["dimensions"] = self.embedding_dimensions
+        if self.platform == "Others (Custom)":
+            embedding_kwargs["api_base"] = self.endpoint
+            if self.use_api_key:
+                embedding_kwargs["api_key"] = self.api_keys
+
+        response = self.retry_policy.call(lambda: embedding(**embedding_kwargs))
+        if self.platform != "Others (Custom)":
+            try:
+                self.add_cost(completion_cost(completion_response=response, call_type="embedding"))
+            except Exception as e:
+                self.provider.io.info(f"Model {self.model} does not support cost calculation.")
+        # The provider may return the vectors out of order
+        return [item["embedding"] for item in sorted(response.data, key=lambda item: item["index"])]
+
+    def on_embedding_batch_error(self, error, texts):
+        """Fail the run or leave the vectors of a failed batch null, according to `on_error`."""
+        if self.on_error == "error":
+            self.provider.io.error(f"Error in embedding: {str(error)}")
+            raise error
+        self.provider.io.info(f"Error in embedding {len(texts)} texts: {str(error)}")
+
+    def embed_column(self, column):
+        """Embed a column of prompts into a fixed-size list array of float32 vectors."""
+        embed_batch = self.embed_batch_locally if self.platform == "**Local Inference**" else self.embed_batch
+        vectors = embed_texts(
+            column.to_numpy(zero_copy_only=False),
+            embed_batch,
+            batch_size=self.embedding_batch_size,
+            dimensions=self.embedding_dimensions or self.embedding_size,
+            on_batch_error=self.on_embedding_batch_error,
+        )
+        # Later record batches must keep the same vector size
+        if vectors.type.list_size:
+            self.embedding_size = vectors.type.list_size
+        return vectors
+
+    def token_codec(self):
+        """Return `(encode, decode)` functions for the tokenizer of the configured model."""
+        if self.platform == "**Local Inference**":
+            llama = self.llama
+            if llama is None:
+                # The worker processes hold the model, load only its vocabulary here
+                if self.tokenizer_llama is None:
+                    self.tokenizer_llama = Llama(model_path=self.llama_kwargs["model_path"], vocab_only=True, verbose=False)
+                llama = self.tokenizer_llama
+            return (
+                lambda text: llama.tokenize(text.encode("utf-8"), add_bos=False),
+                lambda tokens: llama.detokenize(tokens).decode("utf-8", errors="ignore"),
+            )
+        return (
+            lambda text: litellm.encode(model=self.model, text=text),
+            lambda tokens: litellm.decode(model=self.model, tokens=tokens),
+        )
+
+    def chunk_token_budget(self, encode):
+        """Tokens available for one chunk: the context window less the response, the system prompt and the chat template."""
+        if self.chunk_tokens:
+            return self.chunk_tokens
+        if self.platform == "**Local Inference**":
+            budget = self.input_context_length - self.max_token
+        else:
+            try:
+                budget = litellm.get_model_info(self.model)["max_input_tokens"] or DEFAULT_CHUNK_TOKENS
+            except Exception:
+                budget = DEFAULT_CHUNK_TOKENS
+        if self.use_system_prompt and self.system_prompt:
+            budget -= len(encode(self.system_prompt))
+        if self.map_instruction:
+            budget -= len(encode(map_prompt(self.map_instruction, "")))
+        return max(1, budget - CHAT_TEMPLATE_OVERHEAD_TOKENS)
+
+    def plan_prompts(self, prompts):
+        """Estimate the prompt tokens and worst-case cost of a column of prompts without sending them.
+
+        Distinct prompts are tokenized in batches. The worst case assumes every row generates
+        `max_token` completion tokens.
+        """
+        if self.platform == "**Local Inference**":
+            encode, _ = self.token_codec()
+            encode_batch = lambda texts: [encode(text) for text in texts]
+            input_window = self.input_context_length - self.run_plan.max_completion_tokens
+        else:
+            if self.plan_encoder is None:
+                self.plan_encoder = batch_encoder(self.model)
+            encode_batch = self.plan_encoder
+            try:
+                input_window = litellm.get_model_info(self.model)["max_input_tokens"]
+            except Exception:
+                input_window = None
+
+        prompt_tokens = count_tokens(prompts.to_numpy(), encode_batch) + TOKENS_PER_MESSAGE
+        if self.use_system_prompt and self.system_prompt:
+            prompt_tokens += len(encode_batch([self.system_prompt])[0]) + TOKENS_PER_MESSAGE
+        trimmed_rows = 0
+        if input_window:
+            trimmed_rows = int((prompt_tokens > input_window).sum())
+            prompt_tokens = np.minimum(prompt_tokens, input_window)
+        self.run_plan.add(prompt_tokens, trimmed_rows)
+
+        completion_tokens = self.run_plan.max_completion_tokens
+        prices = self.run_plan.prices
+        return pd.DataFrame({
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cost($)': prompt_tokens * prices[0] + completion_tokens * prices[1] if prices else None
+        }, index=prompts.index)
+
+    def dispatch_prompts(self, prompts):
+        """Run a column of prompts through the configured inference path and return the response columns."""
+        if self.batch_processing:
+            input_dataframe = pd.DataFrame({self.prompt_field: prompts})
+            outputs, prompt_tokens_list, completion_tokens_list, cached_tokens_list, costs = self.process_batch(input_dataframe)
+            return pd.DataFrame({
+                self.response_column_name: outputs,
+                'prompt_tokens': prompt_tokens_list,
+                'completion_tokens': completion_tokens_list,
+                'cached_tokens': cached_tokens_list,
+                'cost($)': costs
+            }, index=prompts.index)
+        if self.platform == "**Local Inference**":
+            if self.worker_pool and not self.simulate_response:
+                return self.process_rows_with_worker_pool(prompts)
+            if self.daemon and not self.simulate_response:
+                return self.process_rows_with_daemon(prompts)
+            return prompts.transform(self.process_row_locally)
+        with ThreadPoolExecutor(max_workers=self.chunk_concurrency) as executor:
+            return pd.DataFrame(list(executor.map(self.process_row, prompts)), index=prompts.index)
+
+    def process_long_prompts(self, prompts):
+        """Split prompts that exceed the context window into overlapping chunks, process them and combine the answers.
+
+        Chunks of every row are dispatched together, each after the map instruction. The answers
+        of each row are then reduced with the reduce prompt and the same instruction, in several
+        rounds when they do not fit in one request. The system prompt goes with every request.
+        """
+        encode, decode = self.token_codec()
+        count_tokens = lambda text: len(encode(text))
+        budget = self.chunk_token_budget(encode)
+        overlap = self.chunk_overlap if self.chunk_overlap is not None else budget // 10
+
+        pieces, owners = [], []
+        chunk_counts = {}
+        for index, prompt in prompts.items():
+            chunks = chunk_text(prompt, encode, decode, budget, overlap) if isinstance(prompt, str) else [prompt]
+            pieces.extend(map_prompt(self.map_instruction, chunk) if isinstance(chunk, str) else chunk for chunk in chunks)
+            owners.extend([index] * len(chunks))
+            chunk_counts[index] = len(chunks)
+        chunked_rows = sum(1 for count in chunk_counts.values() if count > 1)
+        if chunked_rows:
+            self.provider.io.info(f"Long input: {chunked_rows} of {len(prompts)} rows split into {sum(count for count in chunk_counts.values() if count > 1)} chunks of at most {budget} tokens")
+
+        totals = pd.DataFrame(0.0, index=prompts.index, columns=['prompt_tokens', 'completion_tokens', 'cost($)'])
+        responses = {index: [] for index in prompts.index}
+        failed = set()
+
+        def add_usage(owners, results):
+            for owner, (_, result) in zip(owners, results.iterrows()):
+                for column in totals.columns:
+                    if pd.notna(result.get(column)):
+                        totals.at[owner, column] += result[column]
+
+        mapped = self.dispatch_prompts(pd.Series(pieces))
+        add_usage(owners, mapped)
+        for owner, response in zip(owners, mapped[self.response_column_name]):
+            if pd.isna(response):
+                failed.add(owner)
+            else:
+                responses[owner].append(response)
+
+        reduce_budget = budget - count_tokens(reduce_prompt(self.reduce_prompt_template, [], self.map_instruction))
+        reduce_cost = 0
+        while True:
+            # Each row keeps its answers in document order, with the position of every reduced group
+            plans, reduce_owners, reduce_prompts = {}, [], []
+            for index, row_responses in responses.items():
+                if index in failed or len(row_responses) < 2:
+                    continue
+                groups = pack_responses(row_responses, count_tokens, reduce_budget)
+                if len(groups) == len(row_responses):
+                    continue  # Every answer alone fills the budget, they are joined instead
+                plans[index] = []
+                for group in groups:
+                    if len(group) == 1:
+                        plans[index].append(group[0])
+                    else:
+                        plans[index].append(len(reduce_prompts))
+                        reduce_owners.append(index)
+                        reduce_prompts.append(reduce_prompt(self.reduce_prompt_template, group, self.map_instruction))
+            if not reduce_prompts:
+                break
+
+            reduced = self.dispatch_prompts(pd.Series(reduce_prompts))
+            add_usage(reduce_owners, reduced)
+            reduce_cost += reduced['cost($)'].fillna(0).sum()
+            self.reduce_calls += len(reduce_prompts)
+            reduced_responses = reduced[self.response_column_name].tolist()
+            for index, plan in plans.items():
+                responses[index] = [reduced_responses[slot] if isinstance(slot, int) else slot for slot in plan]
+                if any(pd.isna(response) for response in responses[index]):
+                    failed.add(index)
+
+        self.chunked_rows += chunked_rows
+        self.chunk_count += sum(count for count in chunk_counts.values() if count > 1)
+        self.reduce_cost += reduce_cost
+        if chunked_rows:
+            chunked_cost = totals.loc[[index for index, count in chunk_counts.items() if count > 1], 'cost($)'].sum()
+            self.provider.io.info(f"Long input: cost of chunked rows ${chunked_cost:.4f}, of which ${reduce_cost:.4f} for combining answers")
+
+        output = totals.copy()
+        output[self.response_column_name] = [
+            None if index in failed else RESPONSE_SEPARATOR.join(responses[index]) for index in prompts.index
+        ]
+        output['chunks'] = pd.Series(chunk_counts)
+        return output
 
     def process_batch(self, input_dataframe):
         """Process multiple rows of data through the LLM in batch mode."""
         batch_messages = []
-        for _, row in input_dataframe.iterrows():
+        # Positions of the rows sent, rows without a prompt or whose prompt file cannot be read are left out
+        positions = []
+        for position, (_, row) in enumerate(input_dataframe.iterrows()):
+            try:
+                prompt = self.prompt_text(row[self.prompt_field])
+            except OSError as e:
+                if self.on_error == "error":
+                    self.provider.io.error(f"Error reading prompt file: {str(e)}")
+                    raise
+                self.provider.io.info(f"Error reading prompt file: {str(e)}")
+                continue
+            if not isinstance(prompt, str):
+                continue  # A missing prompt would fail the whole batch request
             if self.use_system_prompt:
                 messages = [
                     {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": row[self.prompt_field]}
+                    {"role": "user", "content": prompt}
                 ]
             else:
                 messages = [
-                    {"role": "user", "content": row[self.prompt_field]}
+                    {"role": "user", "content": prompt}
                 ]
-            batch_messages.append(trim_messages(messages, self.model))
+            batch_messages.append(self.cacheable_messages(trim_messages(messages, self.model), self.model))
+            positions.append(position)
         
         try:
             completion_kwargs = {
@@ -394,8 +1708,10 @@ class LLMConnect(PluginV2):
                 "seed": self.seed,
                 "drop_params": True,
                 "stream": False,
-                "timeout": 10,
-                "num_retries": 100, #self.num_retries,
+                "timeout": DEFAULT_REQUEST_TIMEOUT,
+                # Failed rows are retried individually by the retry policy
+                "num_retries": 0,
+                "max_retries": 0,
             }
 
             if self.use_caching:
@@ -403,6 +1719,9 @@ class LLMConnect(PluginV2):
             else:
                 completion_kwargs["caching"] = False
 
+            if self.enforceJsonResponse:
+                completion_kwargs["response_format"] = self.remote_response_format()
+
             if self.simulate_response:
                 completion_kwargs["mock_response"] = self.simulate_response_text
 
@@ -411,6 +1730,8 @@ class LLMConnect(PluginV2):
                 if self.use_api_key:
                     completion_kwargs["api_key"] = self.api_keys
             
+            if self.circuit_breaker:
+                self.circuit_breaker.check()
             self.provider.io.info(f"Sending batch request...")
             responses = batch_completion(**completion_kwargs)
             self.provider.io.info(f"Batch response received.")
@@ -418,29 +1739,46 @@ class LLMConnect(PluginV2):
             outputs = []
             prompt_tokens_list = []
             completion_tokens_list = []
+            cached_tokens_list = []
             costs = []
 
-            for response in responses:
+            for messages, response in zip(batch_messages, responses):
+                if isinstance(response, Exception):
+                    row_kwargs = dict(completion_kwargs, messages=messages)
+                    try:
+                        response = self.retry_policy.call(lambda: completion(**row_kwargs), first_error=response)
+                    except Exception as e:
+                        if self.on_error == "error":
+                            raise
+                        self.provider.io.info(f"Error in batch completion: {str(e)}")
+                        outputs.append(None)
+                        prompt_tokens_list.append(None)
+                        completion_tokens_list.append(None)
+                        cached_tokens_list.append(None)
+                        costs.append(None)
+                        continue
+                else:
+                    self.retry_policy.record_success()
+
                 output_content = response.choices[0].message.content
                 prompt_tokens = response.usage.prompt_tokens
                 completion_tokens = response.usage.completion_tokens
-                
-                if not self.simulate_response:
-                    try:    
-                        cost = completion_cost(completion_response=response)
-                        self.total_cost += cost
-                    except Exception as e:
-                        self.provider.io.info(f"Model {self.model} does not support cost calculation.")
-                        cost = 0 # Set cost to 0 if model does not support cost calculation
-                else:
-                    cost = 0  # Set cost to 0 for simulated responses
+                cost = self.response_cost(response)
 
                 outputs.append(output_content)
                 prompt_tokens_list.append(prompt_tokens)
                 completion_tokens_list.append(completion_tokens)
+                cached_tokens_list.append(self.count_cached_tokens(response))
                 costs.append(cost)
 
-            return outputs, prompt_tokens_list, completion_tokens_list, costs
+            # Rows that were not sent keep empty results
+            columns = []
+            for values in (outputs, prompt_tokens_list, completion_tokens_list, cached_tokens_list, costs):
+                column = [None] * len(input_dataframe)
+                for position, value in zip(positions, values):
+                    column[position] = value
+                columns.append(column)
+            return tuple(columns)
 
         except Exception as e:
             if self.on_error == "error":
@@ -449,10 +1787,60 @@ class LLMConnect(PluginV2):
             else:
                 self.provider.io.info(f"Error in batch completion: {str(e)}")
             return ([None] * len(input_dataframe),
+                   [None] * len(input_dataframe),
                    [None] * len(input_dataframe),
                    [None] * len(input_dataframe),
                    [None] * len(input_dataframe))
 
+    def output_table(self, batch, result):
+        """Append the response columns of `result` to the incoming batch as compact Arrow columns.
+
+        Repeated responses are dictionary-encoded, token counts are int32 and costs float32.
+        """
+        columns = {
+            self.response_column_name: self.string_encoder(self.response_column_name, self.dictionary_responses, closed_set=self.operation == CLASSIFICATION_OPERATION).encode(result[self.response_column_name]),
+            'prompt_tokens': int32_column(result['prompt_tokens']),
+            'completion_tokens': int32_column(result['completion_tokens']),
+        }
+        if self.prompt_caching:
+            # Paths without usage details, such as chunked prompts, leave the column empty
+            columns['cached_tokens'] = int32_column(result['cached_tokens'] if 'cached_tokens' in result else [None] * len(result))
+        columns['cost($)'] = float32_column(result['cost($)'])
+        if self.long_input and 'chunks' in result:
+            columns['chunks'] = int32_column(result['chunks'])
+        if self.cascade_models and 'cascade_tier' in result:
+            columns['cascade_tier'] = self.string_encoder('cascade_tier', self.dictionary_responses, closed_set=True).encode(result['cascade_tier'])
+        if self.operation == CLASSIFICATION_OPERATION:
+            for label in self.labels:
+                column = probability_column(label)
+                columns[column] = float32_column(result[column] if column in result else None)
+        if self.deadline and 'status' in result:
+            columns['status'] = self.string_encoder('status', closed_set=True).encode(result['status'])
+        if self.json_parser is not None:
+            fields = self.json_field_columns(result[self.response_column_name])
+            # Unlike the tool columns, a field must not silently replace an input or output column
+            taken = sorted(name for name in fields if name in columns or name in batch.column_names)
+            if taken:
+                raise RuntimeError(f"JSON fields would overwrite the columns: {', '.join(taken)}, set 'jsonFieldPrefix' to rename them")
+            columns.update(fields)
+        return set_columns(batch, columns)
+
+    def string_encoder(self, column, dictionary=True, closed_set=False):
+        """Return the encoder keeping the type of a string output column the same across record batches."""
+        if column not in self.string_encoders:
+            self.string_encoders[column] = StringColumnEncoder(dictionary, closed_set=closed_set)
+        return self.string_encoders[column]
+
+    def json_field_columns(self, responses):
+        """Parse the responses of a batch in bulk into field columns, and the parse error of each row."""
+        fields, errors = self.json_parser.parse(responses)
+        columns = field_columns(fields, self.json_columns, self.json_field_prefix, struct_name=f"{self.response_column_name} JSON") if fields.num_columns else {}
+        columns[json_error_column(self.response_column_name)] = string_column(errors, dictionary=False)
+        failed = sum(error is not None for error in errors)
+        if failed:
+            self.provider.io.warn(f"{failed} of {len(errors)} responses could not be parsed as JSON")
+        return columns
+
     def on_record_batch(self, batch: "pa.Table", anchor: Anchor) -> None:
         """
         Process the passed record batch.
@@ -481,37 +1869,145 @@ class LLMConnect(PluginV2):
         # debugpy.breakpoint() #must have
         # print('break on this line')
 
+        with self.profiled(rows=batch.num_rows):
+            self.process_record_batch(batch)
+
+    @contextmanager
+    def profiled(self, rows=None, step=None):
+        """Profile a record batch of `rows` rows, or a named step of the run, when profiling is on."""
+        if not self.profiler:
+            yield
+            return
+        with self.profiler.step(step) if step else self.profiler.batch(rows):
+            yield
+        self.provider.io.info(self.profiler.batch_summary(self.profiler.batches[-1]))
+
+    def process_record_batch(self, batch):
+        """Run the prompts of a record batch through the configured operation and write the output rows."""
         metadata = batch.schema
         if not any([field_name == self.prompt_field for field_name in metadata.names]):
             raise RuntimeError(
                 f"Incoming data must contain a column with the prompt field: '{self.prompt_field}'"
             )
         
+        if self.dry_run:
+            prompts = batch.column(self.prompt_field).to_pandas()
+            if not is_string_dtype(prompts):
+                raise RuntimeError(f"'{self.prompt_field}' column must be of 'string' data type")
+            # The response column stays empty, the token and cost columns hold the estimates
+            result = self.plan_prompts(pd.Series(self.read_prompts(prompts), index=prompts.index, dtype=object) if self.prompt_from_file else prompts)
+            result.insert(0, self.response_column_name, None)
+            self.provider.write_to_anchor("Output", self.output_table(batch, result))
+            return
+
+        if self.operation == EMBEDDINGS_OPERATION:
+            prompts = batch.column(self.prompt_field)
+            if not (pa.types.is_string(prompts.type) or pa.types.is_large_string(prompts.type)):
+                raise RuntimeError(f"'{self.prompt_field}' column must be of 'string' data type")
+            if self.prompt_from_file:
+                prompts = pa.array(self.read_prompts(prompts.to_pylist()), type=pa.string())
+            self.provider.io.info(f"Embedding {batch.num_rows} rows in batches of {self.embedding_batch_size}.")
+            self.write_table(batch.append_column(self.response_column_name, self.embed_column(prompts)))
+            return
+
         current_batch = batch.to_pandas(split_blocks=False)
         if not is_string_dtype(current_batch[self.prompt_field]):
             raise RuntimeError(f"'{self.prompt_field}' column must be of 'string' data type")
+        batch_start = time.perf_counter()
         
+        if self.pipeline:
+            # The rows are queued and the batch is written once they are done, in arrival order
+            self.pipeline.submit((batch, current_batch), current_batch[self.prompt_field].tolist(), batch.nbytes)
+            return
+
         # Process the current batch
-        if self.batch_processing:
+        if self.operation == CLASSIFICATION_OPERATION:
+            # One next-token step per row scores every label
+            classify = self.classify_row_locally if self.platform == "**Local Inference**" else self.classify_row
+            result = current_batch[self.prompt_field].transform(classify)
+
+            # Add results to the current batch
+            current_batch[self.response_column_name] = result[self.response_column_name]
+            current_batch['prompt_tokens'] = result['prompt_tokens']
+            current_batch['completion_tokens'] = result['completion_tokens']
+            current_batch['cached_tokens'] = result['cached_tokens']
+            current_batch['cost($)'] = result['cost($)']
+            for label in self.labels:
+                current_batch[probability_column(label)] = result[probability_column(label)]
+        elif self.long_input:
+            # Over-length prompts are split into chunks and their answers combined
+            prompts = current_batch[self.prompt_field]
+            result = self.process_long_prompts(pd.Series(self.read_prompts(prompts), index=prompts.index, dtype=object) if self.prompt_from_file else prompts)
+
+            # Add results to the current batch
+            current_batch[self.response_column_name] = result[self.response_column_name]
+            current_batch['prompt_tokens'] = result['prompt_tokens']
+            current_batch['completion_tokens'] = result['completion_tokens']
+            current_batch['cost($)'] = result['cost($)']
+            current_batch['chunks'] = result['chunks']
+        elif self.cascade_models:
+            # Each row escalates through the tiers until a response passes validation
+            result = current_batch[self.prompt_field].transform(self.process_row_cascade)
+
+            # Add results to the current batch
+            current_batch[self.response_column_name] = result[self.response_column_name]
+            current_batch['prompt_tokens'] = result['prompt_tokens']
+            current_batch['completion_tokens'] = result['completion_tokens']
+            current_batch['cached_tokens'] = result['cached_tokens']
+            current_batch['cost($)'] = result['cost($)']
+            current_batch['cascade_tier'] = result['cascade_tier']
+        elif self.batch_processing:
             # # debugpy.breakpoint()
             # Batch processing
-            outputs, prompt_tokens_list, completion_tokens_list, costs = self.process_batch(current_batch)
+            outputs, prompt_tokens_list, completion_tokens_list, cached_tokens_list, costs = self.process_batch(current_batch)
 
             # Add results to the current batch
             current_batch[self.response_column_name] = outputs
             current_batch['prompt_tokens'] = prompt_tokens_list
             current_batch['completion_tokens'] = completion_tokens_list
+            current_batch['cached_tokens'] = cached_tokens_list
             current_batch['cost($)'] = costs
         # if local inference
         elif self.platform == "**Local Inference**":
             # # debugpy.breakpoint()
-            result = current_batch[self.prompt_field].transform(self.process_row_locally)
+            if self.worker_pool and not self.simulate_response:
+                result = self.process_rows_with_worker_pool(current_batch[self.prompt_field])
+            elif self.daemon and not self.simulate_response:
+                result = self.process_rows_with_daemon(current_batch[self.prompt_field])
+            elif self.image_preprocessor:
+                if self.image_field not in current_batch.columns:
+                    raise RuntimeError(f"Incoming data must contain the image column: '{self.image_field}'")
+                result = self.process_rows_with_images(current_batch[self.prompt_field], current_batch[self.image_field])
+            else:
+                result = current_batch[self.prompt_field].transform(self.process_row_locally)
 
             # Add results to the current batch
             current_batch[self.response_column_name] = result[self.response_column_name]
             current_batch['prompt_tokens'] = result['prompt_tokens']
             current_batch['completion_tokens'] = result['completion_tokens']
             current_batch['cost($)'] = result['cost($)']
+        elif self.pack_rows:
+            # Short rows share requests as numbered items, their answers are split back into rows
+            result = self.process_rows_packed(current_batch[self.prompt_field])
+
+            # Add results to the current batch
+            current_batch[self.response_column_name] = result[self.response_column_name]
+            current_batch['prompt_tokens'] = result['prompt_tokens']
+            current_batch['completion_tokens'] = result['completion_tokens']
+            current_batch['cached_tokens'] = result['cached_tokens']
+            current_batch['cost($)'] = result['cost($)']
+        elif self.deadline or self.concurrency_controller:
+            # Rows run concurrently, until the deadline if any, each with its status
+            result = self.process_rows_concurrently(current_batch[self.prompt_field])
+
+            # Add results to the current batch
+            current_batch[self.response_column_name] = result[self.response_column_name]
+            current_batch['prompt_tokens'] = result['prompt_tokens']
+            current_batch['completion_tokens'] = result['completion_tokens']
+            current_batch['cached_tokens'] = result['cached_tokens']
+            current_batch['cost($)'] = result['cost($)']
+            if self.deadline:
+                current_batch['status'] = result['status']
         else:
             # # debugpy.breakpoint()
             # Single processing using pandas transform
@@ -521,11 +2017,49 @@ class LLMConnect(PluginV2):
             current_batch[self.response_column_name] = result[self.response_column_name]
             current_batch['prompt_tokens'] = result['prompt_tokens']
             current_batch['completion_tokens'] = result['completion_tokens']
+            current_batch['cached_tokens'] = result['cached_tokens']
             current_batch['cost($)'] = result['cost($)']
         
+        self.processing_seconds += time.perf_counter() - batch_start
+        self.write_output(batch, current_batch)
+
+    def on_pipeline_output(self, payload, results):
+        """Add the row results of a pipelined batch to its rows and write it."""
+        batch, current_batch = payload
+        columns = [self.response_column_name, 'prompt_tokens', 'completion_tokens', 'cached_tokens', 'cost($)']
+        if self.operation == CLASSIFICATION_OPERATION:
+            columns += [probability_column(label) for label in self.labels]
+        elif self.cascade_models:
+            columns.append('cascade_tier')
+        result = pd.DataFrame(results, index=current_batch.index).reindex(columns=columns)
+        for column in columns:
+            current_batch[column] = result[column]
+        self.write_output(batch, current_batch)
+
+    def write_output(self, batch, current_batch):
+        """Count the processed rows and tokens and write a processed batch to the output anchor."""
+        self.processed_rows += len(current_batch)
+        self.processed_prompt_tokens += int(pd.to_numeric(current_batch['prompt_tokens'], errors="coerce").fillna(0).sum())
+        self.processed_completion_tokens += int(pd.to_numeric(current_batch['completion_tokens'], errors="coerce").fillna(0).sum())
+
         # Write the current batch to the output anchor
         self.provider.io.info(f"Writing final batch to output anchor.")
-        self.provider.write_to_anchor("Output", pa.Table.from_pandas(current_batch))
+        self.write_table(self.output_table(batch, current_batch))
+
+    def write_table(self, table):
+        """Write an output table to the output anchor, or to the sidecar file with only the keys and status to the anchor."""
+        if self.sidecar:
+            missing = [key for key in self.sidecar_keys if key not in table.column_names]
+            if missing:
+                raise RuntimeError(f"Incoming data must contain the sidecar key columns: {', '.join(missing)}")
+            if ROW_ID_COLUMN not in table.column_names:
+                # Numbers the rows across record batches, unless the input has its own row ids
+                table = table.add_column(0, ROW_ID_COLUMN, pa.array(range(self.sidecar.rows, self.sidecar.rows + table.num_rows), type=pa.int64()))
+            if 'status' not in table.column_names:
+                table = table.append_column('status', row_status(table.column(self.response_column_name)))
+            self.sidecar.write(table)
+            table = key_table(table, self.sidecar_keys)
+        self.provider.write_to_anchor("Output", table)
 
 
     def on_incoming_connection_complete(self, anchor: Anchor) -> None:
@@ -542,14 +2076,83 @@ class LLMConnect(PluginV2):
         # debugpy.breakpoint()
         # print('break on on_incoming_connection_complete')
         self.provider.io.info(f"Incoming connection complete for anchor: {anchor.name}")
+        if self.pipeline:
+            with self.profiled(step="pipeline drain"):
+                self.pipeline.drain()
 
     def on_complete(self) -> None:
         """Clean up any plugin resources."""
         # debugpy.breakpoint()
         # print('break on on_complete')
 
+        with self.profiled(step="completion"):
+            if self.pipeline:
+                self.pipeline.drain()
+                self.processing_seconds += self.pipeline.busy_seconds
+                self.pipeline.close()
+            if self.sidecar:
+                self.sidecar.close()
+                self.provider.io.info(f"{self.sidecar.rows} rows written to {self.sidecar.path}")
+
         # Write final information and close the log file
         end_time = datetime.now()
         self.log_file.write(f"End Time: {end_time}\n")
         self.log_file.write(f"Total Cost: ${self.total_cost:.4f}\n")
+        if self.hedge_policy:
+            self.log_file.write(f"Hedged Requests: {self.hedge_policy.hedges} of {self.hedge_policy.requests} ({self.hedge_policy.hedges_won} won by the hedge)\n")
+            self.log_file.write(f"Hedge Cost: ${self.hedge_cost:.4f}\n")
+        if self.cascade_stats:
+            for line in self.cascade_stats.summary():
+                self.provider.io.info(line)
+                self.log_file.write(f"{line}\n")
+        if self.run_plan:
+            for line in self.run_plan.summary(load_throughput(self.throughput_key)):
+                self.provider.io.info(line)
+                self.log_file.write(f"{line}\n")
+            worst_case_cost = self.run_plan.worst_case_cost()
+            if worst_case_cost is not None and worst_case_cost > self.max_budget:
+                self.provider.io.warn(f"The worst-case cost ${worst_case_cost:.4f} exceeds the ${self.max_budget:.4f} budget")
+        elif self.processed_rows and not self.simulate_response:
+            record_throughput(self.throughput_key, self.processed_rows, self.processed_prompt_tokens, self.processed_completion_tokens, self.processing_seconds)
+        if self.profiler:
+            for figures in self.profiler.batches:
+                self.log_file.write(f"{self.profiler.batch_summary(figures)}\n")
+            for path in self.profiler.write():
+                self.provider.io.info(f"Profile written to: {path}")
+            self.profiler.close()
+        if self.prompt_caching and self.processed_rows:
+            cache_line = f"Cached Prompt Tokens: {self.cached_prompt_tokens} of {self.processed_prompt_tokens} (saved ${self.cache_savings:.4f})"
+            self.provider.io.info(cache_line)
+            self.log_file.write(f"{cache_line}\n")
+        if self.concurrency_controller:
+            self.provider.io.info(self.concurrency_controller.summary())
+            for line in [self.concurrency_controller.summary()] + self.concurrency_controller.trace_lines():
+                self.log_file.write(f"{line}\n")
+        if self.deadline:
+            status_line = "Row Status: " + ", ".join(f"{status} {count}" for status, count in sorted(self.status_counts.items()))
+            self.provider.io.info(status_line)
+            self.log_file.write(f"{status_line}\n")
+        if self.pack_rows:
+            pack_line = f"Packed Rows: {self.packed_rows} in {self.packed_requests} requests, {self.resent_rows} sent again alone"
+            self.provider.io.info(pack_line)
+            self.log_file.write(f"{pack_line}\n")
+        if self.bucketed_rows and self.longest_first_seconds > 0:
+            bucketing_line = (
+                f"Length Bucketing: {self.bucketed_rows} rows in {self.bucketed_seconds:.2f}s ({self.bucketed_rows / max(self.bucketed_seconds, 1e-9):.1f} rows/s), "
+                f"{self.input_order_seconds / self.longest_first_seconds - 1:+.0%} throughput against input order (estimated {self.input_order_seconds:.2f}s)"
+            )
+            self.provider.io.info(bucketing_line)
+            self.log_file.write(f"{bucketing_line}\n")
+        if self.long_input:
+            self.log_file.write(f"Chunked Rows: {self.chunked_rows} ({self.chunk_count} chunks, {self.reduce_calls} reduce requests)\n")
+            self.log_file.write(f"Reduce Cost: ${self.reduce_cost:.4f}\n")
         self.log_file.close()
+        if self.event_loop:
+            self.event_loop.stop()
+        if self.worker_pool:
+            self.worker_pool.close()
+        if self.image_preprocessor:
+            self.image_preprocessor.close()
+        if self.daemon:
+            # Only the connection is closed, the daemon stays up for the next run
+            self.daemon.close()
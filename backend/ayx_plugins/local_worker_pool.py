@@ -0,0 +1,201 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Multi-process worker pool for local GGUF inference on many-core hosts."""
+
+import multiprocessing
+import os
+import queue
+import time
+
+from .prompt_files import read_prompt_file
+
+# Seconds to wait for a worker to load its model before the pool gives up.
+WORKER_START_TIMEOUT = 600
+# Seconds between liveness checks of the workers while waiting for results.
+WORKER_POLL_INTERVAL = 5
+# Completion argument naming the prompt file of a row, as `(path, max_tokens)`, read by the worker taking the row.
+PROMPT_FILE_KEY = "prompt_file"
+
+
+def available_cpus():
+    """Return the CPU ids this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cpus(cpus, num_workers):
+    """Split CPU ids into contiguous, equally sized sets, one per worker.
+
+    Contiguous ids usually belong to the same socket, so each worker stays on one NUMA node.
+    """
+    if num_workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(num_workers)]
+    size = len(cpus) // num_workers
+    # The last worker also takes the CPUs left over by the integer division
+    return [cpus[i * size:(i + 1) * size if i < num_workers - 1 else None] for i in range(num_workers)]
+
+
+def pin_to_cpus(cpus):
+    """Pin the current process to the given CPUs, returning False where it is not supported."""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+        return True
+    try:
+        import psutil
+    except ImportError:
+        return False
+    psutil.Process().cpu_affinity(cpus)
+    return True
+
+
+def read_task_prompt(llama, completion_kwargs):
+    """Put the text of the prompt file named in a task into its last message, cut with the model tokenizer."""
+    path, max_tokens = completion_kwargs.pop(PROMPT_FILE_KEY)
+    codec = (
+        lambda text: llama.tokenize(text.encode("utf-8"), add_bos=False),
+        lambda tokens: llama.detokenize(tokens).decode("utf-8", errors="ignore"),
+    )
+    completion_kwargs["messages"][-1]["content"] = read_prompt_file(path, max_tokens, codec)
+    return completion_kwargs
+
+
+def run_task(llama, completion_kwargs):
+    """Answer one task in a worker, returning the status and payload sent back to the pool and the seconds it took."""
+    started = time.perf_counter()
+    if PROMPT_FILE_KEY in completion_kwargs:
+        try:
+            completion_kwargs = read_task_prompt(llama, completion_kwargs)
+        except OSError as e:
+            return "error", f"Error reading prompt file: {e}", time.perf_counter() - started
+    try:
+        response = llama.create_chat_completion(**completion_kwargs)
+    except Exception as e:
+        return "error", f"{type(e).__name__}: {e}", time.perf_counter() - started
+    return "done", response, time.perf_counter() - started
+
+
+def _worker_main(worker_id, llama_kwargs, cpus, n_threads, tasks, results, llama_class=None):
+    """Load the model in a worker process and serve completion requests until told to stop."""
+    try:
+        pinned = pin_to_cpus(cpus)
+        if llama_class is None:
+            from llama_cpp import Llama as llama_class
+
+        # mmap lets every worker share the page cache of the GGUF instead of copying the weights
+        llama = llama_class(**dict(llama_kwargs, n_threads=n_threads, n_threads_batch=n_threads, use_mmap=True))
+    except Exception as e:
+        results.put(("failed", worker_id, f"{type(e).__name__}: {e}"))
+        return
+    results.put(("ready", worker_id, None if pinned else "CPU affinity is not supported on this platform"))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, completion_kwargs = task
+        status, payload, seconds = run_task(llama, completion_kwargs)
+        results.put((status, index, payload, seconds))
+
+
+class LocalWorkerError(RuntimeError):
+    """A completion failed inside a worker process."""
+
+
+class LocalWorkerPool:
+    """A pool of processes, each holding its own `Llama` pinned to a share of the CPUs.
+
+    Rows are sent over a shared task queue, so idle workers pick up the next row, and
+    `map` returns the completions in input order. A row may name its prompt file under
+    `PROMPT_FILE_KEY` instead of holding its text, the worker taking the row then reads it.
+    `llama_class` replaces `llama_cpp.Llama` in the workers; it must be importable by name,
+    as the workers are spawned.
+    """
+
+    def __init__(self, llama_kwargs, num_workers, threads_per_worker=None, on_warning=None, llama_class=None):
+        context = multiprocessing.get_context("spawn")
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.processes = []
+        self.row_seconds = []
+        for worker_id, cpus in enumerate(split_cpus(available_cpus(), num_workers)):
+            process = context.Process(
+                target=_worker_main,
+                args=(worker_id, llama_kwargs, cpus, threads_per_worker or len(cpus), self.tasks, self.results, llama_class),
+                name=f"llm-connect-worker-{worker_id}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+        try:
+            deadline = time.monotonic() + WORKER_START_TIMEOUT
+            for _ in self.processes:
+                while True:
+                    try:
+                        status, worker_id, message = self.results.get(timeout=WORKER_POLL_INTERVAL)
+                        break
+                    except queue.Empty:
+                        self.check_workers_alive()
+                        if time.monotonic() > deadline:
+                            raise RuntimeError(f"Local workers did not load the model within {WORKER_START_TIMEOUT} seconds")
+                if status == "failed":
+                    raise RuntimeError(f"Local worker {worker_id} failed to load the model: {message}")
+                if message and on_warning:
+                    on_warning(f"Local worker {worker_id}: {message}")
+        except Exception:
+            self.close()
+            raise
+
+    def check_workers_alive(self):
+        """Raise if a worker process has exited, as its rows would never be answered."""
+        dead = [process.name for process in self.processes if not process.is_alive()]
+        if dead:
+            raise RuntimeError(f"Local worker process exited unexpectedly: {', '.join(dead)}")
+
+    def map(self, completion_kwargs_list):
+        """Run every completion on the pool and return the results in input order.
+
+        Failed rows are returned as `LocalWorkerError` instances instead of raising, so a
+        single bad row does not lose the completions of the others. The seconds each row took
+        in its worker are kept in `row_seconds`, in input order.
+        """
+        for index, completion_kwargs in enumerate(completion_kwargs_list):
+            self.tasks.put((index, completion_kwargs))
+
+        outputs = [None] * len(completion_kwargs_list)
+        self.row_seconds = [0.0] * len(completion_kwargs_list)
+        remaining = len(completion_kwargs_list)
+        while remaining:
+            try:
+                status, index, payload, seconds = self.results.get(timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                self.check_workers_alive()
+                continue
+            outputs[index] = payload if status == "done" else LocalWorkerError(payload)
+            self.row_seconds[index] = seconds
+            remaining -= 1
+        return outputs
+
+    def close(self):
+        """Stop the workers and release their models."""
+        for process in self.processes:
+            if process.is_alive():
+                self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
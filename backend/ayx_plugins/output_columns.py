@@ -0,0 +1,85 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact Arrow output columns: dictionary-encoded repeated responses, int32 token counts and float32 costs."""
+
+import pandas as pd
+import pyarrow as pa
+
+# A response column is dictionary-encoded when it has at most this many distinct values per row.
+DICTIONARY_MAX_DISTINCT_RATIO = 0.5
+# Fewer responses than this in the first batch cannot tell repeated labels from free text.
+DICTIONARY_MIN_SAMPLE = 64
+
+
+def string_column(values, dictionary=True, max_distinct_ratio=DICTIONARY_MAX_DISTINCT_RATIO):
+    """Return a string array, dictionary-encoded when few distinct values repeat across the rows.
+
+    Classification-style responses then store each label once plus an int32 index per row.
+    """
+    # As objects, a column of only missing responses (float NaN in pandas) converts to nulls
+    array = pa.array(pd.Series(values, dtype=object), type=pa.string(), from_pandas=True)
+    if not dictionary:
+        return array
+    encoded = array.dictionary_encode()
+    if len(encoded.dictionary) <= max_distinct_ratio * len(array):
+        return encoded
+    return array
+
+
+class StringColumnEncoder:
+    """Encode a string column the same way in every record batch of a run.
+
+    The first batch decides on dictionary encoding from its distinct values, later batches
+    follow, so the output anchor keeps one schema for the whole run. A first batch of fewer
+    than `min_sample` responses is too small to judge and is dictionary-encoded, which costs
+    an int32 index per row when the responses turn out to be free text. Columns of a closed
+    set of values, such as class labels, are always dictionary-encoded.
+    """
+
+    def __init__(self, dictionary=True, max_distinct_ratio=DICTIONARY_MAX_DISTINCT_RATIO, min_sample=DICTIONARY_MIN_SAMPLE, closed_set=False):
+        self.dictionary = (True if closed_set else None) if dictionary else False
+        self.max_distinct_ratio = max_distinct_ratio
+        self.min_sample = min_sample
+
+    def encode(self, values):
+        if self.dictionary is None:
+            array = string_column(values, True, self.max_distinct_ratio)
+            if pa.types.is_dictionary(array.type) or len(array) - array.null_count < self.min_sample:
+                self.dictionary = True
+                return array if pa.types.is_dictionary(array.type) else array.dictionary_encode()
+            self.dictionary = False
+            return array
+        array = string_column(values, dictionary=False)
+        return array.dictionary_encode() if self.dictionary else array
+
+
+def int32_column(values):
+    """Return a nullable int32 array from a column of counts mixing numbers and None."""
+    return pa.array(pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").astype("Int32"), type=pa.int32())
+
+
+def float32_column(values):
+    """Return a nullable float32 array from a column of costs mixing numbers and None."""
+    return pa.array(pd.to_numeric(pd.Series(values, dtype=object), errors="coerce"), type=pa.float32(), from_pandas=True)
+
+
+def set_columns(table, columns):
+    """Append named arrays to a table, replacing input columns of the same name."""
+    for name, array in columns.items():
+        if name in table.column_names:
+            table = table.set_column(table.column_names.index(name), name, array)
+        else:
+            table = table.append_column(name, array)
+    return table
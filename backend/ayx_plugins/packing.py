@@ -0,0 +1,133 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Prompt packing: several short rows sent as numbered items of one request, answered as a JSON array."""
+
+import json
+import re
+
+DEFAULT_PACK_SIZE = 10
+DEFAULT_PACK_ANSWER_TOKENS = 16
+# Tokens of the item number in the prompt, and of the id and JSON syntax around each answer.
+ITEM_OVERHEAD_TOKENS = 8
+PACK_INSTRUCTION = (
+    "The user message holds {count} numbered items. Answer each item on its own, as if it were the only one. "
+    'Reply with only a JSON array of {count} objects in item order, each {{"id": <item number>, "answer": "<answer to the item>"}}.'
+)
+CODE_FENCE_PATTERN = r"^\s*```(?:json)?\s*|\s*```\s*$"
+
+
+def with_pack_instruction(messages, count):
+    """Add the packing instruction to the system message, or as a new system message."""
+    instruction = PACK_INSTRUCTION.format(count=count)
+    if messages and messages[0]["role"] == "system" and messages[0]["content"]:
+        return [{"role": "system", "content": f"{messages[0]['content']}\n\n{instruction}"}] + messages[1:]
+    return [{"role": "system", "content": instruction}] + [message for message in messages if message["role"] != "system"]
+
+
+def pack_items(prompts):
+    """Number the prompts of a pack from 1, one item per paragraph."""
+    return "\n\n".join(f"[{number}] {prompt}" for number, prompt in enumerate(prompts, start=1))
+
+
+def pack_groups(prompt_tokens, max_items, input_budget, answer_tokens, max_completion_tokens):
+    """Return lists of row positions, consecutive rows packed while the request fits its limits.
+
+    A pack holds at most `max_items` rows, its items fit in `input_budget` prompt tokens and
+    their answers of `answer_tokens` each in `max_completion_tokens`. Rows too long to share a
+    request are left alone in their group.
+    """
+    max_items = min(max_items, max_completion_tokens // (answer_tokens + ITEM_OVERHEAD_TOKENS))
+    if max_items < 2:
+        return [[position] for position in range(len(prompt_tokens))]
+    groups, group, used = [], [], 0
+    for position, tokens in enumerate(prompt_tokens):
+        tokens += ITEM_OVERHEAD_TOKENS
+        if group and (len(group) == max_items or used + tokens > input_budget):
+            groups.append(group)
+            group, used = [], 0
+        group.append(position)
+        used += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+def answer_text(answer):
+    if answer is None:
+        return None
+    return answer if isinstance(answer, str) else json.dumps(answer)
+
+
+def parse_packed_answers(text, count):
+    """Return the answer of each of the `count` items of a packed response, None for items missing or mismatched.
+
+    Answers are matched by their `id`. A plain array of exactly `count` values is taken in
+    order, and an object wrapping a single array is unwrapped.
+    """
+    answers = [None] * count
+    try:
+        items = json.loads(re.sub(CODE_FENCE_PATTERN, "", text or ""))
+    except ValueError:
+        return answers
+    if isinstance(items, dict):
+        arrays = [value for value in items.values() if isinstance(value, list)]
+        items = arrays[0] if len(arrays) == 1 else None
+    if not isinstance(items, list):
+        return answers
+    if all(isinstance(item, dict) and "id" in item for item in items):
+        seen = set()
+        for item in items:
+            try:
+                number = int(item["id"])
+            except (TypeError, ValueError):
+                continue
+            if not 1 <= number <= count:
+                continue
+            # An item answered twice is ambiguous and sent again alone
+            answers[number - 1] = None if number in seen else answer_text(item.get("answer"))
+            seen.add(number)
+        return answers
+    if len(items) == count and not any(isinstance(item, dict) for item in items):
+        return [answer_text(item) for item in items]
+    return answers
+
+
+def allocate(total, weights):
+    """Split an integer total in proportion to the weights, the shares summing to the total."""
+    if not weights:
+        return []
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        weights, weight_sum = [1] * len(weights), len(weights)
+    exact = [total * weight / weight_sum for weight in weights]
+    shares = [int(value) for value in exact]
+    # The remaining units go to the largest fractional parts
+    for position in sorted(range(len(exact)), key=lambda position: shares[position] - exact[position])[:total - sum(shares)]:
+        shares[position] += 1
+    return shares
+
+
+def split_cost(cost, prompt_tokens, completion_tokens, prices=None):
+    """Split the cost of a packed request over its rows from their share of the prompt and completion tokens.
+
+    With `(input, output)` token prices, output tokens weigh their price; the shares always sum
+    to `cost`, so cached-input discounts and hedge costs are spread the same way.
+    """
+    input_price, output_price = prices if prices else (1.0, 1.0)
+    weights = [prompt * input_price + completion * output_price for prompt, completion in zip(prompt_tokens, completion_tokens)]
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        return [cost / len(weights)] * len(weights) if weights else []
+    return [cost * weight / weight_sum for weight in weights]
@@ -0,0 +1,76 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pipelined processing of record batches: rows of several batches share one pool of requests."""
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+DEFAULT_PIPELINE_WORKERS = 8
+DEFAULT_PIPELINE_MEMORY_MB = 256
+
+
+class OrderedPipeline:
+    """Process the rows of queued record batches on a shared thread pool and emit the batches in arrival order.
+
+    `submit` queues the rows of a batch and returns at once, so the next batch can be read while
+    the rows of earlier ones are still in flight. Finished batches are passed to `on_output` on
+    the thread calling `submit` or `drain`, in the order they were submitted. When the queued
+    batches hold more than `max_bytes` of input, `submit` waits for the oldest batches to finish.
+    """
+
+    def __init__(self, process_row, on_output, workers=DEFAULT_PIPELINE_WORKERS, max_bytes=DEFAULT_PIPELINE_MEMORY_MB * 1024 * 1024):
+        self.process_row = process_row
+        self.on_output = on_output
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-connect-pipeline")
+        self.pending = deque()
+        self.pending_bytes = 0
+        self.busy_since = None
+        # Time with at least one batch in flight, the processing time of the run
+        self.busy_seconds = 0.0
+
+    def submit(self, payload, rows, nbytes):
+        """Queue the rows of a batch; `payload` is handed back to `on_output` with the row results."""
+        if not self.pending:
+            self.busy_since = time.perf_counter()
+        futures = [self.executor.submit(self.process_row, row) for row in rows]
+        self.pending.append((payload, futures, nbytes))
+        self.pending_bytes += nbytes
+        self.emit_finished()
+        while self.pending and self.pending_bytes > self.max_bytes:
+            self.emit_oldest()
+
+    def emit_oldest(self):
+        payload, futures, nbytes = self.pending.popleft()
+        self.pending_bytes -= nbytes
+        wait(futures)
+        if not self.pending:
+            self.busy_seconds += time.perf_counter() - self.busy_since
+        # A row that raised fails the run here, on the tool thread
+        self.on_output(payload, [future.result() for future in futures])
+
+    def emit_finished(self):
+        """Emit the batches at the head of the queue whose rows are all done."""
+        while self.pending and all(future.done() for future in self.pending[0][1]):
+            self.emit_oldest()
+
+    def drain(self):
+        """Wait for every queued batch and emit them in order."""
+        while self.pending:
+            self.emit_oldest()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,180 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pre-flight planning: estimate the tokens, cost and run time of a run without sending any completion."""
+
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_THROUGHPUT_PATH = os.path.expanduser("~/.ayx/llm_connect_throughput.json")
+# Recent runs kept per model and endpoint, so the estimate follows changes of host or provider load.
+THROUGHPUT_HISTORY_RUNS = 20
+TOKENIZE_BATCH_SIZE = 2048
+# Tokens the chat format adds around each message, as counted by OpenAI models.
+TOKENS_PER_MESSAGE = 4
+
+
+def batch_encoder(model):
+    """Return a function tokenizing a list of texts at once with the tokenizer litellm selects for the model.
+
+    tiktoken encodings and HuggingFace tokenizers are run in batch mode, other tokenizers text by text.
+    """
+    import litellm
+
+    try:
+        from litellm.utils import _select_tokenizer
+
+        selected = _select_tokenizer(model)
+    except Exception:
+        selected = {"type": None, "tokenizer": None}
+    tokenizer = selected["tokenizer"]
+    if selected["type"] == "openai_tokenizer" and hasattr(tokenizer, "encode_ordinary_batch"):
+        return tokenizer.encode_ordinary_batch
+    if hasattr(tokenizer, "encode_batch"):
+        return lambda texts: [encoded.ids for encoded in tokenizer.encode_batch(texts)]
+    return lambda texts: [litellm.encode(model=model, text=text) for text in texts]
+
+
+def count_tokens(texts, encode_batch, batch_size=TOKENIZE_BATCH_SIZE):
+    """Return the token count of every text as an int64 array, 0 for missing values.
+
+    Each distinct text is tokenized once, in batches of `batch_size`.
+    """
+    codes, uniques = pd.factorize(pd.Series(texts, dtype=object))
+    # The extra slot counts the missing values, which factorize codes as -1
+    counts = np.zeros(len(uniques) + 1, dtype=np.int64)
+    for start in range(0, len(uniques), batch_size):
+        texts_batch = [str(text) for text in uniques[start:start + batch_size]]
+        counts[start:start + len(texts_batch)] = [len(tokens) for tokens in encode_batch(texts_batch)]
+    return counts[codes]
+
+
+def token_prices(model):
+    """Return the `(input, output)` price per token of a model from the litellm cost map, or None."""
+    import litellm
+
+    try:
+        info = litellm.get_model_info(model)
+    except Exception:
+        return None
+    if info.get("input_cost_per_token") is None:
+        return None
+    return info["input_cost_per_token"], info.get("output_cost_per_token") or 0.0
+
+
+def throughput_key(platform, endpoint, model):
+    return f"{platform}|{endpoint or ''}|{model}"
+
+
+def load_throughput(key, path=DEFAULT_THROUGHPUT_PATH):
+    """Return the recorded runs of a model and endpoint, oldest first."""
+    try:
+        with open(path) as f:
+            return json.load(f).get(key, [])
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+
+def record_throughput(key, rows, prompt_tokens, completion_tokens, seconds, path=DEFAULT_THROUGHPUT_PATH):
+    """Append a finished run to the history of its model and endpoint, keeping the latest runs."""
+    try:
+        with open(path) as f:
+            history = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        history = {}
+    runs = history.get(key, [])
+    runs.append({
+        "rows": rows,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "seconds": seconds,
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+    })
+    history[key] = runs[-THROUGHPUT_HISTORY_RUNS:]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(history, f, indent=2)
+
+
+def estimate_seconds(runs, rows, max_completion_tokens):
+    """Estimate the run time of `rows` rows from past runs: `(expected, worst_case)` seconds, or None.
+
+    The expected time assumes rows as long as in past runs. The worst case assumes every row
+    generates `max_completion_tokens`, with time growing with the completion tokens.
+    """
+    history_rows = sum(run["rows"] for run in runs)
+    history_seconds = sum(run["seconds"] for run in runs)
+    if not history_rows or not history_seconds:
+        return None
+    expected = rows * history_seconds / history_rows
+    completion_per_row = sum(run["completion_tokens"] for run in runs) / history_rows
+    if not completion_per_row:
+        return expected, expected
+    return expected, max(expected, expected * max_completion_tokens / completion_per_row)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class RunPlan:
+    """Token and cost totals of the record batches of a dry run."""
+
+    def __init__(self, max_completion_tokens, prices=None):
+        self.max_completion_tokens = max_completion_tokens
+        self.prices = prices
+        self.rows = 0
+        self.prompt_tokens = 0
+        self.trimmed_rows = 0
+
+    def add(self, prompt_tokens, trimmed_rows=0):
+        self.rows += len(prompt_tokens)
+        self.prompt_tokens += int(prompt_tokens.sum())
+        self.trimmed_rows += trimmed_rows
+
+    def input_cost(self):
+        return self.prompt_tokens * self.prices[0] if self.prices else None
+
+    def worst_case_cost(self):
+        if not self.prices:
+            return None
+        return self.input_cost() + self.rows * self.max_completion_tokens * self.prices[1]
+
+    def summary(self, runs):
+        """Report lines: tokens, input and worst-case cost, and the run time estimated from `runs`."""
+        lines = [
+            f"Plan: {self.rows} rows, {self.prompt_tokens:,} prompt tokens "
+            f"({self.prompt_tokens / max(1, self.rows):.0f} per row), up to {self.rows * self.max_completion_tokens:,} completion tokens"
+        ]
+        if self.trimmed_rows:
+            lines.append(f"Plan: {self.trimmed_rows} rows exceed the model input window, counted at the window size")
+        if self.prices:
+            lines.append(f"Plan cost: input ${self.input_cost():.4f}, worst case with {self.max_completion_tokens} completion tokens per row ${self.worst_case_cost():.4f}")
+        else:
+            lines.append("Plan cost: no price for this model in the litellm cost map")
+        seconds = estimate_seconds(runs, self.rows, self.max_completion_tokens)
+        if seconds:
+            lines.append(
+                f"Plan time: about {format_duration(seconds[0])}, at most {format_duration(seconds[1])} "
+                f"(from {len(runs)} previous runs of this model and endpoint)"
+            )
+        else:
+            lines.append("Plan time: no previous run of this model and endpoint to estimate from")
+        return lines
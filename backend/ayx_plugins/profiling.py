@@ -0,0 +1,304 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Profile record batches: CPU time by call stack, Python allocations and peak memory per batch."""
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+SAMPLING_PROFILER = "sampling"
+CPROFILE_PROFILER = "cprofile"
+DEFAULT_SAMPLING_INTERVAL = 0.005
+# Frames kept per allocation traceback; more frames attribute allocations better but cost more.
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 25
+# cProfile stacks are weighted in microseconds, and stacks under a microsecond are dropped.
+CPROFILE_SECONDS_PER_COUNT = 1e-6
+
+
+def frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def pstats_frame_name(function):
+    """Name a pstats function key like a sampled frame; built-ins keep their own name."""
+    filename, line, name = function
+    if filename == "~":
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def cprofile_stacks(profile, root):
+    """Rebuild collapsed stacks rooted at `root` from a cProfile profile, weighted in microseconds.
+
+    cProfile keeps only caller and callee pairs, so the time of a function called from several
+    places is split between its callers in proportion to the time spent under each of them.
+    Recursive calls are folded into the outermost call.
+    """
+    stats = pstats.Stats(profile).stats
+    callees = defaultdict(list)
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, (_, _, _, edge_seconds) in callers.items():
+            callees[caller].append((function, edge_seconds))
+    stacks = Counter()
+    # Each entry is a stack of function keys and the seconds the last function spent on that stack
+    pending = [((function,), cumulative) for function, (_, _, _, cumulative, callers) in stats.items() if not callers]
+    while pending:
+        stack, seconds = pending.pop()
+        _, _, own_seconds, cumulative, _ = stats[stack[-1]]
+        share = seconds / cumulative if cumulative > 0 else 0
+        count = round(own_seconds * share / CPROFILE_SECONDS_PER_COUNT)
+        if count > 0:
+            stacks[";".join([root] + [pstats_frame_name(function) for function in stack])] += count
+        for callee, edge_seconds in callees[stack[-1]]:
+            if callee not in stack and edge_seconds * share >= CPROFILE_SECONDS_PER_COUNT:
+                pending.append((stack + (callee,), edge_seconds * share))
+    return stacks
+
+
+def write_collapsed(stacks, path):
+    """Write stacks in the collapsed format read by flamegraph.pl, speedscope and inferno."""
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+
+def write_speedscope(stacks, path, name, seconds_per_count):
+    """Write collapsed stacks as a speedscope file with one sampled profile per thread."""
+    frames, frame_index = [], {}
+    profiles = {}
+    for stack, count in stacks.items():
+        thread, *names = stack.split(";")
+        indexes = []
+        for frame in names:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                frames.append({"name": frame})
+            indexes.append(frame_index[frame])
+        profile = profiles.setdefault(thread, {"samples": [], "weights": []})
+        profile["samples"].append(indexes)
+        profile["weights"].append(count * seconds_per_count)
+    document = {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "LLMConnect",
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled", "name": thread, "unit": "seconds",
+                "startValue": 0, "endValue": sum(profile["weights"]),
+                "samples": profile["samples"], "weights": profile["weights"],
+            }
+            for thread, profile in profiles.items()
+        ],
+    }
+    with open(path, "w") as f:
+        json.dump(document, f)
+
+
+class SamplingProfiler:
+    """Sample the Python stacks of every thread at a fixed interval from a background thread.
+
+    Unlike cProfile it sees the worker threads as well, and its overhead does not grow with the
+    number of function calls. Stacks are counted in collapsed form, rooted at the thread name.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLING_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.active = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="llm-connect-profiler", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.active.wait()
+            if self.stopped.is_set():
+                return
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.thread.ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread {ident}"))
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.active.set()
+
+    def stop(self):
+        self.active.clear()
+
+    def close(self):
+        self.stopped.set()
+        self.active.set()
+
+
+def reset_peak_rss():
+    """Reset the peak resident set size of the process where the OS allows it (Linux)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_bytes():
+    """Return the peak resident set size of the process, or None when it cannot be read.
+
+    On Linux the peak since the last `reset_peak_rss`, elsewhere the peak of the whole process.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, "peak_wset", memory.rss)
+
+
+class RunProfiler:
+    """Profile each record batch and write the profile files of the run next to the cost log.
+
+    `mode` is "sampling" for the sampling profiler or "cprofile" for cProfile, which only sees
+    the thread running the tool. Both write collapsed stacks and a speedscope file, cProfile its
+    `.pstats` file as well. With `trace_memory`, tracemalloc records Python allocations.
+    """
+
+    def __init__(self, mode, path_prefix, trace_memory=False, interval=DEFAULT_SAMPLING_INTERVAL):
+        if mode not in (SAMPLING_PROFILER, CPROFILE_PROFILER):
+            raise ValueError(f"Unknown profiler '{mode}', use '{SAMPLING_PROFILER}' or '{CPROFILE_PROFILER}'")
+        self.mode = mode
+        self.path_prefix = path_prefix
+        self.sampler = SamplingProfiler(interval) if mode == SAMPLING_PROFILER else None
+        self.cprofile = cProfile.Profile() if mode == CPROFILE_PROFILER else None
+        self.cprofile_thread = threading.current_thread().name
+        self.trace_memory = trace_memory and not tracemalloc.is_tracing()
+        if self.trace_memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.first_snapshot = None
+        self.batches = []
+
+    def batch(self, rows):
+        """Profile the processing of one record batch of `rows` rows."""
+        return self.measure({"batch": sum("batch" in figures for figures in self.batches) + 1, "rows": rows})
+
+    def step(self, name):
+        """Profile a step of the run outside the record batches, such as draining the pipeline."""
+        return self.measure({"step": name})
+
+    @contextmanager
+    def measure(self, figures):
+        reset_peak_rss()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        if self.sampler:
+            self.sampler.start()
+        if self.cprofile:
+            self.cprofile_thread = threading.current_thread().name
+            self.cprofile.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if self.cprofile:
+                self.cprofile.disable()
+            if self.sampler:
+                self.sampler.stop()
+            figures.update(seconds=seconds, peak_rss=peak_rss_bytes())
+            if self.trace_memory:
+                figures["peak_traced"] = tracemalloc.get_traced_memory()[1]
+                if self.first_snapshot is None:
+                    self.first_snapshot = tracemalloc.take_snapshot()
+            self.batches.append(figures)
+
+    def batch_summary(self, figures):
+        mib = 1024 ** 2
+        if "step" in figures:
+            line = f"Profile {figures['step']}: {figures['seconds']:.2f}s"
+        else:
+            line = f"Profile batch {figures['batch']}: {figures['rows']} rows in {figures['seconds']:.2f}s"
+        if figures["peak_rss"] is not None:
+            line += f", peak RSS {figures['peak_rss'] / mib:.1f} MiB"
+        if "peak_traced" in figures:
+            line += f", peak Python allocations {figures['peak_traced'] / mib:.1f} MiB"
+        return line
+
+    def write_memory_report(self, path):
+        with open(path, "w") as f:
+            for figures in self.batches:
+                f.write(self.batch_summary(figures) + "\n")
+            if not self.trace_memory:
+                return
+            snapshot = tracemalloc.take_snapshot()
+            f.write(f"\nTop {TOP_ALLOCATIONS} allocation sites at the end of the run:\n")
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                f.write(f"{stat}\n")
+            if self.first_snapshot is not None:
+                f.write(f"\nTop {TOP_ALLOCATIONS} allocation sites grown since the first batch:\n")
+                for stat in snapshot.compare_to(self.first_snapshot, "lineno")[:TOP_ALLOCATIONS]:
+                    f.write(f"{stat}\n")
+
+    def write(self):
+        """Write the profile files and return their paths."""
+        # The memory report comes first, so the allocations of writing the other files stay out of it
+        paths = [f"{self.path_prefix}_memory.txt"]
+        self.write_memory_report(paths[-1])
+        if self.sampler:
+            stacks, seconds_per_count = self.sampler.stacks, self.sampler.interval
+        else:
+            paths.append(f"{self.path_prefix}.pstats")
+            self.cprofile.dump_stats(paths[-1])
+            stacks, seconds_per_count = cprofile_stacks(self.cprofile, self.cprofile_thread), CPROFILE_SECONDS_PER_COUNT
+        paths.append(f"{self.path_prefix}.collapsed")
+        write_collapsed(stacks, paths[-1])
+        paths.append(f"{self.path_prefix}.speedscope.json")
+        write_speedscope(stacks, paths[-1], os.path.basename(self.path_prefix), seconds_per_count)
+        return paths
+
+    def close(self):
+        if self.sampler:
+            self.sampler.close()
+        if self.trace_memory:
+            tracemalloc.stop()
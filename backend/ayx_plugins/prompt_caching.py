@@ -0,0 +1,74 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Provider-side prompt prefix caching: mark the static prefix of the messages and read the cached token counts."""
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def needs_cache_control(model):
+    """Whether the provider of `model` only caches prefixes marked with `cache_control`.
+
+    OpenAI, Azure, DeepSeek and Gemini cache repeated prefixes on their own; Anthropic models,
+    including those served by Bedrock and Vertex AI, only cache up to a marked block.
+    """
+    try:
+        import litellm
+
+        provider = litellm.get_llm_provider(model)[1]
+    except Exception:
+        return False
+    return provider == "anthropic" or (provider in ("bedrock", "vertex_ai") and "claude" in model.lower())
+
+
+def with_cache_control(messages):
+    """Mark the end of the leading system messages, the static prefix shared by every row, as cacheable."""
+    prefix = 0
+    while prefix < len(messages) and messages[prefix]["role"] == "system":
+        prefix += 1
+    if not prefix or not messages[prefix - 1]["content"]:
+        return messages
+    last = messages[prefix - 1]
+    content = last["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    content = content[:-1] + [dict(content[-1], cache_control=CACHE_CONTROL)]
+    return messages[:prefix - 1] + [dict(last, content=content)] + messages[prefix:]
+
+
+def cached_token_counts(usage):
+    """Return the prompt tokens read from and written to the provider cache, litellm reports both on `usage`."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or getattr(usage, "cache_read_input_tokens", None) or 0
+    written = getattr(usage, "cache_creation_input_tokens", None) or 0
+    return int(cached), int(written)
+
+
+def cache_savings(model, cached_tokens, written_tokens=0):
+    """Return what the cache saved on the prompt of a request, net of the cache write premium, or 0 if not priced."""
+    if not cached_tokens and not written_tokens:
+        return 0.0
+    try:
+        import litellm
+
+        info = litellm.get_model_info(model)
+    except Exception:
+        return 0.0
+    input_cost = info.get("input_cost_per_token") or 0.0
+    read_cost = info.get("cache_read_input_token_cost")
+    write_cost = info.get("cache_creation_input_token_cost")
+    savings = cached_tokens * (input_cost - read_cost) if read_cost is not None else 0.0
+    if write_cost is not None:
+        savings -= written_tokens * (write_cost - input_cost)
+    return savings
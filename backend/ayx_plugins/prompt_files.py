@@ -0,0 +1,67 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Prompts read from files: the prompt field holds paths and each file is read when its row is sent."""
+
+import codecs
+import mmap
+import os
+
+from .scheduling import CHARS_PER_TOKEN
+
+# Characters read per requested token, twice the average so the exact token cut has enough text.
+READ_CHARS_PER_TOKEN = 2 * CHARS_PER_TOKEN
+MAX_UTF8_BYTES = 4
+
+
+def read_prompt_file(path, max_tokens=None, codec=None):
+    """Return the text of a UTF-8 file, or of about its first `max_tokens` tokens.
+
+    The file is memory-mapped, so with `max_tokens` only the pages holding the first tokens are
+    read. `codec` is an `(encode, decode)` pair cutting the text at exactly `max_tokens` tokens;
+    without it, or when the tokenizer fails, the text is cut at the average characters per token.
+    """
+    with open(os.path.expanduser(path), "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if not max_tokens:
+                with memoryview(mapped) as view:
+                    return str(view, "utf-8", "replace")
+            chars = max_tokens * READ_CHARS_PER_TOKEN
+            # A character cut at the end of the slice is left out rather than replaced
+            text = codecs.getincrementaldecoder("utf-8")("replace").decode(mapped[:chars * MAX_UTF8_BYTES])[:chars]
+    return truncate_tokens(text, max_tokens, codec)
+
+
+def truncate_tokens(text, max_tokens, codec=None):
+    """Cut `text` to `max_tokens` tokens of `codec`, or to the average characters per token without one."""
+    if codec is not None:
+        encode, decode = codec
+        try:
+            tokens = encode(text)
+            return text if len(tokens) <= max_tokens else decode(tokens[:max_tokens])
+        except Exception:
+            pass
+    return text[:max_tokens * CHARS_PER_TOKEN]
+
+
+def estimate_file_tokens(path, max_tokens=None):
+    """Cheap estimate of the tokens a prompt file adds, from its size, without reading it."""
+    try:
+        tokens = os.path.getsize(os.path.expanduser(path)) // CHARS_PER_TOKEN + 1
+    except (OSError, TypeError):
+        return 0
+    return min(tokens, max_tokens) if max_tokens else tokens
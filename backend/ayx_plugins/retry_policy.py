@@ -0,0 +1,207 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Error-class-aware retries with jittered backoff and a circuit breaker."""
+
+import asyncio
+import random
+import time
+from collections import deque, namedtuple
+
+import litellm
+
+RATE_LIMIT = "rate_limit"
+TIMEOUT = "timeout"
+SERVER_ERROR = "server_error"
+AUTH = "auth"
+BAD_REQUEST = "bad_request"
+CONTEXT_OVERFLOW = "context_overflow"
+UNKNOWN = "unknown"
+
+DEFAULT_BREAKER_ERROR_RATE = 50.0
+DEFAULT_BREAKER_WINDOW = 20
+
+RetryRule = namedtuple("RetryRule", ["max_retries", "base_delay", "max_delay"])
+
+# Auth, bad request and context overflow errors fail the same way on every attempt.
+DEFAULT_RETRY_RULES = {
+    RATE_LIMIT: RetryRule(8, 2.0, 60.0),
+    TIMEOUT: RetryRule(3, 1.0, 20.0),
+    SERVER_ERROR: RetryRule(5, 1.0, 30.0),
+    AUTH: RetryRule(0, 0.0, 0.0),
+    BAD_REQUEST: RetryRule(0, 0.0, 0.0),
+    CONTEXT_OVERFLOW: RetryRule(0, 0.0, 0.0),
+    UNKNOWN: RetryRule(2, 1.0, 10.0),
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of sending a request once the circuit breaker has opened."""
+
+
+def classify_error(error):
+    """Map a completion exception to one of the retry error classes."""
+    # ContextWindowExceededError subclasses BadRequestError, check it first
+    if isinstance(error, litellm.ContextWindowExceededError):
+        return CONTEXT_OVERFLOW
+    if isinstance(error, litellm.RateLimitError):
+        return RATE_LIMIT
+    if isinstance(error, (litellm.Timeout, asyncio.TimeoutError, TimeoutError)):
+        return TIMEOUT
+    if isinstance(error, (litellm.AuthenticationError, litellm.PermissionDeniedError)):
+        return AUTH
+    if isinstance(error, (litellm.InternalServerError, litellm.ServiceUnavailableError,
+                          litellm.BadGatewayError, litellm.APIConnectionError)):
+        return SERVER_ERROR
+    if isinstance(error, (litellm.BadRequestError, litellm.NotFoundError, litellm.UnprocessableEntityError)):
+        if "context" in str(error).lower() and "length" in str(error).lower():
+            return CONTEXT_OVERFLOW
+        return BAD_REQUEST
+
+    status_code = getattr(error, "status_code", None)
+    if status_code == 429:
+        return RATE_LIMIT
+    if status_code in (408, 504):
+        return TIMEOUT
+    if status_code in (401, 403):
+        return AUTH
+    if isinstance(status_code, int) and 400 <= status_code < 500:
+        return BAD_REQUEST
+    if isinstance(status_code, int) and status_code >= 500:
+        return SERVER_ERROR
+    return UNKNOWN
+
+
+def retry_after_seconds(error):
+    """Return the provider's Retry-After delay in seconds if the error carries one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Open for the rest of the run once the error rate over a window of requests crosses a threshold.
+
+    Rate-limit errors are backpressure rather than failures and are not counted.
+    """
+
+    def __init__(self, error_rate=DEFAULT_BREAKER_ERROR_RATE, window=DEFAULT_BREAKER_WINDOW, on_open=None):
+        self.error_rate = error_rate
+        self.outcomes = deque(maxlen=window)
+        self.on_open = on_open
+        self.is_open = False
+
+    def current_error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return 100.0 * self.outcomes.count(False) / len(self.outcomes)
+
+    def record(self, success, error_class=None):
+        if error_class == RATE_LIMIT or self.is_open:
+            return
+        self.outcomes.append(success)
+        if len(self.outcomes) == self.outcomes.maxlen and self.current_error_rate() >= self.error_rate:
+            self.is_open = True
+            if self.on_open:
+                self.on_open(self)
+
+    def check(self):
+        if self.is_open:
+            raise CircuitOpenError(
+                f"Circuit breaker open: {self.current_error_rate():.0f}% of the last {len(self.outcomes)} requests failed"
+            )
+
+
+class RetryPolicy:
+    """Retry a request according to the class of each error, with full-jitter exponential backoff."""
+
+    def __init__(self, rules=None, max_retries=None, breaker=None):
+        self.rules = dict(DEFAULT_RETRY_RULES, **(rules or {}))
+        self.max_retries = max_retries
+        self.breaker = breaker
+
+    def should_retry(self, error_class, attempt):
+        max_retries = self.rules[error_class].max_retries
+        if self.max_retries is not None:
+            max_retries = min(max_retries, self.max_retries)
+        return attempt < max_retries
+
+    def backoff(self, error_class, attempt, error=None):
+        """Return the delay before the next attempt, honouring Retry-After on rate limits."""
+        rule = self.rules[error_class]
+        delay = random.uniform(0, min(rule.max_delay, rule.base_delay * 2 ** attempt))
+        if error_class == RATE_LIMIT:
+            retry_after = retry_after_seconds(error)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, rule.max_delay))
+        return delay
+
+    def _next_delay(self, error, attempt):
+        """Record a failed attempt and return the backoff delay, or re-raise when it must not be retried."""
+        error_class = classify_error(error)
+        if self.breaker:
+            self.breaker.record(False, error_class)
+        if not self.should_retry(error_class, attempt):
+            raise error
+        return self.backoff(error_class, attempt, error)
+
+    def _attempt_started(self):
+        if self.breaker:
+            self.breaker.check()
+
+    def record_success(self):
+        if self.breaker:
+            self.breaker.record(True)
+
+    def call(self, fn, first_error=None):
+        """Call `fn()` until it succeeds or its error class is out of retries.
+
+        `first_error` is the failure of an attempt already made outside the policy, such as a
+        row of a batch completion.
+        """
+        attempt = 0
+        error = first_error
+        while True:
+            if error is None:
+                self._attempt_started()
+                try:
+                    result = fn()
+                    self.record_success()
+                    return result
+                except Exception as e:
+                    error = e
+            time.sleep(self._next_delay(error, attempt))
+            attempt += 1
+            error = None
+
+    async def acall(self, fn):
+        """Await the coroutine factory `fn()` with the same retry rules as `call`."""
+        attempt = 0
+        while True:
+            self._attempt_started()
+            try:
+                result = await fn()
+                self.record_success()
+                return result
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                delay = self._next_delay(e, attempt)
+            await asyncio.sleep(delay)
+            attempt += 1
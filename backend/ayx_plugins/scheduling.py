@@ -0,0 +1,45 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Order rows by estimated prompt length so one long prompt picked up last does not hold back the other workers."""
+
+import heapq
+
+# Rough characters per token, good enough to rank prompts by length without a tokenizer.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Cheap estimate of the token count of a prompt."""
+    if not isinstance(text, str):
+        return 0
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def longest_first(lengths):
+    """Row positions from the longest to the shortest, for queues where idle workers take the next row."""
+    return sorted(range(len(lengths)), key=lambda position: lengths[position], reverse=True)
+
+
+
+def makespan(seconds, workers, order=None):
+    """Seconds `workers` take to answer rows of the given durations, each idle worker taking the next row in `order`.
+
+    With the durations measured on one order, this estimates how long another order would have taken.
+    """
+    order = range(len(seconds)) if order is None else order
+    finish = [0.0] * max(1, min(workers, len(seconds)))
+    for position in order:
+        heapq.heapreplace(finish, finish[0] + seconds[position])
+    return max(finish)
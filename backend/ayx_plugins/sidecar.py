@@ -0,0 +1,123 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sidecar output: stream the full output rows to a Parquet or Arrow IPC file while Designer only gets their keys."""
+
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+from .deadlines import STATUS_ERROR, STATUS_OK
+
+PARQUET_FORMAT = "parquet"
+ARROW_FORMAT = "arrow"
+ARROW_EXTENSIONS = (".arrow", ".arrows", ".ipc")
+DEFAULT_SIDECAR_COMPRESSION = "zstd"
+DEFAULT_ROW_GROUP_ROWS = 65536
+ROW_ID_COLUMN = "row_id"
+
+
+def sidecar_format(path, configured=None):
+    """Return the configured format, or the one the file extension names (Parquet by default)."""
+    if configured:
+        if configured not in (PARQUET_FORMAT, ARROW_FORMAT):
+            raise ValueError(f"Unknown sidecar format '{configured}', use '{PARQUET_FORMAT}' or '{ARROW_FORMAT}'")
+        return configured
+    return ARROW_FORMAT if os.path.splitext(path)[1].lower() in ARROW_EXTENSIONS else PARQUET_FORMAT
+
+
+def decode_dictionaries(table):
+    """Replace dictionary-encoded columns by their values.
+
+    Response columns are only dictionary-encoded in batches with few distinct values, while a
+    stream has one schema for every batch. Parquet encodes repeated values on its own.
+    """
+    for position, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(position, field.name, table.column(position).cast(field.type.value_type))
+    return table
+
+
+def row_status(responses):
+    """Status of rows without one: "ok" with a response, "error" without."""
+    return pc.if_else(pc.is_null(responses), STATUS_ERROR, STATUS_OK)
+
+
+def key_table(table, key_fields, status_column="status"):
+    """Return the columns Designer gets when the full rows go to the sidecar: row id, key fields and status."""
+    return table.select([ROW_ID_COLUMN] + [name for name in key_fields if name != ROW_ID_COLUMN] + [status_column])
+
+
+class SidecarWriter:
+    """Append output tables to a Parquet file in row groups of `row_group_rows`, or to an Arrow IPC stream.
+
+    The file is created with the schema of the first table. Parquet rows are buffered until a
+    row group is full, Arrow IPC batches are written as they come.
+    """
+
+    def __init__(self, path, file_format=PARQUET_FORMAT, compression=DEFAULT_SIDECAR_COMPRESSION, row_group_rows=DEFAULT_ROW_GROUP_ROWS):
+        self.path = path
+        self.file_format = file_format
+        self.compression = None if compression in (None, "", "none") else compression
+        self.row_group_rows = row_group_rows
+        self.schema = None
+        self.writer = None
+        self.buffered = []
+        self.buffered_rows = 0
+        self.rows = 0
+
+    def open(self, schema):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.schema = schema
+        if self.file_format == PARQUET_FORMAT:
+            self.writer = pq.ParquetWriter(self.path, schema, compression=self.compression or "none")
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=self.compression)
+            self.writer = pa.ipc.new_stream(self.path, schema, options=options)
+
+    def write(self, table):
+        table = decode_dictionaries(table)
+        if self.writer is None:
+            self.open(table.schema)
+        table = table.select(self.schema.names).cast(self.schema)
+        self.rows += table.num_rows
+        if self.file_format != PARQUET_FORMAT:
+            self.writer.write_table(table)
+            return
+        self.buffered.append(table)
+        self.buffered_rows += table.num_rows
+        if self.buffered_rows >= self.row_group_rows:
+            self.flush(whole_groups=True)
+
+    def flush(self, whole_groups=False):
+        """Write the buffered rows; with `whole_groups`, only full row groups and keep the rest buffered."""
+        if not self.buffered:
+            return
+        table = pa.concat_tables(self.buffered)
+        rows = table.num_rows - table.num_rows % self.row_group_rows if whole_groups else table.num_rows
+        if rows:
+            self.writer.write_table(table.slice(0, rows), row_group_size=self.row_group_rows)
+        self.buffered = [table.slice(rows)] if rows < table.num_rows else []
+        self.buffered_rows = table.num_rows - rows
+
+    def close(self):
+        if self.writer is None:
+            return
+        if self.file_format == PARQUET_FORMAT:
+            self.flush()
+        self.writer.close()
+        self.writer = None
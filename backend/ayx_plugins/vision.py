@@ -0,0 +1,216 @@
+# Copyright (C) 2022 Alteryx, Inc. All rights reserved.
+#
+# Licensed under the ALTERYX SDK AND API LICENSE AGREEMENT;
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.alteryx.com/alteryx-sdk-and-api-license-agreement
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Image input for local vision models: background preprocessing and a cache of projector encodings."""
+
+import base64
+import ctypes
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_IMAGE_MAX_SIZE = 1024
+DEFAULT_IMAGE_CACHE_MB = 512
+IMAGE_PREPROCESS_WORKERS = 4
+# Preprocessed images kept in memory so an image shared by many rows is read and resized once.
+PREPROCESSED_IMAGE_CACHE_ENTRIES = 256
+DEFAULT_VISION_CHAT_HANDLER = "Llava15ChatHandler"
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_image(value):
+    """Return the bytes of an image given as a file path or a binary blob."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    with open(value, "rb") as f:
+        return f.read()
+
+
+def prepare_image(data, max_size=DEFAULT_IMAGE_MAX_SIZE):
+    """Decode an image, shrink it so its longest side is at most `max_size` and return it as a PNG data URI.
+
+    Without Pillow the image is passed through unchanged, llama.cpp then decodes JPEG and PNG itself.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return "data:image/png;base64," + base64.b64encode(data).decode("ascii")
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((max_size, max_size))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+class ImagePreprocessor:
+    """Read, decode and resize images on a thread pool ahead of inference.
+
+    `prefetch` returns a future of the image data URI. Images are cached by file path or blob
+    content hash, so an image reused across prompts is only prepared once.
+    """
+
+    def __init__(self, max_size=DEFAULT_IMAGE_MAX_SIZE, workers=IMAGE_PREPROCESS_WORKERS):
+        self.max_size = max_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-connect-image")
+        self.futures = OrderedDict()
+
+    def prefetch(self, value):
+        key = value if isinstance(value, str) else content_hash(bytes(value))
+        future = self.futures.get(key)
+        if future is None:
+            future = self.executor.submit(lambda: prepare_image(read_image(value), self.max_size))
+            self.futures[key] = future
+            if len(self.futures) > PREPROCESSED_IMAGE_CACHE_ENTRIES:
+                self.futures.popitem(last=False)
+        else:
+            self.futures.move_to_end(key)
+        return future
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ImageEncodingCache:
+    """LRU cache of projector encodings, keyed by image content hash and bounded in bytes."""
+
+    def __init__(self, max_bytes=DEFAULT_IMAGE_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            embeddings = self.entries.get(key)
+            if embeddings is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return embeddings
+
+    def put(self, key, embeddings):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = embeddings
+            self.size += embeddings.nbytes
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+
+class _CachingMtmd:
+    """Stand-in for the `mtmd_cpp` module of a chat handler that reuses cached image encodings.
+
+    Image chunks are encoded by the projector only on a cache miss, then decoded into the
+    language model from the cached embeddings. Everything else goes to the real module.
+    """
+
+    def __init__(self, mtmd_cpp, llama_cpp, cache):
+        self._mtmd_cpp = mtmd_cpp
+        self._llama_cpp = llama_cpp
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self._mtmd_cpp, name)
+
+    def mtmd_helper_eval_chunk_single(self, ctx, lctx, chunk, n_past, seq_id, n_batch, logits_last, new_n_past):
+        mtmd = self._mtmd_cpp
+        key = mtmd.mtmd_input_chunk_get_id(chunk)
+        if mtmd.mtmd_input_chunk_get_type(chunk) != mtmd.MTMD_INPUT_CHUNK_TYPE_IMAGE or not key:
+            return mtmd.mtmd_helper_eval_chunk_single(ctx, lctx, chunk, n_past, seq_id, n_batch, logits_last, new_n_past)
+
+        embeddings = self.cache.get(key)
+        if embeddings is None:
+            result = mtmd.mtmd_encode_chunk(ctx, chunk)
+            if result != 0:
+                return result
+            n_embd = self._llama_cpp.llama_model_n_embd_inp(self._llama_cpp.llama_get_model(lctx))
+            size = mtmd.mtmd_input_chunk_get_n_tokens(chunk) * n_embd
+            embeddings = np.ctypeslib.as_array(mtmd.mtmd_get_output_embd(ctx), shape=(size,)).copy()
+            self.cache.put(key, embeddings)
+        return mtmd.mtmd_helper_decode_image_chunk(
+            ctx, lctx, chunk, embeddings.ctypes.data_as(ctypes.POINTER(ctypes.c_float)),
+            n_past, seq_id, n_batch, new_n_past,
+        )
+
+
+# llama-cpp-python internals the encoding cache hooks into, missing from some versions.
+MTMD_CACHE_HOOKS = (
+    "mtmd_bitmap_set_id", "mtmd_input_chunk_get_id", "mtmd_input_chunk_get_type", "mtmd_input_chunk_get_n_tokens",
+    "mtmd_encode_chunk", "mtmd_get_output_embd", "mtmd_helper_eval_chunk_single", "mtmd_helper_decode_image_chunk",
+    "MTMD_INPUT_CHUNK_TYPE_IMAGE",
+)
+LLAMA_CACHE_HOOKS = ("llama_get_model", "llama_model_n_embd_inp")
+
+
+def missing_cache_hooks(handler_class, mtmd_cpp, llama_cpp):
+    """Return the internals the encoding cache needs that this llama-cpp-python lacks."""
+    missing = [] if hasattr(handler_class, "_create_bitmap_from_bytes") else [f"{handler_class.__name__}._create_bitmap_from_bytes"]
+    if mtmd_cpp is None:
+        missing.append("llama_cpp.mtmd_cpp")
+    else:
+        missing += [f"mtmd_cpp.{name}" for name in MTMD_CACHE_HOOKS if not hasattr(mtmd_cpp, name)]
+    missing += [f"llama_cpp.{name}" for name in LLAMA_CACHE_HOOKS if not hasattr(llama_cpp, name)]
+    return missing
+
+
+def create_vision_handler(handler_name, clip_model_path, cache, verbose=False, on_warning=None):
+    """Create a llama.cpp multimodal chat handler whose image encodings go through `cache`.
+
+    The cache hooks into private parts of llama-cpp-python. When this version lacks them, the
+    plain handler is returned and images are encoded on every row.
+    """
+    import llama_cpp.llama_cpp as llama_cpp
+    from llama_cpp import llama_chat_format
+
+    handler_class = getattr(llama_chat_format, handler_name)
+    try:
+        import llama_cpp.mtmd_cpp as mtmd_cpp
+    except ImportError:
+        mtmd_cpp = None
+
+    missing = missing_cache_hooks(handler_class, mtmd_cpp, llama_cpp)
+    if missing:
+        handler = handler_class(clip_model_path=clip_model_path, verbose=verbose)
+    else:
+        class CachedVisionChatHandler(handler_class):
+            def _create_bitmap_from_bytes(self, image_bytes):
+                bitmap = super()._create_bitmap_from_bytes(image_bytes)
+                # The bitmap id becomes the id of its image chunk, and the cache key of its encoding
+                self._mtmd_cpp.mtmd_bitmap_set_id(bitmap, content_hash(image_bytes).encode("ascii"))
+                return bitmap
+
+        handler = CachedVisionChatHandler(clip_model_path=clip_model_path, verbose=verbose)
+        if hasattr(handler, "_mtmd_cpp"):
+            handler._mtmd_cpp = _CachingMtmd(handler._mtmd_cpp, llama_cpp, cache)
+        else:
+            # The handler does not go through the module the cache wraps, so it runs as the plain handler
+            handler.__class__ = handler_class
+            missing = [f"{handler_class.__name__}._mtmd_cpp"]
+    if missing and on_warning:
+        on_warning(f"Image encodings are not cached, this llama-cpp-python lacks {', '.join(missing)}")
+    return handler
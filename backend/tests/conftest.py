@@ -0,0 +1,56 @@
+import struct
+
+import pytest
+
+# GGUF metadata value types used by the synthetic files
+UINT32, FLOAT32, STRING, ARRAY, UINT64 = 4, 6, 8, 9, 10
+
+
+def _string(value):
+    data = value.encode("utf-8")
+    return struct.pack("<Q", len(data)) + data
+
+
+def _value(value):
+    if isinstance(value, str):
+        return struct.pack("<I", STRING) + _string(value)
+    if isinstance(value, float):
+        return struct.pack("<If", FLOAT32, value)
+    if isinstance(value, list):
+        return struct.pack("<IIQ", ARRAY, STRING, len(value)) + b"".join(_string(item) for item in value)
+    return struct.pack("<II", UINT32, value)
+
+
+def write_gguf(path, metadata, tensors):
+    """Write a GGUF file holding only a header: metadata and a tensor table of (name, shape, ggml_type)."""
+    header = b"GGUF" + struct.pack("<IQQ", 3, len(tensors), len(metadata))
+    for key, value in metadata.items():
+        header += _string(key) + _value(value)
+    for name, shape, ggml_type in tensors:
+        header += _string(name) + struct.pack("<I", len(shape)) + struct.pack(f"<{len(shape)}Q", *shape)
+        header += struct.pack("<IQ", ggml_type, 0)
+    with open(path, "wb") as f:
+        f.write(header)
+    return str(path)
+
+
+@pytest.fixture
+def synthetic_gguf(tmp_path):
+    """A small llama-like GGUF header: 4 layers, Q4_K_M, 4096 trained context, without tensor data."""
+    metadata = {
+        "general.architecture": "llama",
+        "general.name": "tiny-llama",
+        "general.file_type": 15,
+        "llama.context_length": 4096,
+        "llama.embedding_length": 2048,
+        "llama.block_count": 4,
+        "llama.attention.head_count": 16,
+        "llama.attention.head_count_kv": 4,
+        "tokenizer.ggml.tokens": [f"tok{i}" for i in range(100)],
+    }
+    tensors = [("token_embd.weight", [2048, 32000], 12), ("output.weight", [2048, 32000], 14)]
+    for layer in range(4):
+        tensors.append((f"blk.{layer}.attn_q.weight", [2048, 2048], 12))
+        tensors.append((f"blk.{layer}.ffn_up.weight", [2048, 8192], 12))
+        tensors.append((f"blk.{layer}.attn_norm.weight", [2048], 0))
+    return write_gguf(tmp_path / "tiny-llama-Q4_K_M.gguf", metadata, tensors)
@@ -0,0 +1,60 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.ayx_plugins.autotune import (
+    autotune, load_tuning, model_fingerprint, save_tuning, thread_candidates,
+)
+
+
+class FakeLlama:
+    """Simulated model whose evaluation speed only depends on the thread and batch settings."""
+
+    clock = [0.0]
+
+    def __init__(self, n_threads=1, n_batch=512, n_ubatch=512, **kwargs):
+        self.n_threads = n_threads
+        self.n_batch = n_batch
+
+    def tokenize(self, text, add_bos=True):
+        return [42]
+
+    def token_bos(self):
+        return 1
+
+    def eval(self, tokens):
+        # 8 threads and a 1024 batch are the sweet spot of this fake host
+        FakeLlama.clock[0] += len(tokens) * (1 + abs(self.n_threads - 8)) * (1 + abs(self.n_batch - 1024) / 1024)
+
+    def close(self):
+        pass
+
+
+def test_thread_candidates():
+    assert thread_candidates(8) == [1, 2, 4, 8]
+    assert thread_candidates(128) == [16, 32, 64, 128]
+    assert thread_candidates(1) == [1]
+
+
+def test_autotune_picks_fastest_settings(monkeypatch):
+    monkeypatch.setattr("time.perf_counter", lambda: FakeLlama.clock[0])
+    settings, measurements = autotune(FakeLlama, {"n_ctx": 1024}, max_threads=16, prompt_tokens=256, decode_tokens=8)
+    assert settings["n_threads"] == 8
+    assert settings["n_batch"] == 1024
+    assert len(measurements) > 1
+
+
+def test_tuning_roundtrip(tmp_path):
+    path = str(tmp_path / "tuning.json")
+    assert load_tuning("host|abc", path) is None
+    save_tuning("host|abc", {"n_threads": 8}, [], path)
+    save_tuning("host|def", {"n_threads": 4}, [], path)
+    assert load_tuning("host|abc", path) == {"n_threads": 8}
+
+
+def test_model_fingerprint(tmp_path):
+    model = tmp_path / "model.gguf"
+    model.write_bytes(b"GGUF" + b"\0" * 100)
+    first = model_fingerprint(str(model))
+    model.write_bytes(b"GGUF" + b"\1" * 100)
+    assert model_fingerprint(str(model)) != first
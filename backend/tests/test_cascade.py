@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import math
+
+from backend.ayx_plugins.cascade import (
+    JSON_INVALID, LOW_CONFIDENCE, REFUSAL, REGEX_MISS, CascadeStats, CascadeValidator, parse_cascade_models,
+    response_confidence,
+)
+
+
+def test_parse_cascade_models():
+    assert parse_cascade_models("local, gpt-4o-mini\ngpt-4o") == ["local", "gpt-4o-mini", "gpt-4o"]
+
+
+def test_validator_reasons():
+    assert CascadeValidator(require_json=True).check("not json") == JSON_INVALID
+    assert CascadeValidator().check("I'm sorry, I can't help with that.") == REFUSAL
+    assert CascadeValidator(pattern=r"^(yes|no)$").check("maybe") == REGEX_MISS
+    assert CascadeValidator(pattern=r"^(yes|no)$").check("yes") is None
+
+
+def test_validator_confidence():
+    validator = CascadeValidator(min_confidence=0.5)
+    confident = {"content": [{"logprob": math.log(0.9)}, {"logprob": math.log(0.8)}]}
+    unsure = {"content": [{"logprob": math.log(0.2)}]}
+    assert response_confidence(confident) > 0.8
+    assert validator.check("yes", confident) is None
+    assert validator.check("yes", unsure) == LOW_CONFIDENCE
+    # Without log probabilities the response is accepted
+    assert validator.check("yes", None) is None
+
+
+def test_cascade_stats_savings():
+    stats = CascadeStats(["small", "large"])
+    stats.record_attempt("small", 0.001)
+    stats.record_attempt("small", 0.001, REFUSAL)
+    stats.record_attempt("large", 0.01)
+    stats.baseline_cost = 0.02
+    assert stats.answered == {"small": 1, "large": 1}
+    assert abs(stats.savings() - 0.008) < 1e-12
+    assert stats.summary()[0].startswith("Cascade tier small: answered 1 of 2 rows (50.0%)")
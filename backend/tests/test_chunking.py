@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.ayx_plugins.chunking import chunk_spans, chunk_text, map_prompt, pack_responses, reduce_prompt
+
+
+def encode(text):
+    return text.split()
+
+
+def decode(tokens):
+    return " ".join(tokens)
+
+
+def test_chunk_spans_overlap():
+    assert chunk_spans(10, 4, 1) == [(0, 4), (3, 7), (6, 10)]
+
+
+def test_chunk_text_keeps_short_prompts():
+    assert chunk_text("a b c", encode, decode, 3) == ["a b c"]
+
+
+def test_chunk_text_splits_long_prompts():
+    assert chunk_text("a b c d e", encode, decode, 3, 1) == ["a b c", "c d e"]
+
+
+def test_pack_responses_respects_budget():
+    responses = ["a b", "c d", "e f", "g"]
+    # Each response also counts the separator token
+    assert pack_responses(responses, lambda text: len(encode(text)), 6) == [["a b", "c d"], ["e f", "g"]]
+
+
+def test_reduce_prompt_placeholder():
+    assert reduce_prompt("Combine:\n{responses}", ["x", "y"]) == "Combine:\nx\n\n---\n\ny"
+    assert reduce_prompt("Combine", ["x"]) == "Combine\n\nx"
+
+
+def test_task_goes_with_chunks_and_reduce():
+    assert map_prompt("Summarize.", "part") == "Summarize.\n\npart"
+    assert map_prompt(None, "part") == "part"
+    assert reduce_prompt("Combine:\n{responses}", ["x"], "Summarize.") == "Task: Summarize.\n\nCombine:\nx"
+    assert reduce_prompt("Answer '{task}' from:\n{responses}", ["x"], "Summarize.") == "Answer 'Summarize.' from:\nx"
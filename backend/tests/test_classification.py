@@ -0,0 +1,54 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import math
+
+import numpy as np
+
+from backend.ayx_plugins.classification import (
+    label_token_ids, parse_labels, score_logits, score_text, score_top_logprobs, shared_first_tokens, with_instruction,
+)
+
+
+def test_parse_labels():
+    assert parse_labels("Positive, Negative\nNeutral,Positive,") == ["Positive", "Negative", "Neutral"]
+    assert parse_labels(None) == []
+
+
+def test_instruction_joins_the_system_prompt():
+    messages = with_instruction([{"role": "system", "content": "Rate reviews."}, {"role": "user", "content": "great"}], ["A", "B"])
+    assert messages[0]["content"].startswith("Rate reviews.\n\nClassify the input.")
+    assert messages[0]["content"].endswith("A, B")
+    assert with_instruction([{"role": "user", "content": "great"}], ["A"])[0]["role"] == "system"
+
+
+def test_label_token_ids_and_shared_first_tokens():
+    vocabulary = {"yes": [1], " yes": [2], "yesterday": [1, 3], " yesterday": [2, 3], "no": [4], " no": [4]}
+    label_ids = label_token_ids(["yes", "yesterday", "no"], vocabulary.get)
+    assert label_ids == [[1, 2], [1, 2], [4]]
+    assert shared_first_tokens(label_ids) == [0, 1]
+
+
+def test_score_logits_normalizes_over_labels():
+    logits = np.zeros(10, dtype=np.float32)
+    logits[[1, 2, 4]] = [2.0, 2.0, math.log(2.0) + 2.0]
+    probabilities = score_logits(logits, [[1, 2], [4]])
+    assert np.allclose(probabilities, [0.5, 0.5])
+
+
+def test_score_top_logprobs_matches_token_prefixes():
+    top_logprobs = [
+        {"token": "Pos", "logprob": math.log(0.6)},
+        {"token": " pos", "logprob": math.log(0.2)},
+        {"token": "Neg", "logprob": math.log(0.1)},
+        {"token": "\n", "logprob": math.log(0.1)},
+    ]
+    probabilities = score_top_logprobs(top_logprobs, ["Positive", "Negative", "Neutral"])
+    assert np.allclose(probabilities, [0.8 / 0.9, 0.1 / 0.9, 0.0])
+    assert score_top_logprobs([{"token": "x", "logprob": -1.0}], ["Positive"]) is None
+
+
+def test_score_text():
+    assert score_text(" Negative.", ["Positive", "Negative"]).tolist() == [0.0, 1.0]
+    assert score_text("maybe", ["Positive", "Negative"]) is None
@@ -0,0 +1,78 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import asyncio
+
+from backend.ayx_plugins.concurrency import INCREASE, LATENCY_SPIKE, RATE_LIMITED, AIMDController
+from backend.ayx_plugins.deadlines import STATUS_OK, RunDeadline, run_with_deadline
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_limit_grows_by_one_per_round_of_successes():
+    controller = AIMDController(initial=4, clock=FakeClock())
+    for _ in range(4):
+        controller.on_success(0.0, 1.0)
+    assert controller.limit == 5
+    for _ in range(5):
+        controller.on_success(0.0, 1.0)
+    assert controller.limit == 6
+    assert [change.reason for change in controller.trace] == ["start", INCREASE, INCREASE]
+
+
+def test_limit_is_bounded():
+    controller = AIMDController(initial=2, min_limit=2, max_limit=3, clock=FakeClock())
+    for _ in range(20):
+        controller.on_success(0.0, 1.0)
+    assert controller.limit == 3
+    controller.on_overload(0.0, RATE_LIMITED)
+    assert controller.limit == 2
+
+
+def test_one_overload_episode_cuts_once():
+    clock = FakeClock()
+    controller = AIMDController(initial=16, clock=clock)
+    clock.now = 5.0
+    controller.on_overload(1.0, RATE_LIMITED)
+    assert controller.limit == 8
+    # Requests sent before the cut were sent at the old level
+    controller.on_overload(2.0, RATE_LIMITED)
+    assert controller.limit == 8
+    controller.on_overload(6.0, RATE_LIMITED)
+    assert controller.limit == 4
+    assert controller.trace[-1].reason == RATE_LIMITED
+    assert controller.trace[-1].seconds == 5.0
+
+
+def test_latency_spike_cuts_the_limit():
+    controller = AIMDController(initial=8, clock=FakeClock())
+    for _ in range(10):
+        controller.on_success(0.0, 1.0)
+    limit = controller.limit
+    controller.on_success(0.0, 5.0)
+    assert controller.limit == limit // 2
+    assert controller.trace[-1].reason == LATENCY_SPIKE
+
+
+def test_dispatch_follows_the_controller_limit():
+    controller = AIMDController(initial=2, max_limit=3)
+    running, peak = [0], [0]
+
+    async def process(row):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        controller.on_success(controller.clock(), 0.01)
+        return row
+
+    outcomes = asyncio.run(run_with_deadline(list(range(20)), process, RunDeadline(), controller=controller))
+    assert all(status == STATUS_OK for status, _ in outcomes)
+    assert peak[0] == 3
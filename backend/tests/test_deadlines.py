@@ -0,0 +1,91 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import asyncio
+
+from backend.ayx_plugins.deadlines import STATUS_ERROR, STATUS_OK, STATUS_SKIPPED, STATUS_TIMEOUT, RunDeadline, run_with_deadline
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_row_timeout_is_capped_by_the_run_deadline():
+    clock = FakeClock()
+    deadline = RunDeadline(run_seconds=10, row_seconds=4, clock=clock)
+    assert deadline.row_timeout() == 4
+    clock.now += 8
+    assert deadline.row_timeout() == 2
+    assert not deadline.expired()
+    clock.now += 5
+    assert deadline.remaining() == 0
+    assert deadline.expired()
+
+
+def test_no_deadline():
+    deadline = RunDeadline()
+    assert deadline.remaining() is None
+    assert deadline.row_timeout() is None
+    assert not deadline.expired()
+    assert not deadline.under_pressure(1000, 5.0, 1)
+
+
+def test_under_pressure_when_the_queue_cannot_finish_in_time():
+    clock = FakeClock()
+    deadline = RunDeadline(run_seconds=10, clock=clock)
+    assert not deadline.under_pressure(8, 2.0, 4)
+    assert deadline.under_pressure(40, 2.0, 4)
+    assert not deadline.under_pressure(40, None, 4)
+
+
+def test_every_row_gets_a_status():
+    async def process(row):
+        if row == "fail":
+            raise ValueError("bad row")
+        await asyncio.sleep(0.5 if row == "slow" else 0.01)
+        return row.upper()
+
+    outcomes = asyncio.run(run_with_deadline(["a", "slow", "fail", "b"], process, RunDeadline(row_seconds=0.1), concurrency=2))
+    assert outcomes[0] == (STATUS_OK, "A")
+    assert outcomes[1] == (STATUS_TIMEOUT, None)
+    assert outcomes[2][0] == STATUS_ERROR and isinstance(outcomes[2][1], ValueError)
+    assert outcomes[3] == (STATUS_OK, "B")
+
+
+def test_run_deadline_cancels_running_rows_and_skips_the_rest():
+    cancelled = []
+
+    async def process(row):
+        try:
+            await asyncio.sleep(0.05 if row < 2 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(row)
+            raise
+        return row
+
+    outcomes = asyncio.run(run_with_deadline(list(range(6)), process, RunDeadline(run_seconds=0.3), concurrency=2))
+    assert outcomes[:2] == [(STATUS_OK, 0), (STATUS_OK, 1)]
+    assert outcomes[2:4] == [(STATUS_TIMEOUT, None)] * 2
+    assert outcomes[4:] == [(STATUS_SKIPPED, None)] * 2
+    assert sorted(cancelled) == [2, 3]
+
+
+def test_shortest_rows_go_first_under_pressure():
+    order = []
+
+    async def process(row):
+        order.append(row)
+        await asyncio.sleep(0.05)
+        return row
+
+    # Ten rows of 50ms on one request cannot finish in 0.3s, after the first row the shortest go first
+    lengths = [5, 9, 8, 1, 7, 2, 6, 3, 4, 5]
+    outcomes = asyncio.run(run_with_deadline(list(range(10)), process, RunDeadline(run_seconds=0.3), concurrency=1, lengths=lengths))
+    assert order[:3] == [0, 3, 5]
+    assert sum(status == STATUS_OK for status, _ in outcomes) >= 3
+    assert outcomes[1] == (STATUS_SKIPPED, None)
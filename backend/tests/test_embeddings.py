@@ -0,0 +1,41 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import pyarrow as pa
+
+from backend.ayx_plugins.embeddings import embed_texts
+
+
+def test_embed_texts_deduplicates_and_keeps_nulls():
+    batches = []
+
+    def embed_batch(texts):
+        batches.append(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    vectors = embed_texts(["a", "bb", None, "a"], embed_batch, batch_size=1)
+
+    assert batches == [["a"], ["bb"]]
+    assert vectors.type == pa.list_(pa.float32(), 2)
+    assert vectors.to_pylist() == [[1.0, 1.0], [2.0, 1.0], None, [1.0, 1.0]]
+
+
+def test_embed_texts_failed_batch_is_null():
+    def embed_batch(texts):
+        if "bad" in texts:
+            raise ValueError("bad input")
+        return [[1.0, 2.0, 3.0] for _ in texts]
+
+    errors = []
+    vectors = embed_texts(["bad", "ok"], embed_batch, batch_size=1, on_batch_error=lambda e, texts: errors.append(texts))
+
+    assert errors == [["bad"]]
+    assert vectors.to_pylist() == [None, [1.0, 2.0, 3.0]]
+
+
+def test_embed_texts_without_successful_batch_uses_dimensions():
+    vectors = embed_texts([None, None], lambda texts: [], dimensions=4)
+
+    assert vectors.type == pa.list_(pa.float32(), 4)
+    assert vectors.null_count == 2
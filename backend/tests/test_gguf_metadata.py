@@ -0,0 +1,58 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import os
+
+import pytest
+
+from backend.ayx_plugins.gguf_metadata import (
+    GGUFFormatError, GGUFIndex, kv_cache_bytes, read_gguf_header, summarize_gguf, tensor_nbytes,
+)
+
+
+def test_tensor_nbytes():
+    assert tensor_nbytes([2048], 0) == 2048 * 4
+    # Q4_K packs 256 weights in 144 bytes
+    assert tensor_nbytes([2048, 2048], 12) == 2048 * 2048 // 256 * 144
+
+
+def test_read_header(synthetic_gguf):
+    header = read_gguf_header(synthetic_gguf)
+    assert header["version"] == 3
+    assert header["metadata"]["general.architecture"] == "llama"
+    # Long tokenizer arrays are skipped, not stored
+    assert header["metadata"]["tokenizer.ggml.tokens"] is None
+    assert len(header["tensors"]) == 14
+
+
+def test_summary(synthetic_gguf):
+    summary = summarize_gguf(read_gguf_header(synthetic_gguf))
+    assert summary["quantization"] == "Q4_K_M"
+    assert summary["context_length"] == 4096
+    assert summary["block_count"] == 4
+    layer = tensor_nbytes([2048, 2048], 12) + tensor_nbytes([2048, 8192], 12) + 2048 * 4
+    assert summary["layer_bytes"] == [layer] * 4
+    assert summary["tensor_bytes"] == 4 * layer + summary["non_layer_bytes"]
+    # 4 KV heads of 128 dims, keys and values in f16, 4 layers
+    assert kv_cache_bytes(summary, 1024) == 4 * 256 * 2 * 1024 * 4
+
+
+def test_not_a_gguf(tmp_path):
+    path = tmp_path / "model.gguf"
+    path.write_bytes(b"NOPE" + b"\0" * 32)
+    with pytest.raises(GGUFFormatError):
+        read_gguf_header(str(path))
+
+
+def test_index_is_invalidated_by_mtime(synthetic_gguf, tmp_path):
+    index = GGUFIndex(str(tmp_path / "index.json"))
+    assert index.get(synthetic_gguf)["block_count"] == 4
+
+    reloaded = GGUFIndex(str(tmp_path / "index.json"))
+    assert os.path.abspath(synthetic_gguf) in reloaded.entries
+    reloaded.entries[os.path.abspath(synthetic_gguf)]["summary"]["block_count"] = 99
+    assert reloaded.get(synthetic_gguf)["block_count"] == 99
+
+    os.utime(synthetic_gguf, (0, 12345))
+    assert reloaded.get(synthetic_gguf)["block_count"] == 4
@@ -0,0 +1,39 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.ayx_plugins.gguf_metadata import kv_cache_bytes, read_gguf_header, summarize_gguf
+from backend.ayx_plugins.gpu_placement import MIB, parse_nvidia_smi, plan_gpu_layers
+
+# Recorded output of `nvidia-smi --query-gpu=index,name,memory.total,memory.free --format=csv,noheader,nounits`
+NVIDIA_SMI_OUTPUT = """0, NVIDIA RTX A4000, 16376, 15210
+1, NVIDIA RTX A4000, 16376, 812
+"""
+
+
+def test_parse_nvidia_smi():
+    gpus = parse_nvidia_smi(NVIDIA_SMI_OUTPUT)
+    assert gpus[0] == {"index": 0, "name": "NVIDIA RTX A4000", "total_mib": 16376, "free_mib": 15210}
+    assert gpus[1]["free_mib"] == 812
+
+
+def test_everything_fits(synthetic_gguf):
+    summary = summarize_gguf(read_gguf_header(synthetic_gguf))
+    layers, used = plan_gpu_layers(summary, 4096, free_mib=15210, budget_percent=90)
+    assert layers == -1
+    assert used == summary["tensor_bytes"] + kv_cache_bytes(summary, 4096)
+
+
+def test_partial_offload_within_budget(synthetic_gguf):
+    summary = summarize_gguf(read_gguf_header(synthetic_gguf))
+    per_layer = summary["layer_bytes"][0] + kv_cache_bytes(summary, 4096) / 4
+    # Room for the reserve and two and a half layers
+    free_mib = (512 * MIB + 2.5 * per_layer) / MIB
+    layers, used = plan_gpu_layers(summary, 4096, free_mib=free_mib, budget_percent=100)
+    assert layers == 2
+    assert used == 2 * per_layer
+
+
+def test_no_room(synthetic_gguf):
+    summary = summarize_gguf(read_gguf_header(synthetic_gguf))
+    assert plan_gpu_layers(summary, 4096, free_mib=812, budget_percent=50) == (0, 0)
@@ -0,0 +1,51 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import asyncio
+
+from backend.ayx_plugins.hedging import HedgePolicy, LatencyTracker, hedged_request
+
+
+def make_request(result, seconds):
+    async def request():
+        await asyncio.sleep(seconds)
+        return result
+    return request
+
+
+def warm_policy(latency=0.01, max_hedge_percent=50.0):
+    policy = HedgePolicy(percentile=95.0, max_hedge_percent=max_hedge_percent, min_samples=5)
+    for _ in range(5):
+        policy.requests += 1
+        policy.latencies.record(latency)
+    return policy
+
+
+def test_latency_percentile():
+    tracker = LatencyTracker()
+    assert tracker.percentile(95) is None
+    for seconds in range(1, 101):
+        tracker.record(seconds)
+    assert tracker.percentile(95) == 95
+    assert tracker.percentile(50) == 50
+
+
+def test_no_hedge_before_enough_samples():
+    policy = HedgePolicy(min_samples=5)
+    result = asyncio.run(hedged_request(make_request("primary", 0.05), make_request("hedge", 0), policy))
+    assert result == ("primary", False, False)
+
+
+def test_hedge_wins_over_straggler():
+    policy = warm_policy()
+    result = asyncio.run(hedged_request(make_request("primary", 1.0), make_request("hedge", 0), policy))
+    assert result == ("hedge", True, True)
+    assert policy.hedges == 1
+
+
+def test_hedge_cap():
+    policy = warm_policy(max_hedge_percent=0.0)
+    result = asyncio.run(hedged_request(make_request("primary", 0.05), make_request("hedge", 0), policy))
+    assert result == ("primary", False, False)
+    assert policy.hedges == 0
@@ -0,0 +1,63 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import json
+import threading
+import types
+
+import pyarrow as pa
+
+from backend.ayx_plugins.inference_daemon import InferenceDaemon, decode_message, encode_message
+
+
+class FakeLlama:
+    def __init__(self):
+        self.calls = 0
+
+    def create_chat_completion(self, messages, **kwargs):
+        self.calls += 1
+        return {
+            "choices": [{"message": {"content": messages[-1]["content"].upper()}}],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 1},
+        }
+
+
+def test_message_round_trip():
+    header, table = decode_message(encode_message({"op": "chat"}, pa.table({"messages": ["[]"]})))
+    assert header == {"op": "chat"}
+    assert table.column("messages").to_pylist() == ["[]"]
+
+
+def test_daemon_chat_reuses_model_and_cache():
+    llama_kwargs = {"model_path": "model.gguf"}
+    daemon = InferenceDaemon("unused", b"key")
+    llama = FakeLlama()
+    daemon.models[json.dumps(llama_kwargs, sort_keys=True)] = (llama, threading.Lock())
+
+    messages = pa.table({"messages": [json.dumps([{"role": "user", "content": "hi"}])] * 2})
+    header = {"op": "chat", "llama_kwargs": llama_kwargs, "params": {"max_tokens": 4}, "cache": True}
+    for _ in range(2):
+        _, result = daemon.handle_request(header, messages)
+
+    assert result.column("content").to_pylist() == ["HI", "HI"]
+    assert result.column("prompt_tokens").type == pa.int32()
+    assert llama.calls == 1
+    assert daemon.handle_request({"op": "load", "llama_kwargs": llama_kwargs}, None)[0]["already_loaded"]
+
+
+def test_least_recently_used_model_is_unloaded(monkeypatch):
+    loaded = []
+
+    def load(**llama_kwargs):
+        loaded.append(llama_kwargs["model_path"])
+        return FakeLlama()
+
+    monkeypatch.setitem(sys.modules, "llama_cpp", types.SimpleNamespace(Llama=load))
+    daemon = InferenceDaemon("unused", b"key", max_models=2)
+    for model_path in ("a.gguf", "b.gguf", "a.gguf", "c.gguf", "a.gguf", "b.gguf"):
+        daemon.model({"model_path": model_path})
+
+    # "b" was the least recently used when "c" was loaded, then "c" when "b" came back
+    assert loaded == ["a.gguf", "b.gguf", "c.gguf", "b.gguf"]
+    assert [json.loads(key)["model_path"] for key in daemon.models] == ["a.gguf", "b.gguf"]
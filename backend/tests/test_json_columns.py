@@ -0,0 +1,90 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import pyarrow as pa
+import pytest
+
+from backend.ayx_plugins.json_columns import STRUCT_COLUMNS, JsonResponseParser, arrow_schema, field_columns, json_lines, read_valid_lines
+
+
+def test_json_schema_to_arrow_schema():
+    schema = arrow_schema({
+        "type": "object",
+        "properties": {
+            "label": {"enum": ["positive", "negative"]},
+            "score": {"type": ["number", "null"]},
+            "count": {"type": "integer"},
+            "tags": {"type": "array", "items": {"type": "string"}},
+            "meta": {"type": "object", "properties": {"valid": {"type": "boolean"}}},
+            "anything": {},
+        },
+    })
+    assert schema == pa.schema([
+        ("label", pa.string()),
+        ("score", pa.float64()),
+        ("count", pa.int64()),
+        ("tags", pa.list_(pa.string())),
+        ("meta", pa.struct([("valid", pa.bool_())])),
+    ])
+    with pytest.raises(ValueError):
+        arrow_schema({"type": "array", "items": {"type": "string"}})
+
+
+def test_lines_strip_fences_and_line_breaks():
+    lines = json_lines(['```json\n{"a": 1,\n "b": "x\\ny"}\n```', None, "  ", '{"a": 2}'])
+    assert lines.to_pylist() == ['{"a": 1,  "b": "x\\ny"}', "{}", "{}", '{"a": 2}']
+
+
+def test_invalid_lines_are_isolated():
+    lines = json_lines(['{"a": 1}', "not json", '{"a": 2}', '{"a": 3}', "[1, 2]", '{"a": 4}'])
+    tables, errors = read_valid_lines(lines)
+    assert sorted(errors) == [1, 4]
+    assert [row["a"] for _, table in tables for row in table.to_pylist()] == [1, 2, 3, 4]
+
+
+def test_schema_is_inferred_once_and_kept():
+    parser = JsonResponseParser()
+    fields, errors = parser.parse(['{"a": 1, "b": null}', '{"a": 2.5, "c": {"d": true}}', "oops"])
+    assert parser.schema == pa.schema([("a", pa.float64()), ("b", pa.string()), ("c", pa.struct([("d", pa.bool_())]))])
+    assert fields.to_pylist()[1] == {"a": 2.5, "b": None, "c": {"d": True}}
+    assert fields.to_pylist()[2] == {"a": None, "b": None, "c": None}
+    assert errors[:2] == [None, None] and errors[2]
+
+    # Later batches get the same columns: new fields are ignored, conflicting types are errors
+    fields, errors = parser.parse(['{"a": 3, "e": 1}', '{"a": "three"}'])
+    assert fields.schema == parser.schema
+    assert fields.column("a").to_pylist() == [3.0, None]
+    assert errors[0] is None and errors[1]
+
+
+def test_sample_rows_limit_inference():
+    parser = JsonResponseParser(sample_rows=1)
+    fields, _ = parser.parse(['{"a": 1}', '{"a": 2, "b": "x"}'])
+    assert fields.column_names == ["a"]
+
+
+def test_given_schema_converts_values():
+    parser = JsonResponseParser(pa.schema([("score", pa.float64()), ("label", pa.string())]))
+    fields, errors = parser.parse(['{"label": "yes", "score": 1}', '{"score": 0.5}'])
+    assert fields.to_pylist() == [{"score": 1.0, "label": "yes"}, {"score": 0.5, "label": None}]
+    assert errors == [None, None]
+
+
+def test_flattened_and_struct_columns():
+    parser = JsonResponseParser()
+    fields, _ = parser.parse(['{"a": 1, "b": {"c": {"d": "x"}, "e": [1, 2]}}'])
+    columns = field_columns(fields, prefix="out.")
+    assert list(columns) == ["out.a", "out.b.c.d", "out.b.e"]
+    assert columns["out.b.e"].to_pylist() == [[1, 2]]
+    columns = field_columns(fields, STRUCT_COLUMNS, struct_name="LLM Response JSON")
+    assert list(columns) == ["LLM Response JSON"]
+    assert columns["LLM Response JSON"].to_pylist() == [{"a": 1, "b": {"c": {"d": "x"}, "e": [1, 2]}}]
+
+
+def test_responses_with_several_documents_are_errors():
+    parser = JsonResponseParser()
+    fields, errors = parser.parse(['{"a": 1}', '{"a": 2}\n{"a": 3}', '{"a": 4}', '{"a": 5} {"a": 6}', '{"a": 7}'])
+    assert fields.num_rows == 5
+    assert fields.column("a").to_pylist() == [1, None, 4, None, 7]
+    assert [error is not None for error in errors] == [False, True, False, True, False]
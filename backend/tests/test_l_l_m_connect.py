@@ -6,6 +6,7 @@ from ayx_python_sdk.core import Anchor
 from ayx_python_sdk.core.testing import BatchTuple, SdkToolTestService
 
 from backend.ayx_plugins.l_l_m_connect import LLMConnect
+from backend.ayx_plugins.local_worker_pool import LocalWorkerError, run_task
 
 import pyarrow as pa
 from pyarrow import RecordBatch
@@ -109,6 +110,34 @@ def l_l_m_connect_plugin_service():
     )
 
 
+def make_remote_plugin_service(**settings):
+    """Build a testing service for a simulated remote platform, overriding the given tool settings."""
+    config = {
+        "platform": "OpenAI",
+        "model": "gpt-4o-mini",
+        "promptField": "Prompt",
+        "maxToken": "256",
+        "useCaching": "0",
+        "simulateResponse": "1",
+        "simulateResponseText": "The response has been simulated.",
+        "onError": "warning",
+        "responseColumnName": "LLM Response",
+        "inferenceType": "Remote",
+    }
+    config.update(settings)
+    config_xml = "".join(f"<{key}>{value}</{key}>" for key, value in config.items())
+    return SdkToolTestService(
+        plugin_class=LLMConnect,
+        config_mock=f"<Configuration>{config_xml}<Secrets /></Configuration>",
+        input_anchor_config={
+            "Input": TEST_SCHEMA,
+        },
+        output_anchor_config={
+           "Output": pa.schema([]),
+        }
+    )
+
+
 def test_init(l_l_m_connect_plugin_service):
     """
     This function is where you should test your plugin's constructor (ie, LLMConnect.__init__())
@@ -148,6 +177,220 @@ def test_on_record_batch(l_l_m_connect_plugin_service, anchor, record_batch_set,
 
     
 
+def test_json_schema_response_format():
+    """The configured JSON schema is sent as `json_schema` structured output to remote providers."""
+    schema = '{"type": "object", "properties": {"answer": {"type": "string"}}, "required": ["answer"]}'
+    service = make_remote_plugin_service(enforceJsonResponse="1", jsonSchema=schema)
+
+    response_format = service.plugin.remote_response_format()
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["schema"]["required"] == ["answer"]
+
+    service = make_remote_plugin_service(enforceJsonResponse="1")
+    assert service.plugin.remote_response_format() == {"type": "json_object"}
+
+
+def test_output_schema_is_the_same_for_every_batch():
+    """The response column is encoded as decided on the first batch, whatever the distinct responses of later batches."""
+    service = make_remote_plugin_service()
+    for prompts in (["one"], ["two", "three", "four"]):
+        service.run_on_record_batch(pa.RecordBatch.from_pandas(pd.DataFrame({"Prompt": prompts})), Anchor("Input", "1"))
+
+    schemas = [batch.schema for batch in service.data_streams["Output"]]
+    assert len(schemas) == 2
+    assert schemas[0].equals(schemas[1])
+
+
+def test_json_fields_do_not_overwrite_columns():
+    response = '{"answer": "yes", "cost($)": 1, "Prompt": "echo"}'
+    batch = pa.RecordBatch.from_pandas(pd.DataFrame({"Prompt": ["one"]}))
+    service = make_remote_plugin_service(simulateResponseText=response, parseJson="1")
+    with pytest.raises(RuntimeError, match=r"Prompt, cost\(\$\)"):
+        service.run_on_record_batch(batch, Anchor("Input", "1"))
+
+    service = make_remote_plugin_service(simulateResponseText=response, parseJson="1", jsonFieldPrefix="json.")
+    service.run_on_record_batch(batch, Anchor("Input", "1"))
+    output = service.data_streams["Output"][0]
+    assert output.column("Prompt").to_pylist() == ["one"]
+    assert output.column("json.Prompt").to_pylist() == ["echo"]
+    assert output.column("json.answer").to_pylist() == ["yes"]
+
+
+def test_pipeline_workers_add_to_the_run_totals(monkeypatch):
+    """Rows answered on several pipeline workers each add their cost once, while the cost log rotates under them."""
+    import litellm
+    from concurrent.futures import ThreadPoolExecutor
+    from backend.ayx_plugins import l_l_m_connect
+
+    monkeypatch.setattr(l_l_m_connect, "completion", lambda **kwargs: litellm.completion(**dict(kwargs, mock_response="ok")))
+    monkeypatch.setattr(l_l_m_connect, "completion_cost", lambda **kwargs: 0.001)
+    service = make_remote_plugin_service(simulateResponse="0", pipeline="1", pipelineWorkers="8")
+    plugin = service.plugin
+    # Every logged call rotates the log file
+    plugin.max_log_size = 1
+
+    rows = 200
+    service.run_on_record_batch(pa.RecordBatch.from_pandas(pd.DataFrame({"Prompt": [f"row {i}" for i in range(rows)]})), Anchor("Input", "1"))
+    service.run_on_incoming_connection_complete(Anchor("Input", "1"))
+    assert sum(batch.num_rows for batch in service.data_streams["Output"]) == rows
+    assert plugin.total_cost == pytest.approx(rows * 0.001)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda call: (plugin.add_cost(0.001), plugin.my_custom_logging_fn({"call": call})), range(1000)))
+    assert plugin.total_cost == pytest.approx((rows + 1000) * 0.001)
+
+
+def test_local_cascade_tier_needs_a_local_model():
+    """Without a model loaded by the tool, rows would fail on the local tier and always pay for the next one."""
+    with pytest.raises(RuntimeError):
+        make_remote_plugin_service(cascadeModels="local, gpt-4o")
+
+
+def test_cascade_rows_report_cached_tokens():
+    service = make_remote_plugin_service(model="gpt-4o", cascadeModels="gpt-4o-mini, gpt-4o")
+    service.run_on_record_batch(pa.RecordBatch.from_pandas(pd.DataFrame({"Prompt": ["one", "two"]})), Anchor("Input", "1"))
+
+    output = service.data_streams["Output"][0]
+    assert output.column("cascade_tier").to_pylist() == ["gpt-4o-mini", "gpt-4o-mini"]
+    assert output.column("cached_tokens").to_pylist() == [0, 0]
+
+
+class EchoLlama:
+    """Answers a prompt with its upper-cased text."""
+
+    def create_chat_completion(self, messages, **kwargs):
+        prompt = messages[-1]["content"]
+        return {"choices": [{"message": {"content": prompt.upper()}}], "usage": {"prompt_tokens": len(prompt), "completion_tokens": 1}}
+
+
+class InProcessWorkerPool:
+    """Runs the tasks of the local worker pool in the test process, recording the prompt or file of each task as it is sent."""
+
+    def __init__(self):
+        self.sent = []
+        self.row_seconds = []
+
+    def map(self, completion_kwargs_list):
+        outputs = []
+        self.row_seconds = []
+        for completion_kwargs in completion_kwargs_list:
+            self.sent.append(completion_kwargs["prompt_file"][0] if "prompt_file" in completion_kwargs else completion_kwargs["messages"][-1]["content"])
+            status, payload, seconds = run_task(EchoLlama(), completion_kwargs)
+            outputs.append(payload if status == "done" else LocalWorkerError(payload))
+            self.row_seconds.append(seconds)
+        return outputs
+
+
+def test_length_bucketing_sends_longest_first_and_keeps_row_order():
+    prompts = ["short", "a much longer prompt than the others", "mid length", "x"]
+    service = make_remote_plugin_service(lengthBucketing="1")
+    service.plugin.worker_pool = InProcessWorkerPool()
+    result = service.plugin.process_rows_with_worker_pool(pd.Series(prompts))
+
+    assert service.plugin.worker_pool.sent == ["a much longer prompt than the others", "mid length", "short", "x"]
+    assert result["LLM Response"].tolist() == [prompt.upper() for prompt in prompts]
+    assert result["prompt_tokens"].tolist() == [len(prompt) for prompt in prompts]
+    assert service.plugin.bucketed_rows == 4
+    assert any("Length bucketing: 4 rows in" in str(message) for message in service.io_stream)
+
+
+def test_worker_pool_reads_prompt_files_in_the_workers(tmp_path):
+    """Workers get the paths of the prompt files, a file that cannot be read fails only its row."""
+    prompt_file = tmp_path / "prompt.txt"
+    prompt_file.write_text("hello")
+    paths = [str(prompt_file), str(tmp_path / "missing.txt")]
+    service = make_remote_plugin_service(promptFromFile="1")
+    service.plugin.worker_pool = InProcessWorkerPool()
+    result = service.plugin.process_rows_with_worker_pool(pd.Series(paths))
+
+    assert service.plugin.worker_pool.sent == paths
+    assert result["LLM Response"][0] == "HELLO" and pd.isna(result["LLM Response"][1])
+
+    service = make_remote_plugin_service(promptFromFile="1", onError="error")
+    service.plugin.worker_pool = InProcessWorkerPool()
+    with pytest.raises(LocalWorkerError, match="Error reading prompt file"):
+        service.plugin.process_rows_with_worker_pool(pd.Series(paths))
+
+
+def test_packed_rows_read_their_prompt_files(tmp_path, monkeypatch):
+    """Packs are formed from the file sizes, and each pack reads its own files when it is sent."""
+    paths = []
+    for name in ("a", "b", "c"):
+        (tmp_path / f"{name}.txt").write_text(f"prompt {name}")
+        paths.append(str(tmp_path / f"{name}.txt"))
+    paths.append(str(tmp_path / "missing.txt"))
+    answers = '[{"id": 1, "answer": "x"}, {"id": 2, "answer": "y"}, {"id": 3, "answer": "z"}]'
+    service = make_remote_plugin_service(promptFromFile="1", packRows="1", packSize="4", simulateResponseText=answers)
+    read = []
+    read_prompts = service.plugin.read_prompts
+    monkeypatch.setattr(service.plugin, "read_prompts", lambda paths: read.append(list(paths)) or read_prompts(paths))
+    service.run_on_record_batch(pa.RecordBatch.from_pandas(pd.DataFrame({"Prompt": paths})), Anchor("Input", "1"))
+
+    output = service.data_streams["Output"][0]
+    assert output.column("LLM Response").to_pylist() == ["x", "y", "z", None]
+    assert read == [paths]
+    assert service.plugin.packed_rows == 3
+
+
+def test_daemon_rows_with_unreadable_prompt_files_follow_on_error(tmp_path):
+    """A prompt file that cannot be read leaves its row empty instead of failing the daemon request."""
+
+    class FakeDaemon:
+        def chat(self, llama_kwargs, messages_list, params, grammar=None, cache=False):
+            self.sent = [messages[-1]["content"] for messages in messages_list]
+            return pa.table({
+                "content": [content.upper() for content in self.sent],
+                "prompt_tokens": pa.array([3] * len(self.sent), pa.int32()),
+                "completion_tokens": pa.array([1] * len(self.sent), pa.int32()),
+                "error": pa.array([None] * len(self.sent), pa.string()),
+            })
+
+    prompt_file = tmp_path / "prompt.txt"
+    prompt_file.write_text("hello")
+    service = make_remote_plugin_service(promptFromFile="1")
+    service.plugin.daemon = FakeDaemon()
+    result = service.plugin.process_rows_with_daemon(pd.Series([str(prompt_file), str(tmp_path / "missing.txt")]))
+
+    assert service.plugin.daemon.sent == ["hello"]
+    assert result["LLM Response"][0] == "HELLO" and pd.isna(result["LLM Response"][1])
+    assert result["cost($)"][0] == 0 and pd.isna(result["cost($)"][1])
+
+    service = make_remote_plugin_service(promptFromFile="1", onError="error")
+    service.plugin.daemon = FakeDaemon()
+    with pytest.raises(OSError):
+        service.plugin.process_rows_with_daemon(pd.Series([str(tmp_path / "missing.txt")]))
+
+
+def test_long_input_map_and_reduce_carry_the_task(monkeypatch):
+    """Every chunk of a long row and every request combining their answers carry the map instruction."""
+    import litellm
+    from backend.ayx_plugins import l_l_m_connect
+
+    sent = []
+
+    def record(**kwargs):
+        sent.append(kwargs["messages"][-1]["content"])
+        return litellm.completion(**kwargs)
+
+    monkeypatch.setattr(l_l_m_connect, "completion", record)
+    service = make_remote_plugin_service(
+        longInput="1", chunkTokens="50", chunkOverlap="0",
+        mapInstruction="List the cities named in the text.", reducePrompt="Merge the lists:\n{responses}",
+    )
+    service.run_on_record_batch(pa.RecordBatch.from_pandas(pd.DataFrame({"Prompt": ["Paris and Rome. " * 60, "Oslo."]})), Anchor("Input", "1"))
+
+    output = service.data_streams["Output"][0]
+    chunks = output.column("chunks").to_pylist()
+    assert chunks[0] > 1 and chunks[1] == 1
+    map_requests = [content for content in sent if not content.startswith("Task:")]
+    reduce_requests = [content for content in sent if content.startswith("Task:")]
+    assert len(map_requests) == sum(chunks)
+    assert all(content.startswith("List the cities named in the text.\n\n") for content in map_requests)
+    assert reduce_requests
+    assert all("List the cities named in the text." in content and "Merge the lists:" in content for content in reduce_requests)
+    assert output.column("LLM Response").to_pylist() == ["The response has been simulated."] * 2
+
+
 @pytest.mark.parametrize("anchor", [
      Anchor("Input", "1"),
 ])
@@ -0,0 +1,94 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from backend.ayx_plugins.local_worker_pool import LocalWorkerError, LocalWorkerPool, split_cpus
+
+
+class FakeLlama:
+    """Stands in for `llama_cpp.Llama` in the worker processes."""
+
+    def __init__(self, model_path, n_threads, **kwargs):
+        if not os.path.basename(model_path).endswith(".gguf"):
+            raise ValueError(f"Not a GGUF file: {model_path}")
+        self.n_threads = n_threads
+
+    def create_chat_completion(self, messages, **kwargs):
+        prompt = messages[-1]["content"]
+        if prompt == "fail":
+            raise ValueError("cannot answer")
+        if prompt == "slow":
+            time.sleep(1)
+        return {"content": prompt.upper(), "pid": os.getpid(), "n_threads": self.n_threads}
+
+
+def chat(prompt):
+    return {"messages": [{"role": "user", "content": prompt}]}
+
+
+def chat_from_file(path):
+    return dict(chat(""), prompt_file=(str(path), None))
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = LocalWorkerPool({"model_path": "model.gguf"}, 2, threads_per_worker=1, llama_class=FakeLlama)
+    yield pool
+    pool.close()
+
+
+def test_split_cpus_contiguous():
+    assert split_cpus(list(range(8)), 2) == [[0, 1, 2, 3], [4, 5, 6, 7]]
+
+
+def test_split_cpus_more_workers_than_cpus():
+    assert split_cpus([0, 1], 3) == [[0], [1], [0]]
+
+
+def test_split_cpus_remainder_goes_to_last_worker():
+    assert split_cpus(list(range(7)), 2) == [[0, 1, 2], [3, 4, 5, 6]]
+
+
+def test_map_returns_results_in_input_order(pool):
+    # The slow first row holds one worker while the other one answers the rest
+    results = pool.map([chat(prompt) for prompt in ["slow", "a", "b", "c"]])
+    assert [result["content"] for result in results] == ["SLOW", "A", "B", "C"]
+    assert len({result["pid"] for result in results}) == 2
+    assert all(result["n_threads"] == 1 for result in results)
+    assert pool.row_seconds[0] >= 1 > max(pool.row_seconds[1:])
+
+
+def test_failed_rows_are_returned_as_errors(pool):
+    results = pool.map([chat("a"), chat("fail"), chat("b")])
+    assert isinstance(results[1], LocalWorkerError) and "cannot answer" in str(results[1])
+    assert [results[0]["content"], results[2]["content"]] == ["A", "B"]
+    # The workers keep serving after a failed row
+    assert pool.map([chat("c")])[0]["content"] == "C"
+
+
+def test_workers_read_prompt_files(pool, tmp_path):
+    (tmp_path / "prompt.txt").write_text("from a file")
+    results = pool.map([chat_from_file(tmp_path / "prompt.txt"), chat_from_file(tmp_path / "missing.txt")])
+    assert results[0]["content"] == "FROM A FILE"
+    assert isinstance(results[1], LocalWorkerError) and "Error reading prompt file" in str(results[1])
+
+
+def test_close_stops_the_workers():
+    pool = LocalWorkerPool({"model_path": "model.gguf"}, 2, llama_class=FakeLlama)
+    processes = list(pool.processes)
+    pool.close()
+    assert pool.processes == []
+    assert not any(process.is_alive() for process in processes)
+
+
+def test_model_load_failure_stops_the_workers():
+    running = set(multiprocessing.active_children())
+    with pytest.raises(RuntimeError, match="failed to load the model"):
+        LocalWorkerPool({"model_path": "model.bin"}, 2, llama_class=FakeLlama)
+    assert set(multiprocessing.active_children()) <= running
@@ -0,0 +1,76 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+
+from backend.ayx_plugins.output_columns import StringColumnEncoder, float32_column, int32_column, set_columns, string_column
+
+
+def test_repeated_responses_are_dictionary_encoded():
+    column = string_column(["positive", "negative", "positive", None, "positive", "negative"])
+    assert pa.types.is_dictionary(column.type)
+    assert column.dictionary.to_pylist() == ["positive", "negative"]
+    assert column.to_pylist() == ["positive", "negative", "positive", None, "positive", "negative"]
+
+
+def test_distinct_responses_stay_plain_strings():
+    assert string_column(["a", "b", "c"]).type == pa.string()
+    assert string_column(["a", "a"], dictionary=False).type == pa.string()
+
+
+def test_encoding_is_decided_once_per_run():
+    batches = [["yes", "no", "yes", "yes"], ["a", "b", "c"], [None, None]]
+    encoder = StringColumnEncoder()
+    sink = pa.BufferOutputStream()
+    writer = None
+    for responses in batches:
+        table = pa.table({"LLM Response": encoder.encode(responses)})
+        # A stream only takes batches of its first schema
+        writer = writer or pa.ipc.new_stream(sink, table.schema)
+        writer.write_table(table)
+    writer.close()
+    result = pa.ipc.open_stream(sink.getvalue()).read_all()
+    assert pa.types.is_dictionary(result.schema.field("LLM Response").type)
+    assert result.column("LLM Response").to_pylist() == ["yes", "no", "yes", "yes", "a", "b", "c", None, None]
+
+    encoder = StringColumnEncoder(min_sample=3)
+    assert [encoder.encode(responses).type for responses in batches[1:] + batches[:1]] == [pa.string()] * 3
+    encoder = StringColumnEncoder(dictionary=False)
+    assert {encoder.encode(responses).type for responses in batches} == {pa.string()}
+
+
+def test_small_first_batches_do_not_decide_on_plain_strings():
+    encoder = StringColumnEncoder()
+    assert pa.types.is_dictionary(encoder.encode(["a", "b", "c"]).type)
+    assert pa.types.is_dictionary(encoder.encode(["yes", "no"] * 100).type)
+
+    encoder = StringColumnEncoder()
+    assert encoder.encode([f"answer {i}" for i in range(100)]).type == pa.string()
+    assert encoder.encode(["yes", "no"] * 100).type == pa.string()
+
+    encoder = StringColumnEncoder(closed_set=True)
+    assert pa.types.is_dictionary(encoder.encode([f"label {i}" for i in range(100)]).type)
+    assert StringColumnEncoder(dictionary=False, closed_set=True).encode(["a", "a"]).type == pa.string()
+
+
+def test_missing_responses_are_nulls():
+    assert string_column(pd.Series([float("nan"), float("nan")]), dictionary=False).to_pylist() == [None, None]
+
+
+def test_numeric_columns_are_compact():
+    tokens = int32_column([12, None, 3.0])
+    assert tokens.type == pa.int32()
+    assert tokens.to_pylist() == [12, None, 3]
+    costs = float32_column([0.5, None])
+    assert costs.type == pa.float32()
+    assert costs.to_pylist() == [0.5, None]
+
+
+def test_set_columns_replaces_existing_columns():
+    table = pa.table({"prompt": ["x"], "prompt_tokens": ["old"]})
+    table = set_columns(table, {"prompt_tokens": int32_column([1]), "cost($)": float32_column([0.25])})
+    assert table.column_names == ["prompt", "prompt_tokens", "cost($)"]
+    assert table.column("prompt_tokens").to_pylist() == [1]
@@ -0,0 +1,62 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import pytest
+
+from backend.ayx_plugins.packing import ITEM_OVERHEAD_TOKENS, allocate, pack_groups, pack_items, parse_packed_answers, split_cost, with_pack_instruction
+
+
+def test_items_are_numbered():
+    assert pack_items(["first", "second"]) == "[1] first\n\n[2] second"
+
+
+def test_instruction_joins_the_system_message():
+    messages = with_pack_instruction([{"role": "system", "content": "Classify."}, {"role": "user", "content": "[1] a"}], 3)
+    assert messages[0]["content"].startswith("Classify.\n\n") and "3 numbered items" in messages[0]["content"]
+    assert with_pack_instruction([{"role": "user", "content": "[1] a"}], 1)[0]["role"] == "system"
+
+
+def test_groups_respect_pack_size_and_prompt_budget():
+    assert pack_groups([5] * 5, max_items=2, input_budget=1000, answer_tokens=10, max_completion_tokens=1000) == [[0, 1], [2, 3], [4]]
+    # Two items fill the budget, a row longer than the budget stays alone
+    budget = 2 * (10 + ITEM_OVERHEAD_TOKENS)
+    assert pack_groups([10, 10, 10, 500, 10], max_items=10, input_budget=budget, answer_tokens=10, max_completion_tokens=1000) == [[0, 1], [2], [3], [4]]
+
+
+def test_groups_respect_max_completion_tokens():
+    answer_tokens = 16
+    groups = pack_groups([5] * 6, max_items=10, input_budget=1000, answer_tokens=answer_tokens, max_completion_tokens=3 * (answer_tokens + ITEM_OVERHEAD_TOKENS))
+    assert groups == [[0, 1, 2], [3, 4, 5]]
+    # Without room for two answers, every row is sent alone
+    assert pack_groups([5] * 3, max_items=10, input_budget=1000, answer_tokens=answer_tokens, max_completion_tokens=answer_tokens) == [[0], [1], [2]]
+
+
+def test_answers_matched_by_id():
+    text = '```json\n[{"id": 2, "answer": "b"}, {"id": 1, "answer": {"field": 1}}, {"id": 7, "answer": "x"}]\n```'
+    assert parse_packed_answers(text, 3) == ['{"field": 1}', "b", None]
+
+
+def test_duplicate_or_missing_answers_are_dropped():
+    text = '[{"id": 1, "answer": "a"}, {"id": 1, "answer": "b"}, {"id": "2", "answer": "c"}]'
+    assert parse_packed_answers(text, 3) == [None, "c", None]
+    assert parse_packed_answers("Sorry, I cannot help.", 2) == [None, None]
+    assert parse_packed_answers('[{"id": 1, "answer": "a"}, {"id": 2, "answ', 2) == [None, None]
+
+
+def test_plain_and_wrapped_arrays():
+    assert parse_packed_answers('["a", "b"]', 2) == ["a", "b"]
+    assert parse_packed_answers('["a"]', 2) == [None, None]
+    assert parse_packed_answers('{"answers": [{"id": 1, "answer": "a"}, {"id": 2, "answer": "b"}]}', 2) == ["a", "b"]
+
+
+def test_allocation_sums_to_total():
+    assert allocate(10, [1, 1, 1]) == [4, 3, 3]
+    assert allocate(7, [0, 0]) == [4, 3]
+    assert sum(allocate(101, [3, 50, 7, 11])) == 101
+
+
+def test_cost_split_by_priced_tokens():
+    costs = split_cost(0.3, [10, 10], [0, 10], prices=(1.0, 2.0))
+    assert costs == pytest.approx([0.075, 0.225])
+    assert split_cost(0.2, [0, 0], [0, 0]) == pytest.approx([0.1, 0.1])
@@ -0,0 +1,73 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import threading
+import time
+
+import pytest
+
+from backend.ayx_plugins.pipeline import OrderedPipeline
+
+
+def test_batches_are_emitted_in_arrival_order():
+    outputs = []
+
+    def process_row(row):
+        # The first batch finishes last
+        time.sleep(0.1 if row.startswith("a") else 0.0)
+        return row.upper()
+
+    pipeline = OrderedPipeline(process_row, lambda payload, results: outputs.append((payload, results)), workers=4)
+    pipeline.submit("first", ["a1", "a2"], 10)
+    pipeline.submit("second", ["b1"], 10)
+    assert outputs == []
+    pipeline.drain()
+    pipeline.close()
+    assert outputs == [("first", ["A1", "A2"]), ("second", ["B1"])]
+    assert pipeline.busy_seconds >= 0.1
+
+
+def test_rows_of_several_batches_are_in_flight_together():
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def process_row(row):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return row
+
+    pipeline = OrderedPipeline(process_row, lambda payload, results: None, workers=4)
+    for batch in range(4):
+        pipeline.submit(batch, [batch], 10)
+    pipeline.drain()
+    pipeline.close()
+    assert peak[0] == 4
+
+
+def test_memory_bound_waits_for_the_oldest_batches():
+    outputs = []
+    pipeline = OrderedPipeline(lambda row: row, lambda payload, results: outputs.append(payload), workers=2, max_bytes=100)
+    pipeline.submit("first", [1], 80)
+    pipeline.submit("second", [2], 80)
+    # Queuing the second batch exceeded the bound, the first one was written before returning
+    assert outputs[0] == "first"
+    assert pipeline.pending_bytes <= 100
+    pipeline.drain()
+    pipeline.close()
+    assert outputs == ["first", "second"]
+
+
+def test_row_errors_are_raised_when_the_batch_is_emitted():
+    def process_row(row):
+        raise RuntimeError("provider down")
+
+    pipeline = OrderedPipeline(process_row, lambda payload, results: None)
+    with pytest.raises(RuntimeError):
+        pipeline.submit("batch", ["x"], 10)
+        pipeline.drain()
+    pipeline.close()
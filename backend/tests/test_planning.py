@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import numpy as np
+
+from backend.ayx_plugins import planning
+from backend.ayx_plugins.planning import RunPlan, count_tokens, estimate_seconds, load_throughput, record_throughput
+
+
+def test_count_tokens_tokenizes_distinct_texts_in_batches():
+    batches = []
+
+    def encode_batch(texts):
+        batches.append(texts)
+        return [text.split() for text in texts]
+
+    counts = count_tokens(["a b", "c", "a b", None, "d e f"], encode_batch, batch_size=2)
+    assert counts.tolist() == [2, 1, 2, 0, 3]
+    assert batches == [["a b", "c"], ["d e f"]]
+
+
+def test_count_tokens_without_texts():
+    assert count_tokens([None], lambda texts: []).tolist() == [0]
+
+
+def test_throughput_history_keeps_latest_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(planning, "THROUGHPUT_HISTORY_RUNS", 2)
+    path = tmp_path / "throughput.json"
+    for seconds in (1.0, 2.0, 3.0):
+        record_throughput("key", 10, 100, 50, seconds, path=path)
+    record_throughput("other", 1, 1, 1, 1.0, path=path)
+    assert [run["seconds"] for run in load_throughput("key", path=path)] == [2.0, 3.0]
+    assert load_throughput("missing", path=path) == []
+
+
+def test_estimate_seconds_scales_with_rows_and_completion_tokens():
+    runs = [{"rows": 100, "prompt_tokens": 5000, "completion_tokens": 2000, "seconds": 50.0}]
+    assert estimate_seconds(runs, 200, 20) == (100.0, 100.0)
+    assert estimate_seconds(runs, 200, 40) == (100.0, 200.0)
+    assert estimate_seconds([], 200, 40) is None
+
+
+def test_run_plan_summary():
+    plan = RunPlan(10, prices=(0.001, 0.002))
+    plan.add(np.array([100, 300]), trimmed_rows=1)
+    assert plan.input_cost() == 0.4
+    assert plan.worst_case_cost() == 0.4 + 2 * 10 * 0.002
+    lines = plan.summary([])
+    assert lines[0].startswith("Plan: 2 rows, 400 prompt tokens (200 per row)")
+    assert "no previous run" in lines[-1]
+    assert "no price" in RunPlan(10).summary([])[1]
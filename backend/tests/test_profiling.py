@@ -0,0 +1,72 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import json
+import time
+
+import pytest
+
+from backend.ayx_plugins.profiling import RunProfiler
+
+
+def busy_work(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+
+def test_sampling_profiler_writes_flamegraph_files(tmp_path):
+    profiler = RunProfiler("sampling", str(tmp_path / "profile"), interval=0.001)
+    with profiler.batch(10):
+        busy_work(0.2)
+    paths = profiler.write()
+    profiler.close()
+
+    assert [Path(path).name for path in paths] == ["profile_memory.txt", "profile.collapsed", "profile.speedscope.json"]
+    collapsed = (tmp_path / "profile.collapsed").read_text().splitlines()
+    assert any(line.startswith("MainThread;") and "busy_work" in line for line in collapsed)
+    speedscope = json.loads((tmp_path / "profile.speedscope.json").read_text())
+    assert "MainThread" in [profile["name"] for profile in speedscope["profiles"]]
+    assert any(frame["name"].startswith("busy_work") for frame in speedscope["shared"]["frames"])
+
+
+def test_cprofile_with_memory_tracing(tmp_path):
+    profiler = RunProfiler("cprofile", str(tmp_path / "profile"), trace_memory=True)
+    for rows in (5, 7):
+        with profiler.batch(rows):
+            data = [bytes(1000) for _ in range(1000)]
+    paths = profiler.write()
+    profiler.close()
+
+    assert [figures["rows"] for figures in profiler.batches] == [5, 7]
+    assert all(figures["peak_traced"] >= 1000 * 1000 for figures in profiler.batches)
+    assert [Path(path).name for path in paths] == ["profile_memory.txt", "profile.pstats", "profile.collapsed", "profile.speedscope.json"]
+    report = (tmp_path / "profile_memory.txt").read_text()
+    assert report.startswith("Profile batch 1: 5 rows in")
+    assert "allocation sites" in report
+
+
+def test_cprofile_stacks_are_rebuilt_from_the_call_graph(tmp_path):
+    profiler = RunProfiler("cprofile", str(tmp_path / "profile"))
+    with profiler.batch(1):
+        busy_work(0.1)
+    with profiler.step("pipeline drain"):
+        busy_work(0.1)
+    profiler.write()
+    profiler.close()
+
+    assert profiler.batch_summary(profiler.batches[-1]).startswith("Profile pipeline drain: ")
+    stacks = dict(line.rsplit(" ", 1) for line in (tmp_path / "profile.collapsed").read_text().splitlines())
+    busy = [stack for stack in stacks if stack.startswith("MainThread;busy_work") and stack.endswith("<built-in method builtins.sum>")]
+    assert busy
+    # Weights are microseconds, most of the profiled time being spent under busy_work
+    assert sum(int(stacks[stack]) for stack in busy) > 0.05 * 1e6
+    speedscope = json.loads((tmp_path / "profile.speedscope.json").read_text())
+    assert [profile["name"] for profile in speedscope["profiles"]] == ["MainThread"]
+    assert 0.1 < speedscope["profiles"][0]["endValue"] < 1
+
+
+def test_unknown_profiler():
+    with pytest.raises(ValueError):
+        RunProfiler("perf", "profile")
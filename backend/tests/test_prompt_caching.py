@@ -0,0 +1,41 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from litellm import Usage
+
+from backend.ayx_plugins.prompt_caching import CACHE_CONTROL, cache_savings, cached_token_counts, needs_cache_control, with_cache_control
+
+
+def test_only_anthropic_models_need_markers():
+    assert needs_cache_control("claude-sonnet-4-5")
+    assert needs_cache_control("bedrock/anthropic.claude-3-5-sonnet-20240620-v1:0")
+    assert not needs_cache_control("gpt-4o-mini")
+    assert not needs_cache_control("not-a-provider/model")
+
+
+def test_the_last_system_message_is_marked():
+    messages = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hello"}]
+    marked = with_cache_control(messages)
+    assert marked[0] == {"role": "system", "content": [{"type": "text", "text": "Be brief.", "cache_control": CACHE_CONTROL}]}
+    assert marked[1] == messages[1]
+    # The input messages are left unchanged
+    assert messages[0]["content"] == "Be brief."
+
+
+def test_messages_without_system_prefix_are_unchanged():
+    messages = [{"role": "user", "content": "Hello"}]
+    assert with_cache_control(messages) == messages
+
+
+def test_cached_token_counts():
+    usage = Usage(prompt_tokens=2000, completion_tokens=10, total_tokens=2010, prompt_tokens_details={"cached_tokens": 1500})
+    assert cached_token_counts(usage) == (1500, 0)
+    assert cached_token_counts(Usage(prompt_tokens=5, completion_tokens=1, total_tokens=6)) == (0, 0)
+
+
+def test_cache_savings():
+    # gpt-4o-mini reads cached tokens at half the input price
+    assert abs(cache_savings("gpt-4o-mini", 1000) - 1000 * 0.075e-6) < 1e-12
+    assert cache_savings("gpt-4o-mini", 0) == 0
+    assert cache_savings("unknown-model", 1000) == 0
@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import pytest
+
+from backend.ayx_plugins.prompt_files import estimate_file_tokens, read_prompt_file, truncate_tokens
+
+
+def test_whole_file_is_read(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("Résumé of the quarter.\nRevenue grew.", encoding="utf-8")
+    assert read_prompt_file(str(path)) == "Résumé of the quarter.\nRevenue grew."
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_bytes(b"")
+    assert read_prompt_file(str(path)) == ""
+
+
+def test_missing_file_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        read_prompt_file(str(tmp_path / "missing.txt"))
+
+
+def test_first_tokens_without_tokenizer(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("é" * 1000, encoding="utf-8")
+    # 4 characters per token, and no replacement character for a multi-byte character cut by the read
+    assert read_prompt_file(str(path), max_tokens=10) == "é" * 40
+
+
+def test_first_tokens_with_tokenizer(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text(" ".join(f"word{i}" for i in range(1000)), encoding="utf-8")
+    codec = (lambda text: text.split(" "), lambda tokens: " ".join(tokens))
+    assert read_prompt_file(str(path), max_tokens=3, codec=codec) == "word0 word1 word2"
+
+
+def test_failing_tokenizer_falls_back_to_characters():
+    def encode(text):
+        raise RuntimeError("no tokenizer")
+
+    assert truncate_tokens("abcdefghij", 2, (encode, None)) == "abcdefgh"
+
+
+def test_estimate_from_file_size(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("x" * 400)
+    assert estimate_file_tokens(str(path)) == 101
+    assert estimate_file_tokens(str(path), max_tokens=50) == 50
+    assert estimate_file_tokens(str(tmp_path / "missing.txt")) == 0
@@ -0,0 +1,81 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import litellm
+import pytest
+
+from backend.ayx_plugins.retry_policy import (
+    AUTH, CONTEXT_OVERFLOW, RATE_LIMIT, SERVER_ERROR, TIMEOUT,
+    CircuitBreaker, CircuitOpenError, RetryPolicy, RetryRule, classify_error,
+)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def failing(errors):
+    """Return a callable raising the given errors in turn, then returning 'ok'."""
+    errors = list(errors)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+    fn.calls = calls
+    return fn
+
+
+@pytest.mark.parametrize("error, expected", [
+    (litellm.RateLimitError("slow down", "openai", "gpt-4o"), RATE_LIMIT),
+    (litellm.Timeout("timed out", "gpt-4o", "openai"), TIMEOUT),
+    (litellm.AuthenticationError("bad key", "openai", "gpt-4o"), AUTH),
+    (litellm.ContextWindowExceededError("too long", "gpt-4o", "openai"), CONTEXT_OVERFLOW),
+    (StatusError(503), SERVER_ERROR),
+    (StatusError(429), RATE_LIMIT),
+])
+def test_classify_error(error, expected):
+    assert classify_error(error) == expected
+
+
+def test_transient_errors_are_retried():
+    policy = RetryPolicy(rules={SERVER_ERROR: RetryRule(3, 0.0, 0.0)})
+    fn = failing([StatusError(500), StatusError(502)])
+    assert policy.call(fn) == "ok"
+    assert len(fn.calls) == 3
+
+
+def test_auth_errors_fail_fast():
+    policy = RetryPolicy()
+    fn = failing([StatusError(401)])
+    with pytest.raises(StatusError):
+        policy.call(fn)
+    assert len(fn.calls) == 1
+
+
+def test_num_retries_caps_every_class():
+    policy = RetryPolicy(rules={SERVER_ERROR: RetryRule(5, 0.0, 0.0)}, max_retries=1)
+    fn = failing([StatusError(500)] * 3)
+    with pytest.raises(StatusError):
+        policy.call(fn)
+    assert len(fn.calls) == 2
+
+
+def test_circuit_breaker_opens_and_fails_fast():
+    opened = []
+    breaker = CircuitBreaker(error_rate=50.0, window=4, on_open=opened.append)
+    policy = RetryPolicy(breaker=breaker)
+    for _ in range(4):
+        with pytest.raises(StatusError):
+            policy.call(failing([StatusError(400)]))
+    assert breaker.is_open and opened == [breaker]
+
+    fn = failing([])
+    with pytest.raises(CircuitOpenError):
+        policy.call(fn)
+    assert fn.calls == []
@@ -0,0 +1,23 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.ayx_plugins.scheduling import estimate_tokens, longest_first, makespan
+
+
+def test_longest_first():
+    assert longest_first([1, 3, 2]) == [1, 2, 0]
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("a" * 40) == 11
+    assert estimate_tokens(None) == 0
+
+
+def test_makespan_of_an_order():
+    seconds = [1, 1, 1, 1, 4]
+    # In input order the long row starts last and the other worker idles
+    assert makespan(seconds, 2) == 6
+    assert makespan(seconds, 2, longest_first(seconds)) == 4
+    assert makespan(seconds, 8) == 4
+    assert makespan([], 2) == 0
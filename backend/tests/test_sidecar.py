@@ -0,0 +1,64 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+import pytest
+
+from backend.ayx_plugins.output_columns import string_column
+from backend.ayx_plugins.sidecar import ARROW_FORMAT, PARQUET_FORMAT, SidecarWriter, key_table, row_status, sidecar_format
+
+
+def output_batch(responses, start):
+    return pa.table({
+        "row_id": pa.array(range(start, start + len(responses)), type=pa.int64()),
+        "LLM Response": string_column(responses),
+    })
+
+
+def test_format_from_extension():
+    assert sidecar_format("out/results.parquet") == PARQUET_FORMAT
+    assert sidecar_format("out/results.arrows") == ARROW_FORMAT
+    assert sidecar_format("out/results.bin", ARROW_FORMAT) == ARROW_FORMAT
+    with pytest.raises(ValueError):
+        sidecar_format("out/results.bin", "csv")
+
+
+def test_parquet_rows_are_written_in_full_row_groups(tmp_path):
+    path = tmp_path / "results.parquet"
+    writer = SidecarWriter(str(path), PARQUET_FORMAT, row_group_rows=4)
+    # The first batch is dictionary-encoded, the second is not
+    writer.write(output_batch(["yes", "yes", "no", "yes", "no", "no"], 0))
+    writer.write(output_batch(["a", "b", "c"], 6))
+    assert writer.buffered_rows == 1
+    writer.close()
+
+    parquet = pq.ParquetFile(path)
+    assert [parquet.metadata.row_group(i).num_rows for i in range(parquet.num_row_groups)] == [4, 4, 1]
+    assert parquet.metadata.row_group(0).column(1).compression == "ZSTD"
+    table = parquet.read()
+    assert table.column("row_id").to_pylist() == list(range(9))
+    assert table.column("LLM Response").to_pylist() == ["yes", "yes", "no", "yes", "no", "no", "a", "b", "c"]
+
+
+def test_arrow_stream(tmp_path):
+    path = tmp_path / "results.arrows"
+    writer = SidecarWriter(str(path), ARROW_FORMAT, compression="lz4")
+    writer.write(output_batch(["yes", "yes", "yes"], 0))
+    writer.write(output_batch(["a", None], 3))
+    writer.close()
+    with pa.ipc.open_stream(path) as reader:
+        table = reader.read_all()
+    assert table.schema.field("LLM Response").type == pa.string()
+    assert table.column("LLM Response").to_pylist() == ["yes", "yes", "yes", "a", None]
+
+
+def test_key_table_keeps_row_id_keys_and_status():
+    table = output_batch(["a", None], 0)
+    table = table.add_column(1, "customer", pa.array(["c1", "c2"]))
+    table = table.append_column("status", row_status(table.column("LLM Response")))
+    keys = key_table(table, ["customer"])
+    assert keys.column_names == ["row_id", "customer", "status"]
+    assert keys.column("status").to_pylist() == ["ok", "error"]
@@ -0,0 +1,141 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+import base64
+import ctypes
+import types
+
+import numpy as np
+import pytest
+
+from backend.ayx_plugins.vision import ImageEncodingCache, ImagePreprocessor, _CachingMtmd, create_vision_handler
+
+
+class FakeMtmd:
+    MTMD_INPUT_CHUNK_TYPE_TEXT = 0
+    MTMD_INPUT_CHUNK_TYPE_IMAGE = 1
+
+    def __init__(self):
+        self.encoded = 0
+        self.decoded = []
+        self.output = (ctypes.c_float * 6)(*range(6))
+
+    def mtmd_input_chunk_get_id(self, chunk):
+        return chunk["id"]
+
+    def mtmd_input_chunk_get_type(self, chunk):
+        return chunk["type"]
+
+    def mtmd_input_chunk_get_n_tokens(self, chunk):
+        return 3
+
+    def mtmd_encode_chunk(self, ctx, chunk):
+        self.encoded += 1
+        return 0
+
+    def mtmd_get_output_embd(self, ctx):
+        return ctypes.cast(self.output, ctypes.POINTER(ctypes.c_float))
+
+    def mtmd_helper_decode_image_chunk(self, ctx, lctx, chunk, embd, n_past, seq_id, n_batch, new_n_past):
+        self.decoded.append([embd[i] for i in range(6)])
+        return 0
+
+
+class FakeLlamaCpp:
+    @staticmethod
+    def llama_get_model(lctx):
+        return None
+
+    @staticmethod
+    def llama_model_n_embd_inp(model):
+        return 2
+
+
+def test_image_preprocessor_prepares_each_image_once(tmp_path):
+    image_path = tmp_path / "image.png"
+    image_path.write_bytes(b"not really a png")
+    preprocessor = ImagePreprocessor()
+    try:
+        first = preprocessor.prefetch(str(image_path))
+        assert preprocessor.prefetch(str(image_path)) is first
+        assert preprocessor.prefetch(b"not really a png") is not first
+    finally:
+        preprocessor.close()
+
+
+def test_image_encoding_cache_evicts_least_recently_used():
+    cache = ImageEncodingCache(max_bytes=2 * 4 * 4)
+    cache.put(b"a", np.zeros(4, dtype=np.float32))
+    cache.put(b"b", np.zeros(4, dtype=np.float32))
+    cache.get(b"a")
+    cache.put(b"c", np.zeros(4, dtype=np.float32))
+    assert list(cache.entries) == [b"a", b"c"]
+
+
+def test_image_chunk_is_encoded_once_per_image():
+    mtmd = FakeMtmd()
+    caching = _CachingMtmd(mtmd, FakeLlamaCpp, ImageEncodingCache())
+    chunk = {"id": b"hash", "type": FakeMtmd.MTMD_INPUT_CHUNK_TYPE_IMAGE}
+
+    for _ in range(3):
+        assert caching.mtmd_helper_eval_chunk_single(None, None, chunk, 0, 0, 512, False, None) == 0
+
+    assert mtmd.encoded == 1
+    assert mtmd.decoded == [[0.0, 1.0, 2.0, 3.0, 4.0, 5.0]] * 3
+    assert caching.MTMD_INPUT_CHUNK_TYPE_TEXT == 0
+
+
+class FakeChatHandler:
+    def __init__(self, clip_model_path, verbose=False):
+        self.clip_model_path = clip_model_path
+        self._mtmd_cpp = FakeMtmd()
+
+    def _create_bitmap_from_bytes(self, image_bytes):
+        return image_bytes
+
+
+class OlderChatHandler:
+    def __init__(self, clip_model_path, verbose=False):
+        self.clip_model_path = clip_model_path
+
+
+@pytest.fixture
+def fake_llama_cpp(monkeypatch):
+    """Install a llama_cpp package whose handlers and mtmd module are fakes."""
+    mtmd_cpp = types.ModuleType("llama_cpp.mtmd_cpp")
+    for name in dir(FakeMtmd):
+        if name.startswith("mtmd") or name.startswith("MTMD"):
+            setattr(mtmd_cpp, name, getattr(FakeMtmd, name))
+    mtmd_cpp.mtmd_bitmap_set_id = mtmd_cpp.mtmd_helper_eval_chunk_single = lambda *args: 0
+    llama_chat_format = types.SimpleNamespace(FakeChatHandler=FakeChatHandler, OlderChatHandler=OlderChatHandler)
+    package = types.SimpleNamespace(llama_cpp=FakeLlamaCpp, llama_chat_format=llama_chat_format, mtmd_cpp=mtmd_cpp)
+    monkeypatch.setitem(sys.modules, "llama_cpp", package)
+    monkeypatch.setitem(sys.modules, "llama_cpp.llama_cpp", FakeLlamaCpp)
+    monkeypatch.setitem(sys.modules, "llama_cpp.llama_chat_format", llama_chat_format)
+    monkeypatch.setitem(sys.modules, "llama_cpp.mtmd_cpp", mtmd_cpp)
+    return mtmd_cpp
+
+
+def test_vision_handler_caches_encodings(fake_llama_cpp):
+    warnings = []
+    handler = create_vision_handler("FakeChatHandler", "clip.gguf", ImageEncodingCache(), on_warning=warnings.append)
+    assert isinstance(handler, FakeChatHandler) and isinstance(handler._mtmd_cpp, _CachingMtmd)
+    assert warnings == []
+
+
+def test_vision_handler_without_cache_hooks_is_plain(fake_llama_cpp, monkeypatch):
+    warnings = []
+    handler = create_vision_handler("OlderChatHandler", "clip.gguf", ImageEncodingCache(), on_warning=warnings.append)
+    assert type(handler) is OlderChatHandler
+    assert "OlderChatHandler._create_bitmap_from_bytes" in warnings[0]
+
+    # A handler that does not hold the mtmd module is left as the plain handler
+    monkeypatch.setattr(FakeChatHandler, "__init__", OlderChatHandler.__init__)
+    handler = create_vision_handler("FakeChatHandler", "clip.gguf", ImageEncodingCache(), on_warning=warnings.append)
+    assert type(handler) is FakeChatHandler
+    assert "FakeChatHandler._mtmd_cpp" in warnings[1]
+
+    monkeypatch.delattr(fake_llama_cpp, "mtmd_helper_decode_image_chunk")
+    create_vision_handler("FakeChatHandler", "clip.gguf", ImageEncodingCache(), on_warning=warnings.append)
+    assert "mtmd_cpp.mtmd_helper_decode_image_chunk" in warnings[2]